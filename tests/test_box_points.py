@@ -0,0 +1,15 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from box_points import count_points_in_boxes
+
+
+def test_nan_points_are_ignored():
+    rng = np.random.default_rng(0)
+    inside = rng.uniform(-0.9, 0.9, (65, 3)).astype(np.float32)
+    outside = rng.uniform(20, 30, (40, 3)).astype(np.float32)
+    xyz = np.concatenate([inside, outside, np.full((1, 3), np.nan, dtype=np.float32)])
+    boxes = np.array([[0, 0, 0, 2, 2, 2, 0], [-50, -50, 0, 2, 2, 2, 0]], dtype=np.float64)
+    assert count_points_in_boxes(xyz, boxes).tolist() == [65, 0]
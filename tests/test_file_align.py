@@ -0,0 +1,16 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from file_align import transfer_files
+
+
+def test_same_destination_written_once_by_last_source(tmp_path):
+    pairs = []
+    for i in range(8):
+        src = tmp_path / f"1700000000{i:09d}.pcd"
+        src.write_bytes(bytes([i]) * 65536)
+        pairs.append((str(src), str(tmp_path / "1700000000.pcd")))
+    summary = transfer_files(pairs, mode="copy", threads=8)
+    assert summary["copy"][0] == 1
+    assert (tmp_path / "1700000000.pcd").read_bytes() == bytes([7]) * 65536
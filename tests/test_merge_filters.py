@@ -0,0 +1,24 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from merge_pcd import filter_points
+
+
+def nan_cloud():
+    points = np.zeros(5, dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4')])
+    points['x'] = [0.0, 0.01, 1.0, np.nan, 2.0]
+    return points
+
+
+def test_voxel_downsample_drops_nan_points():
+    out = filter_points(nan_cloud(), voxel_size=0.5)
+    assert len(out) == 3
+    assert np.isfinite(out['x']).all()
+
+
+def test_ego_box_drops_nan_points():
+    out = filter_points(nan_cloud(), ego_box=[5, 5, 5, 6, 6, 6])
+    assert len(out) == 4
+    assert np.isfinite(out['x']).all()
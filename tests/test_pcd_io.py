@@ -0,0 +1,19 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from pcd_io import read_pcd, write_pcd
+
+
+@pytest.mark.parametrize('count', [0, 5])
+def test_binary_compressed_round_trip(tmp_path, count):
+    pytest.importorskip('lzf')
+    points = np.zeros(count, dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4')])
+    points['x'] = np.arange(count)
+    path = str(tmp_path / 'cloud.pcd')
+    write_pcd(path, points, 'binary_compressed')
+    loaded = read_pcd(path)
+    assert len(loaded) == count
+    np.testing.assert_array_equal(loaded['x'], points['x'])
@@ -0,0 +1,50 @@
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from point_store import PointStore, PointStoreWriter
+
+
+def sample_points():
+    points = np.zeros(3, dtype=[('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4'), ('timestamp', '<f8')])
+    points['x'] = [1.234, -50.0, 100.0]
+    points['intensity'] = [0.0, 255.0, 4000.0]
+    points['timestamp'] = 1700000000.0 + np.array([0.0, 0.05, 0.099])
+    return points
+
+
+def test_int16_store_only_quantizes_xyz(tmp_path):
+    writer = PointStoreWriter(str(tmp_path), ('x', 'y', 'z', 'intensity', 'timestamp'), 'int16')
+    writer.append(1, sample_points())
+    writer.close()
+    store = PointStore(str(tmp_path))
+    assert store.fields == ('x', 'y', 'z')
+    assert store.attribute_fields == ('intensity', 'timestamp')
+    assert store.frame(1).dtype == np.int16
+    points = sample_points()
+    np.testing.assert_allclose(store.frame_attributes(1)[:, 0], points['intensity'])
+    np.testing.assert_array_equal(store.frame_attributes(1)[:, 1], points['timestamp'])
+    full = store.frame(1, dequantize=True)
+    np.testing.assert_allclose(full[:, 0], points['x'], atol=0.005)
+
+
+def test_float32_store_keeps_float64_timestamps(tmp_path):
+    writer = PointStoreWriter(str(tmp_path), ('x', 'y', 'z', 'intensity', 'timestamp'), 'float32')
+    writer.append(1, sample_points())
+    writer.close()
+    store = PointStore(str(tmp_path))
+    assert store.fields == ('x', 'y', 'z')
+    assert store.frame(1).dtype == np.float32
+    np.testing.assert_array_equal(store.frame_attributes(1)[:, 1], sample_points()['timestamp'])
+    np.testing.assert_allclose(np.diff(store.frame(1, dequantize=True)[:, 4]), [0.05, 0.049], atol=1e-6)
+
+
+def test_xyz_only_store_has_no_attributes(tmp_path):
+    writer = PointStoreWriter(str(tmp_path), ('x', 'y', 'z'), 'float32')
+    writer.append(1, sample_points())
+    writer.close()
+    store = PointStore(str(tmp_path))
+    assert store.frame(1).shape == (3, 3)
+    assert store.frame_attributes(1) is None
+    assert not os.path.exists(os.path.join(str(tmp_path), 'attributes.bin'))
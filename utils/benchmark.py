@@ -0,0 +1,229 @@
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import subprocess
+from datetime import datetime
+
+UTILS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, UTILS_DIR)
+from calibration import LIDARS, CAMERAS, MAIN_LIDAR
+from keyframes import KEYFRAME_CAMERA
+
+# 可测试的阶段及其输入目录（用于计算 MB/秒），按列出的顺序运行，check 依赖 merge 和 labels 的结果
+STAGE_INPUTS = {
+    'keyframes': [KEYFRAME_CAMERA, MAIN_LIDAR],
+    'merge': LIDARS,
+    'undistort': CAMERAS,
+    'labels': [],
+    'check': ["labels", "lidar_point_cloud_0"],
+}
+DEFAULT_RESULTS_DIR = "benchmark_results"
+
+
+def dir_bytes(path):
+    if not os.path.isdir(path):
+        return 0
+    with os.scandir(path) as entries:
+        return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+
+def stage_input_bytes(stage, scene_dir):
+    """阶段读取的输入数据量，labels 阶段为所有标注导出目录"""
+    if stage == 'labels':
+        from extract_label import find_exports
+        return sum(dir_bytes(d) for d in find_exports(scene_dir))
+    return sum(dir_bytes(os.path.join(scene_dir, d)) for d in STAGE_INPUTS[stage])
+
+
+def clear_caches(stage, scene_dir):
+    """删除阶段会复用的磁盘缓存：标定解析缓存、去畸变映射表缓存和关键帧签名缓存"""
+    import shutil
+    from calibration import CACHE_DIR
+    caches = [CACHE_DIR]
+    if stage == 'undistort':
+        from undistort import MAP_CACHE_DIR
+        caches.append(MAP_CACHE_DIR)
+    elif stage == 'keyframes':
+        from keyframes import SIGNATURE_DIR
+        caches.append(os.path.join(scene_dir, SIGNATURE_DIR))
+    for path in caches:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def run_stage(stage, scene_dir, workers):
+    """在当前进程中运行一个阶段（忽略构建记录），返回失败数"""
+    if stage == 'keyframes':
+        from keyframes import select_scene_keyframes
+        select_scene_keyframes(scene_dir, workers=workers)
+        return 0
+    if stage == 'merge':
+        from merge_pcd import merge_scene
+        return len(merge_scene(scene_dir, workers=workers, force=True))
+    if stage == 'undistort':
+        from undistort import undistort_scene
+        return len(undistort_scene(scene_dir, workers=workers, force=True))
+    if stage == 'labels':
+        from extract_label import extract_scene_labels
+        return len(extract_scene_labels(scene_dir, force=True, workers=workers))
+    from check_label import check_scene
+    check_scene(scene_dir, verbose=False, points=True, workers=workers)
+    return 0
+
+
+def measure(stage, scene_dir, workers, out_path):
+    """子进程入口：清除缓存后冷启动运行一个阶段，并把耗时、数据量和内存峰值写入 out_path"""
+    from merge_pcd import list_timestamps
+    frames = len(list_timestamps(scene_dir))
+    input_bytes = stage_input_bytes(stage, scene_dir)
+    # 清除缓存不计入耗时，之后的运行与首次处理一样需要重新解析标定、生成映射表和签名
+    clear_caches(stage, scene_dir)
+    start = time.perf_counter()
+    failures = run_stage(stage, scene_dir, workers)
+    elapsed = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位为 KB，子进程为所有已结束子进程中的最大值
+    result = {
+        'elapsed': elapsed,
+        'frames': frames,
+        'input_bytes': input_bytes,
+        'failures': failures,
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        'peak_child_rss_mb': resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024,
+    }
+    with open(out_path, 'w') as f:
+        json.dump(result, f)
+
+
+def benchmark_once(root, scene, stage, workers, log):
+    """在独立的子进程中运行一个阶段，保证每次测得的内存峰值互不影响"""
+    out_path = os.path.join(root, f".benchmark_{stage}_{workers}.json")
+    command = [sys.executable, os.path.abspath(__file__), '--measure', stage, '--scene', scene,
+               '--workers', str(workers), '--out', out_path]
+    start = time.perf_counter()
+    proc = subprocess.run(command, cwd=root, stdout=log, stderr=subprocess.PIPE, text=True)
+    record = {'stage': stage, 'workers': workers}
+    if proc.returncode != 0 or not os.path.exists(out_path):
+        record['error'] = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"退出码 {proc.returncode}"
+        record['elapsed'] = time.perf_counter() - start
+        return record
+    with open(out_path, 'r') as f:
+        record.update(json.load(f))
+    os.remove(out_path)
+    elapsed = max(record['elapsed'], 1e-9)
+    record['frames_per_s'] = record['frames'] / elapsed
+    record['mb_per_s'] = record['input_bytes'] / 2**20 / elapsed
+    return record
+
+
+def host_info():
+    import numpy as np
+    info = {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__}
+    try:
+        import cv2
+        info['opencv'] = cv2.__version__
+    except ImportError:
+        pass
+    return info
+
+
+def print_table(records, baseline=None):
+    """打印结果表，指定 baseline 时附加与之前结果相比的加速比"""
+    previous = {(r['stage'], r['workers']): r for r in (baseline or {}).get('results', []) if 'error' not in r}
+    print(f"\n{'阶段':<10} {'进程':>4} {'耗时(s)':>9} {'帧/秒':>8} {'MB/秒':>8} {'峰值RSS(MB)':>12} {'子进程峰值':>10}"
+          + (f" {'加速比':>7}" if baseline else ""))
+    for r in records:
+        if 'error' in r:
+            print(f"{r['stage']:<10} {r['workers']:>4} 失败: {r['error']}")
+            continue
+        line = (f"{r['stage']:<10} {r['workers']:>4} {r['elapsed']:>9.2f} {r['frames_per_s']:>8.2f} "
+                f"{r['mb_per_s']:>8.1f} {r['peak_rss_mb']:>12.0f} {r['peak_child_rss_mb']:>10.0f}")
+        old = previous.get((r['stage'], r['workers']))
+        if old is not None:
+            line += f" {old['elapsed'] / max(r['elapsed'], 1e-9):>7.2f}x"
+        print(line)
+
+
+def run_benchmark(root, scene, stages, workers_list, repeat=1, output=None, baseline=None):
+    """按阶段和进程数依次运行基准测试，结果保存为 JSON，返回结果字典"""
+    from merge_pcd import list_timestamps
+    root = os.path.abspath(root)
+    scene_dir = os.path.join(root, scene)
+    scene_info = {'frames': len(list_timestamps(scene_dir)),
+                  'input_mb': {stage: stage_input_bytes(stage, scene_dir) / 2**20 for stage in STAGE_INPUTS}}
+    records = []
+    log_path = os.path.join(root, "benchmark.log")
+    with open(log_path, 'w') as log:
+        for stage in stages:
+            for workers in workers_list:
+                for i in range(repeat):
+                    record = benchmark_once(root, scene, stage, workers, log)
+                    record['repeat'] = i
+                    records.append(record)
+                    status = record.get('error') or f"{record['elapsed']:.2f} 秒"
+                    print(f"{stage} workers={workers} 第 {i + 1}/{repeat} 次: {status}")
+
+    results = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'host': host_info(),
+        'root': root,
+        'scene': scene,
+        'scene_info': scene_info,
+        'results': records,
+    }
+    if output is None:
+        output = os.path.join(DEFAULT_RESULTS_DIR, f"benchmark_{datetime.now():%Y%m%d_%H%M%S}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
+
+    baseline_results = None
+    if baseline:
+        with open(baseline, 'r') as f:
+            baseline_results = json.load(f)
+    print_table(records, baseline_results)
+    print(f"\n结果已保存到 {output}，各阶段的输出日志在 {log_path}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在合成场景上测试各处理阶段的吞吐量和内存峰值")
+    parser.add_argument('--root', type=str, default='benchmark_data', help='合成数据目录，默认为 benchmark_data')
+    parser.add_argument('--scene', type=str, default='scene_1', help='场景名，默认为 scene_1')
+    parser.add_argument('--generate', action='store_true', help='先生成合成场景（目录已存在时覆盖同名文件）')
+    parser.add_argument('--frames', type=int, default=10, help='生成的帧数，默认为 10')
+    parser.add_argument('--points', type=int, default=120000, help='生成的 LIDAR_TOP_32 每帧点数，默认为 120000')
+    parser.add_argument('--objects', type=int, default=20, help='生成的每帧标注框数量，默认为 20')
+    parser.add_argument('--stages', type=str, default=','.join(STAGE_INPUTS),
+                        help=f'要测试的阶段，逗号分隔，默认为 {",".join(STAGE_INPUTS)}')
+    parser.add_argument('--workers', type=str, default='1',
+                        help='要测试的进程数，逗号分隔，例如 1,4,8，默认为 1')
+    parser.add_argument('--repeat', type=int, default=1, help='每种配置重复运行的次数，默认为 1')
+    parser.add_argument('--output', type=str, default=None,
+                        help=f'结果 JSON 路径，默认为 {DEFAULT_RESULTS_DIR}/benchmark_<时间>.json')
+    parser.add_argument('--baseline', type=str, default=None, help='之前保存的结果 JSON，用于打印加速比')
+    # 以下参数供内部子进程使用
+    parser.add_argument('--measure', type=str, choices=list(STAGE_INPUTS), default=None, help=argparse.SUPPRESS)
+    parser.add_argument('--out', type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.scene, int(args.workers), args.out)
+        return
+
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGE_INPUTS]
+    if unknown:
+        parser.error(f"未知的阶段: {', '.join(unknown)}，可选 {', '.join(STAGE_INPUTS)}")
+    if args.generate or not os.path.isdir(os.path.join(args.root, args.scene)):
+        from synthetic_scene import generate_scene
+        generate_scene(args.root, args.scene, args.frames, args.points, args.objects, workers=os.cpu_count() or 1)
+    workers_list = [int(w) for w in args.workers.split(',')]
+    run_benchmark(args.root, args.scene, stages, workers_list, args.repeat, args.output, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
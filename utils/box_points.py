@@ -0,0 +1,71 @@
+import numpy as np
+from pcd_io import read_pcd, points_xyz
+
+# 体素哈希在 xy 平面上的网格边长（米）
+CELL_SIZE = 2.0
+
+
+def build_grid(xyz, cell_size=CELL_SIZE):
+    """按 xy 网格对点排序，返回 (排序后的点, 排序后的网格键, 网格原点, 网格列数, 网格行数)
+
+    网格键为 ix * ny + iy，同一列中相邻的网格在排序后的数组中是连续的一段。
+    """
+    cells = np.floor(xyz[:, :2] / cell_size).astype(np.int64)
+    origin = cells.min(axis=0)
+    cells -= origin
+    nx, ny = cells.max(axis=0) + 1
+    keys = cells[:, 0] * ny + cells[:, 1]
+    order = np.argsort(keys, kind='stable')
+    return xyz[order], keys[order], origin, nx, ny
+
+
+def count_points_in_boxes(xyz, boxes, cell_size=CELL_SIZE):
+    """统计每个旋转 3D 框 (x y z dx dy dz yaw) 内的点数，数值无效的框计为 -1
+
+    先用 xy 网格取出框外接圆覆盖的网格中的候选点，再把候选点变换到框坐标系中做向量化判断，
+    避免对每个框遍历整帧点云。
+    """
+    counts = np.zeros(len(boxes), dtype=np.int64)
+    if len(boxes) == 0:
+        return counts
+    valid = np.isfinite(boxes).all(axis=1)
+    counts[~valid] = -1
+    # 雷达无回波的点坐标为 NaN，取整后会使网格原点和尺寸溢出，先去掉
+    xyz = xyz[np.isfinite(xyz).all(axis=1)]
+    if len(xyz) == 0:
+        return counts
+
+    points, keys, origin, nx, ny = build_grid(xyz, cell_size)
+    for i in np.flatnonzero(valid):
+        x, y, z, dx, dy, dz, yaw = (float(v) for v in boxes[i])
+        r = 0.5 * np.hypot(dx, dy)
+        ix0, iy0 = np.floor((np.array([x - r, y - r]) / cell_size)).astype(np.int64) - origin
+        ix1, iy1 = np.floor((np.array([x + r, y + r]) / cell_size)).astype(np.int64) - origin
+        ix0, iy0 = max(ix0, 0), max(iy0, 0)
+        ix1, iy1 = min(ix1, nx - 1), min(iy1, ny - 1)
+        if ix0 > ix1 or iy0 > iy1:
+            continue
+        columns = np.arange(ix0, ix1 + 1) * ny
+        starts = np.searchsorted(keys, columns + iy0, 'left')
+        ends = np.searchsorted(keys, columns + iy1, 'right')
+        candidates = np.concatenate([points[s:e] for s, e in zip(starts, ends)])
+        if len(candidates) == 0:
+            continue
+
+        # 变换到框坐标系（绕 z 轴旋转 -yaw）后与半尺寸比较
+        offset = candidates - np.array([x, y, z], dtype=candidates.dtype)
+        c, s = np.cos(yaw), np.sin(yaw)
+        local_x = offset[:, 0] * c + offset[:, 1] * s
+        local_y = offset[:, 1] * c - offset[:, 0] * s
+        inside = (np.abs(local_x) <= dx / 2) & (np.abs(local_y) <= dy / 2) & (np.abs(offset[:, 2]) <= dz / 2)
+        counts[i] = np.count_nonzero(inside)
+    return counts
+
+
+def count_frame_points(job):
+    """进程池任务，job 为 (点云路径, 框数组)，返回 (框内点数, 错误信息)"""
+    pcd_path, boxes = job
+    try:
+        return count_points_in_boxes(points_xyz(read_pcd(pcd_path, mmap=True)), boxes), None
+    except Exception as e:
+        return None, str(e)
@@ -0,0 +1,179 @@
+import os
+import json
+import pickle
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pcd_io import read_pcd_header
+from label_store import CLASS_NAMES, open_label_store
+from calibration import OUTPUT_DIRS
+
+# 每帧索引引用的场景目录，任一目录中的文件有增删改时重新生成该场景的索引
+CAMERA_DIRS = list(OUTPUT_DIRS)
+SCENE_DIRS = ["lidar_point_cloud_0", "camera_config", "labels"] + CAMERA_DIRS
+# 每个场景缓存的索引，以及索引格式版本，格式变化时需要全部重新生成
+SCENE_CACHE = ".infos_cache.pkl"
+INFOS_VERSION = 1
+
+
+def dir_signature(path):
+    """目录的 (文件数, 最新修改时间)，目录不存在时为 None"""
+    if not os.path.isdir(path):
+        return None
+    count, latest = 0, 0
+    with os.scandir(path) as entries:
+        for entry in entries:
+            count += 1
+            latest = max(latest, entry.stat().st_mtime_ns)
+    return count, latest
+
+
+def scene_signature(scene_dir):
+    return [INFOS_VERSION] + [dir_signature(os.path.join(scene_dir, d)) for d in SCENE_DIRS]
+
+
+def list_stems(path):
+    """返回 {文件名去掉后缀: 文件名}，目录不存在时为空"""
+    if not os.path.isdir(path):
+        return {}
+    return {os.path.splitext(f)[0]: f for f in os.listdir(path)}
+
+
+def parse_camera_config(config):
+    """将 camera_config 中每个相机的内外参转换为矩阵"""
+    cameras = []
+    for entry in config:
+        internal = entry['camera_internal']
+        intrinsic = np.array([[internal['fx'], 0, internal['cx']],
+                              [0, internal['fy'], internal['cy']],
+                              [0, 0, 1]], dtype=np.float64)
+        extrinsic = np.array(entry['camera_external'], dtype=np.float64).reshape(4, 4)
+        if not entry.get('rowMajor', True):
+            extrinsic = extrinsic.T
+        cameras.append({'intrinsic': intrinsic, 'extrinsic': extrinsic,
+                        'width': entry['width'], 'height': entry['height']})
+    return cameras
+
+
+def build_scene_infos(scene_dir):
+    """生成一个场景中每一帧的索引，返回 (帧索引列表, 缺少图像或配置而跳过的帧数)"""
+    lidar_dir = os.path.join(scene_dir, "lidar_point_cloud_0")
+    frames = sorted(os.path.splitext(f)[0] for f in os.listdir(lidar_dir) if f.endswith('.pcd'))
+    images = [list_stems(os.path.join(scene_dir, d)) for d in CAMERA_DIRS]
+    configs = list_stems(os.path.join(scene_dir, "camera_config"))
+
+    store = None
+    label_dir = os.path.join(scene_dir, "labels")
+    if os.path.isdir(label_dir):
+        store = open_label_store(label_dir)
+        # 存储中的类别编码转换为 CLASS_NAMES 的下标，未知类别不计数
+        mapping = np.array([CLASS_NAMES.index(n) if n in CLASS_NAMES else -1 for n in store.class_names], dtype=np.intp)
+
+    # camera_config 中各帧通常是同一文件的硬链接，按文件身份只解析一次
+    parsed = {}
+    infos, skipped = [], 0
+    for frame in frames:
+        if frame not in configs or any(frame not in stems for stems in images):
+            skipped += 1
+            continue
+        config_path = os.path.join(scene_dir, "camera_config", configs[frame])
+        st = os.stat(config_path)
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns)
+        if key not in parsed:
+            with open(config_path, 'r') as f:
+                parsed[key] = parse_camera_config(json.load(f))
+
+        lidar_path = os.path.join(lidar_dir, f"{frame}.pcd")
+        num_boxes = dict.fromkeys(CLASS_NAMES, 0)
+        label_path = None
+        if store is not None and frame in store:
+            label_path = os.path.join(label_dir, f"{frame}.txt")
+            codes = mapping[store.frame(frame)[1].astype(np.intp)]
+            counts = np.bincount(codes[codes >= 0], minlength=len(CLASS_NAMES))
+            num_boxes = {name: int(count) for name, count in zip(CLASS_NAMES, counts)}
+        infos.append({
+            'scene': os.path.basename(os.path.normpath(scene_dir)),
+            'timestamp': frame,
+            'lidar_path': lidar_path,
+            'num_points': read_pcd_header(lidar_path)['points'],
+            'image_paths': [os.path.join(scene_dir, d, stems[frame]) for d, stems in zip(CAMERA_DIRS, images)],
+            'cameras': parsed[key],
+            'label_path': label_path,
+            'num_boxes': num_boxes,
+        })
+    return infos, skipped
+
+
+def load_scene_infos(scene_dir, force=False):
+    """读取场景的索引缓存，场景目录有变化或 force=True 时重新生成，返回 (帧索引列表, 跳过的帧数, 是否重新生成)"""
+    cache_path = os.path.join(scene_dir, SCENE_CACHE)
+    signature = scene_signature(scene_dir)
+    if not force and os.path.exists(cache_path):
+        with open(cache_path, 'rb') as f:
+            cache = pickle.load(f)
+        if cache['signature'] == signature:
+            return cache['infos'], cache['skipped'], False
+
+    infos, skipped = build_scene_infos(scene_dir)
+    with open(cache_path + '.tmp', 'wb') as f:
+        pickle.dump({'signature': signature, 'infos': infos, 'skipped': skipped}, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(cache_path + '.tmp', cache_path)
+    return infos, skipped, True
+
+
+def _scene_job(job):
+    scene_dir, force = job
+    try:
+        return scene_dir, load_scene_infos(scene_dir, force), None
+    except Exception as e:
+        return scene_dir, None, str(e)
+
+
+def build_infos(trainval, out_dir='.', workers=1, force=False):
+    """按 trainval.yaml 生成 infos_<划分>.pkl，返回 {划分: 帧数}
+
+    每个场景的索引缓存在场景目录下，只有发生变化的场景会重新生成，多个场景在进程池中并行处理。
+    """
+    import yaml
+    with open(trainval, 'r') as f:
+        splits = {split: scenes or [] for split, scenes in (yaml.safe_load(f) or {}).items()}
+    scenes = sorted({scene for split_scenes in splits.values() for scene in split_scenes})
+
+    jobs = [(scene, force) for scene in scenes]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_scene_job, jobs))
+    else:
+        results = [_scene_job(job) for job in jobs]
+
+    scene_infos = {}
+    for scene, result, error in results:
+        if error is not None:
+            print(f"[ERROR] 生成 {scene} 的索引失败: {error}")
+            continue
+        infos, skipped, rebuilt = result
+        scene_infos[scene] = infos
+        print(f"{scene}: {len(infos)} 帧{'（重新生成）' if rebuilt else '（使用缓存）'}"
+              + (f"，{skipped} 帧缺少图像或相机配置已跳过" if skipped else ""))
+
+    counts = {}
+    for split, split_scenes in splits.items():
+        data_list = [info for scene in split_scenes for info in scene_infos.get(scene, [])]
+        out_path = os.path.join(out_dir, f"infos_{split}.pkl")
+        with open(out_path + '.tmp', 'wb') as f:
+            pickle.dump({'metainfo': {'classes': CLASS_NAMES, 'cameras': CAMERA_DIRS, 'version': INFOS_VERSION},
+                         'data_list': data_list}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(out_path + '.tmp', out_path)
+        counts[split] = len(data_list)
+        print(f"已保存 {out_path}: {len(data_list)} 帧")
+    return counts
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成训练集和验证集的帧索引")
+    parser.add_argument('--trainval', type=str, default='trainval.yaml', help='场景划分文件，默认为 trainval.yaml')
+    parser.add_argument('--out-dir', type=str, default='.', help='索引文件 infos_<划分>.pkl 的保存目录，默认为当前目录')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理场景的进程数，默认为 1')
+    parser.add_argument('--force', action='store_true', help='忽略场景缓存，全部重新生成')
+    args = parser.parse_args()
+    build_infos(args.trainval, args.out_dir, args.workers, args.force)
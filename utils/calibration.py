@@ -0,0 +1,254 @@
+import os
+import json
+import pickle
+import hashlib
+import threading
+from typing import NamedTuple
+import numpy as np
+
+# 标定文件的位置，与其他脚本一样相对于 data 目录
+CALIB_DIR = "utils"
+PARAMETERS_DIR = os.path.join(CALIB_DIR, "Parameters")
+LIDAR_EXTRINSICS = os.path.join(CALIB_DIR, "lidar2m32.json")
+CAMERA_EXTRINSICS = os.path.join(CALIB_DIR, "32m2cameras.json")
+# 解析并校验后的标定缓存，以所有标定文件内容的哈希为键，格式变化时修改版本号
+CACHE_DIR = os.path.join(PARAMETERS_DIR, ".calib_cache")
+CACHE_VERSION = 1
+# 外参正交性校验的容差
+ROTATION_TOLERANCE = 1e-3
+
+
+class CameraSpec(NamedTuple):
+    """相机的固定配置：原始图像文件夹、去畸变输出文件夹、标定文件名、相机模型和原始分辨率 (w, h)"""
+    name: str
+    output_dir: str
+    param_file: str
+    model: str
+    size: tuple
+
+
+# 各相机的配置，顺序与 camera_config 中一致
+CAMERA_SPECS = (
+    CameraSpec("CAM_FRONT_8M", "camera_image_0", "pinhole-front.txt", "pinhole", (3840, 2160)),
+    CameraSpec("CAM_FRONT_3M", "camera_image_1", "fisheye-front.txt", "fisheye", (1920, 1536)),
+    CameraSpec("CAM_LEFT_3M", "camera_image_2", "fisheye-left.txt", "fisheye", (1920, 1536)),
+    CameraSpec("CAM_RIGHT_3M", "camera_image_3", "fisheye-right.txt", "fisheye", (1920, 1536)),
+    CameraSpec("CAM_BACK_3MH", "camera_image_4", "pinhole-back.txt", "pinhole", (1920, 1536)),
+)
+CAMERAS = [spec.name for spec in CAMERA_SPECS]
+OUTPUT_DIRS = [spec.output_dir for spec in CAMERA_SPECS]
+PARAM_FILES = [os.path.join(PARAMETERS_DIR, spec.param_file) for spec in CAMERA_SPECS]
+# 参与合并的激光雷达，LIDAR_TOP_32 为主雷达
+LIDARS = ["LIDAR_FRONT", "LIDAR_REAR", "LIDAR_TOP_32"]
+MAIN_LIDAR = "LIDAR_TOP_32"
+# 各相机模型使用的畸变系数：鱼眼为 (k1, k2, k3, k4)，针孔为有理模型 (k1, k2, p1, p2, k3, k4, k5, k6)
+DISTORTION_KEYS = {
+    'fisheye': ('K1', 'K2', 'K3', 'K4'),
+    'pinhole': ('K1', 'K2', 'P1', 'P2', 'K3', 'K4', 'K5', 'K6'),
+}
+
+
+class CameraCalibration(NamedTuple):
+    """一个相机解析并校验后的标定，矩阵均为只读的 float64 数组"""
+    spec: CameraSpec
+    serial: str
+    intrinsic: np.ndarray
+    distortion: np.ndarray
+    extrinsic: np.ndarray
+    digest: str
+
+    @property
+    def name(self):
+        return self.spec.name
+
+    @property
+    def model(self):
+        return self.spec.model
+
+    @property
+    def size(self):
+        return self.spec.size
+
+
+class Calibration(NamedTuple):
+    """所有相机和激光雷达的标定，digest 为全部标定文件内容的哈希"""
+    cameras: tuple
+    lidars: tuple
+    digest: str
+
+    def camera(self, name):
+        for camera in self.cameras:
+            if camera.name == name:
+                return camera
+        raise KeyError(f"标定中不存在相机: {name}")
+
+    def lidar_transforms(self, direction="sensor2main"):
+        """各非主雷达的 float32 4x4 外参
+
+        direction 为 sensor2main 时矩阵将各雷达坐标变换到 LIDAR_TOP_32 坐标系，直接使用；
+        为 main2sensor 时矩阵方向相反，取逆后使用。
+        """
+        transforms = {}
+        for name, matrix in self.lidars:
+            if direction == "main2sensor":
+                matrix = np.linalg.inv(matrix)
+            transforms[name] = matrix.astype(np.float32)
+        return transforms
+
+
+def read_camera_parameters(param_file):
+    """从参数文件中读取相机内参和畸变系数，值为 '/'、'null' 或空的参数被忽略"""
+    params = {}
+    with open(param_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            # 使用冒号分割键值
+            if ':' not in line:
+                continue
+            key, value = (v.strip() for v in line.split(':', 1))
+            if value in ('/', 'null', ''):
+                continue
+            try:
+                params[key] = float(value)
+            except ValueError:
+                # 如果不能转换为浮点数，则保存为字符串
+                params[key] = value
+    return params
+
+
+def readonly(values, shape=None):
+    array = np.array(values, dtype=np.float64)
+    if shape is not None:
+        array = array.reshape(shape)
+    array.setflags(write=False)
+    return array
+
+
+def check_rigid(matrix, source):
+    """校验 4x4 刚体变换：有限值、最后一行为 [0, 0, 0, 1]、旋转部分正交且行列式为 1"""
+    if matrix.shape != (4, 4) or not np.isfinite(matrix).all():
+        raise ValueError(f"{source} 不是有效的 4x4 矩阵")
+    if not np.allclose(matrix[3], [0, 0, 0, 1]):
+        raise ValueError(f"{source} 的最后一行不是 [0, 0, 0, 1]: {matrix[3].tolist()}")
+    rotation = matrix[:3, :3]
+    if not np.allclose(rotation @ rotation.T, np.eye(3), atol=ROTATION_TOLERANCE) or np.linalg.det(rotation) < 0:
+        raise ValueError(f"{source} 的旋转部分不是正交矩阵")
+
+
+def parse_camera(spec, param_file, extrinsics, digest):
+    """解析并校验一个相机的内参、畸变系数和外参"""
+    params = read_camera_parameters(param_file)
+    missing = [key for key in ('FX', 'FY', 'CX', 'CY') if not isinstance(params.get(key), float)]
+    if missing:
+        raise ValueError(f"{param_file} 缺少必要的相机参数: {', '.join(missing)}")
+    width, height = spec.size
+    if params['FX'] <= 0 or params['FY'] <= 0:
+        raise ValueError(f"{param_file} 的焦距必须为正数: FX={params['FX']}, FY={params['FY']}")
+    if not (0 <= params['CX'] < width and 0 <= params['CY'] < height):
+        raise ValueError(f"{param_file} 的主点 ({params['CX']}, {params['CY']}) 不在 {width}x{height} 图像内")
+    distortion = [params.get(key, 0.0) for key in DISTORTION_KEYS[spec.model]]
+    if not all(isinstance(v, float) and np.isfinite(v) for v in distortion):
+        raise ValueError(f"{param_file} 的畸变系数无效: {distortion}")
+
+    if spec.name not in extrinsics:
+        raise ValueError(f"{CAMERA_EXTRINSICS} 中缺少 {spec.name} 的外参")
+    extrinsic = readonly(extrinsics[spec.name], (4, 4))
+    check_rigid(extrinsic, f"{spec.name} 的外参")
+    intrinsic = readonly([[params['FX'], 0, params['CX']], [0, params['FY'], params['CY']], [0, 0, 1]])
+    return CameraCalibration(spec, str(params.get('SN码', '')), intrinsic, readonly(distortion), extrinsic, digest)
+
+
+# 参与哈希的所有标定文件，最后两个依次为雷达外参和相机外参
+SOURCE_FILES = PARAM_FILES + [LIDAR_EXTRINSICS, CAMERA_EXTRINSICS]
+
+
+def file_digests(paths):
+    """每个标定文件内容的 sha1，文件不存在时报错；大小和修改时间未变的文件使用进程内缓存的哈希"""
+    digests = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"标定文件不存在: {path}（请在 data 目录下运行）") from None
+        key = (path, st.st_size, st.st_mtime_ns)
+        if key not in _file_digests:
+            with open(path, 'rb') as f:
+                _file_digests[key] = hashlib.sha1(f.read()).hexdigest()
+        digests.append(_file_digests[key])
+    return digests
+
+
+def parse_calibration(digests=None):
+    """解析并校验所有标定文件，返回 Calibration"""
+    paths = SOURCE_FILES
+    digests = digests or file_digests(paths)
+    with open(paths[-1], 'r') as f:
+        camera_extrinsics = json.load(f)
+    cameras = tuple(parse_camera(spec, path, camera_extrinsics, digest)
+                    for spec, path, digest in zip(CAMERA_SPECS, paths, digests))
+
+    with open(paths[-2], 'r') as f:
+        lidar_extrinsics = json.load(f)
+    lidars = []
+    for name in LIDARS:
+        if name == MAIN_LIDAR:
+            continue
+        if name not in lidar_extrinsics:
+            raise ValueError(f"{paths[-2]} 中缺少 {name} 的外参")
+        matrix = readonly(lidar_extrinsics[name], (4, 4))
+        check_rigid(matrix, f"{name} 的外参")
+        lidars.append((name, matrix))
+    return Calibration(cameras, tuple(lidars), hashlib.sha1('|'.join(digests).encode()).hexdigest())
+
+
+def freeze(calibration):
+    """从缓存读出的数组默认可写，重新设为只读"""
+    for camera in calibration.cameras:
+        for array in (camera.intrinsic, camera.distortion, camera.extrinsic):
+            array.setflags(write=False)
+    for _, matrix in calibration.lidars:
+        matrix.setflags(write=False)
+    return calibration
+
+
+# 进程内已加载的标定，键为标定文件内容的哈希，每个进程只解析一次
+_calibrations = {}
+# 进程内已计算的文件哈希，键为 (路径, 大小, 修改时间)，文件未变化时不再重新读取
+_file_digests = {}
+
+
+def load_calibration():
+    """读取标定，优先使用进程内缓存和磁盘上的二进制缓存，标定文件内容变化时重新解析和校验"""
+    digests = file_digests(SOURCE_FILES)
+    key = hashlib.sha1(f"{CACHE_VERSION}|{'|'.join(digests)}".encode()).hexdigest()
+    if key in _calibrations:
+        return _calibrations[key]
+
+    cache_path = os.path.join(CACHE_DIR, f"calibration_{key[:16]}.pkl")
+    calibration = None
+    if os.path.exists(cache_path):
+        try:
+            with open(cache_path, 'rb') as f:
+                calibration = freeze(pickle.load(f))
+        except Exception:
+            # 缓存损坏或格式不兼容时重新解析
+            calibration = None
+    if calibration is None:
+        calibration = parse_calibration(digests)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # 先写临时文件再重命名，避免并发运行时读到不完整的缓存；pipeline 各阶段的线程可能同时写入，文件名带上线程号
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(calibration, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    _calibrations[key] = calibration
+    return calibration
+
+
+if __name__ == "__main__":
+    calibration = load_calibration()
+    print(f"标定校验通过，哈希 {calibration.digest[:16]}")
+    for camera in calibration.cameras:
+        print(f"  {camera.name:<13} {camera.model:<8} {camera.size[0]}x{camera.size[1]} "
+              f"fx={camera.intrinsic[0, 0]:.2f} fy={camera.intrinsic[1, 1]:.2f} SN={camera.serial}")
+    for name, matrix in calibration.lidars:
+        print(f"  {name:<13} 平移 {np.round(matrix[:3, 3], 3).tolist()}")
@@ -1,75 +1,262 @@
 import os
 import numpy as np
-from collections import defaultdict
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from label_store import CLASS_NAMES, open_label_store
+from box_points import count_frame_points
+from instrument import stage_report
 
 # 自定义数据集的类别
-class_names = ['car', 'truck', 'bus', 'bicycle', 'pedestrian', 'traffic_cone', 'barrier']
+class_names = list(CLASS_NAMES)
 
+# 一个场景所有标注框的结构化数组：所在文件序号、行号、7 个框参数 (x y z dx dy dz yaw) 以及类别编码
+# 类别编码为 class_names 中的下标，不在列表中的类别为负数
+LABEL_DTYPE = np.dtype([('frame', np.int32), ('line', np.int32), ('box', np.float32, (7,)), ('cls', np.int16)])
+# 超过该数值（米）时给出警告，例如超出点云范围
+MAX_VALUE = 100
+# 长宽高超过该数值（米）时给出警告
+MAX_BOX_SIZE = 20.0
+# statistics.txt 中距离和尺寸直方图的分段（米）
+DISTANCE_BINS = [0, 10, 20, 30, 40, 50, 60, 80, 100, np.inf]
+SIZE_BINS = [0, 0.5, 1, 2, 3, 4, 5, 6, 8, 10, 15, np.inf]
+# 框内点数少于该值时给出警告，以及 statistics.txt 中框内点数直方图的分段
+MIN_POINTS = 5
+POINT_BINS = [0, 1, 5, 10, 20, 50, 100, 200, 500, 1000, np.inf]
 
-def check_label_file(file_path, class_counts):
-    with open(file_path, 'r') as f:
-        lines = f.readlines()
 
-    for line_idx, line in enumerate(lines):
-        parts = line.strip().split()
-        if len(parts) != 8:
-            print(f"[ERROR] {file_path} 第 {line_idx+1} 行: 数据长度不为 8，实际为 {len(parts)}")
+def load_scene_labels(label_dir):
+    """从列式标签存储读取目录下的所有标注，返回 (结构化数组, 文件名列表, 未知类别名列表, [(文件序号, 行号, 格式错误信息)])
+
+    存储不存在或标签文件有变化时会先重新生成存储。
+    """
+    store = open_label_store(label_dir)
+    files = [f"{frame}.txt" for frame in store.frames]
+    known = {name: i for i, name in enumerate(class_names)}
+    unknown = [name for name in store.class_names if name not in known]
+    # 存储中的类别编码转换为 class_names 中的下标，未知类别为负数
+    mapping = np.array([known[name] if name in known else -unknown.index(name) - 1 for name in store.class_names],
+                       dtype=np.int16)
+
+    labels = np.empty(len(store.boxes), dtype=LABEL_DTYPE)
+    labels['frame'] = store.frame_ids()
+    labels['line'] = store.lines
+    labels['box'] = store.boxes
+    labels['cls'] = mapping[store.classes.astype(np.intp)]
+    messages = [(frame, line, f"[ERROR] {os.path.join(label_dir, files[frame])} 第 {line} 行: {message}")
+                for frame, line, message in zip(store.error_frames, store.error_lines, store.error_messages)]
+    return labels, files, unknown, messages
+
+
+def check_labels(labels, files, unknown, label_dir):
+    """对所有标注框进行向量化检查，返回 [(文件序号, 行号, 错误或警告信息)]"""
+    box = labels['box']
+    found = []
+
+    def report(mask, level, describe):
+        for i in np.flatnonzero(mask):
+            found.append((labels['frame'][i], labels['line'][i],
+                          f"[{level}] {os.path.join(label_dir, files[labels['frame'][i]])} "
+                          f"第 {labels['line'][i]} 行: {describe(i)}"))
+
+    finite = np.isfinite(box).all(axis=1)
+    report(~finite, 'ERROR', lambda i: "包含 NaN 或 Inf")
+    with np.errstate(invalid='ignore'):
+        report((np.abs(box) > MAX_VALUE).any(axis=1), 'WARNING', lambda i: f"存在较大数值: {rounded(box[i])}")
+        sizes = box[:, 3:6]
+        report(finite & (sizes <= 0).any(axis=1), 'ERROR', lambda i: f"长宽高必须为正数: {rounded(sizes[i])}")
+        report(finite & (sizes > MAX_BOX_SIZE).any(axis=1), 'WARNING',
+               lambda i: f"长宽高超过 {MAX_BOX_SIZE} 米: {rounded(sizes[i])}")
+    report(labels['cls'] < 0, 'ERROR',
+           lambda i: f"类别 '{unknown[-labels['cls'][i] - 1]}' 不在允许的类别列表中")
+    return found
+
+
+def rounded(values):
+    """存储中的框为 float32，打印时按标签文件的 3 位小数显示"""
+    return [round(float(v), 3) for v in values]
+
+
+def class_name(code, unknown):
+    return class_names[code] if code >= 0 else unknown[-code - 1]
+
+
+def count_classes(labels, unknown):
+    """按类别首次出现的顺序统计每个类别的数量"""
+    codes, first, counts = np.unique(labels['cls'], return_index=True, return_counts=True)
+    order = np.argsort(first, kind='stable')
+    return {class_name(int(codes[i]), unknown): int(counts[i]) for i in order}
+
+
+def class_histograms(labels):
+    """统计每个已知类别的距离（到原点的水平距离）和长度（dx）直方图，只统计数值有效的框"""
+    box = labels['box']
+    valid = np.isfinite(box).all(axis=1) & (labels['cls'] >= 0)
+    distance = np.hypot(box[:, 0], box[:, 1])
+    histograms = {}
+    for code, name in enumerate(class_names):
+        mask = valid & (labels['cls'] == code)
+        if not mask.any():
             continue
+        histograms[name] = (np.histogram(distance[mask], DISTANCE_BINS)[0],
+                            np.histogram(box[mask, 3], SIZE_BINS)[0])
+    return histograms
 
-        try:
-            # 前7个是浮点数
-            values = [float(p) for p in parts[:7]]
-            label = parts[7]
-            class_counts[label] += 1
 
-            # 检查是否有 NaN 或 Inf
-            if any(np.isnan(values)) or any(np.isinf(values)):
-                print(f"[ERROR] {file_path} 第 {line_idx+1} 行: 包含 NaN 或 Inf")
+def box_point_counts(scene_dir, labels, files, workers=1):
+    """读取每个有标注的帧的合并点云，统计每个框内的点数，返回 (与 labels 对齐的点数数组, 错误信息)
 
-            # 检查值是否过大（例如超出点云范围）
-            if any(abs(v) > 100 for v in values):
-                print(f"[WARNING] {file_path} 第 {line_idx+1} 行: 存在较大数值: {values}")
+    点云缺失或读取失败的帧中的框点数为 -1。workers 大于 1 时按帧分发到进程池。
+    """
+    counts = np.full(len(labels), -1, dtype=np.int64)
+    found = []
+    bounds = np.searchsorted(labels['frame'], np.arange(len(files) + 1))
+    jobs, frames = [], []
+    for frame, filename in enumerate(files):
+        start, end = bounds[frame], bounds[frame + 1]
+        if start == end:
+            continue
+        pcd_path = os.path.join(scene_dir, 'lidar_point_cloud_0', os.path.splitext(filename)[0] + '.pcd')
+        if not os.path.exists(pcd_path):
+            found.append((frame, 0, f"[ERROR] {os.path.join(scene_dir, 'labels', filename)}: 找不到对应的点云 {pcd_path}"))
+            continue
+        jobs.append((pcd_path, labels['box'][start:end]))
+        frames.append(frame)
 
-            # 检查类别是否存在
-            if label not in class_names:
-                print(f"[ERROR] {file_path} 第 {line_idx+1} 行: 类别 '{label}' 不在允许的类别列表中")
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(count_frame_points, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+    else:
+        results = [count_frame_points(job) for job in jobs]
+
+    for frame, (pcd_path, _), (frame_counts, error) in zip(frames, jobs, results):
+        if error is not None:
+            found.append((frame, 0, f"[ERROR] 读取点云 {pcd_path} 失败: {error}"))
+            continue
+        counts[bounds[frame]:bounds[frame + 1]] = frame_counts
+    return counts, found
 
-        except ValueError as e:
-            print(f"[ERROR] {file_path} 第 {line_idx+1} 行: 数值转换失败 - {e}")
 
-def save_statistics(total_frames, class_counts, scene_dir):
+def check_box_points(labels, counts, files, label_dir, min_points=MIN_POINTS):
+    """标记框内没有点或点数过少的框，返回 [(文件序号, 行号, 警告信息)]"""
+    found = []
+    for i in np.flatnonzero((counts >= 0) & (counts < min_points)):
+        message = "框内没有点" if counts[i] == 0 else f"框内只有 {counts[i]} 个点"
+        found.append((labels['frame'][i], labels['line'][i],
+                      f"[WARNING] {os.path.join(label_dir, files[labels['frame'][i]])} "
+                      f"第 {labels['line'][i]} 行: {message}"))
+    return found
+
+
+def point_histograms(labels, counts):
+    """统计每个已知类别的框内点数直方图"""
+    histograms = {}
+    for code, name in enumerate(class_names):
+        mask = (labels['cls'] == code) & (counts >= 0)
+        if mask.any():
+            histograms[name] = np.histogram(counts[mask], POINT_BINS)[0]
+    return histograms
+
+
+def format_bins(bins):
+    return [f"{bins[i]:g}-{bins[i + 1]:g}" if np.isfinite(bins[i + 1]) else f">{bins[i]:g}"
+            for i in range(len(bins) - 1)]
+
+
+def save_statistics(total_frames, class_counts, scene_dir, histograms=None, verbose=True, points=None):
     stat_file = os.path.join(scene_dir, 'statistics.txt')
+    lines = [f"总帧数: {total_frames}", "类别分布:"]
+    lines += [f"{class_name}: {count}" for class_name, count in class_counts.items()]
+    if histograms:
+        for title, bins, index in (("距离分布 (m):", DISTANCE_BINS, 0), ("长度分布 dx (m):", SIZE_BINS, 1)):
+            lines += ["", title, "类别 " + " ".join(format_bins(bins))]
+            lines += [f"{name}: " + " ".join(str(int(v)) for v in hist[index]) for name, hist in histograms.items()]
+    if points:
+        lines += ["", "框内点数分布:", "类别 " + " ".join(format_bins(POINT_BINS))]
+        lines += [f"{name}: " + " ".join(str(int(v)) for v in hist) for name, hist in points.items()]
     with open(stat_file, 'w') as f:
-        f.write(f"总帧数: {total_frames}\n")
-        f.write("类别分布:\n")
-
-        for class_name, count in class_counts.items():
-            f.write(f"{class_name}: {count}\n")
+        f.write("\n".join(lines) + "\n")
 
+    if not verbose:
+        return
     # 同时打印到控制台
     print(f"\n总处理帧数: {total_frames}")
     print("类别分布:")
     for class_name, count in class_counts.items():
         print(f"{class_name}: {count}")
-    
+
+
+def check_scene(scene_dir, verbose=True, points=False, min_points=MIN_POINTS, workers=1):
+    """检查场景 labels 目录下的所有标注文件，并写入 statistics.txt，返回 (帧数, 错误和警告信息)
+
+    points=True 时还会统计每个框内的点云点数，标记点数少于 min_points 的框。
+    """
+    label_dir = os.path.join(scene_dir, 'labels')
+    if verbose:
+        print(f"开始检查{scene_dir}下的标注文件...\n")
+    with stage_report(scene_dir, 'check', verbose) as stats:
+        with stats.timer('load'):
+            labels, files, unknown, found = load_scene_labels(label_dir)
+        with stats.timer('check'):
+            found += check_labels(labels, files, unknown, label_dir)
+        stats.count('frames', len(files))
+        stats.count('boxes', len(labels))
+        histograms_points = None
+        if points:
+            with stats.timer('points'):
+                counts, point_errors = box_point_counts(scene_dir, labels, files, workers)
+                found += point_errors + check_box_points(labels, counts, files, label_dir, min_points)
+                histograms_points = point_histograms(labels, counts)
+    # 同一行的多条信息保持检查顺序
+    messages = [message for _, _, message in sorted(found, key=lambda item: (item[0], item[1]))]
+    if verbose:
+        for message in messages:
+            print(message)
+        print("\n检查完成。")
+    save_statistics(len(files), count_classes(labels, unknown), scene_dir, class_histograms(labels), verbose,
+                    histograms_points)
+    return len(files), messages
+
+
+def _check_job(job):
+    scene_dir, points, min_points = job
+    try:
+        return scene_dir, check_scene(scene_dir, False, points, min_points), None
+    except Exception as e:
+        return scene_dir, None, str(e)
+
 
 def main():
     parser = argparse.ArgumentParser(description="检查标注文件并统计类别分布")
-    parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--path', type=str, nargs='+', required=True, help='场景路径，可指定多个，例如 scene_1 scene_2')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='并行进程数，多个场景时按场景并行，单个场景统计框内点数时按帧并行，默认为 1')
+    parser.add_argument('--points', action='store_true', help='读取合并后的点云，统计每个框内的点数并标记空框')
+    parser.add_argument('--min-points', type=int, default=MIN_POINTS,
+                        help=f'框内点数少于该值时给出警告，默认为 {MIN_POINTS}')
     args = parser.parse_args()
-    scene_dir = args.path
-    label_dir = os.path.join(scene_dir, 'labels')
-    print(f"开始检查{args.path}下的标注文件...\n")
-    total_frames = len([f for f in os.listdir(label_dir) if f.endswith('.txt')])  # 统计总帧数
-    class_counts = defaultdict(int)                                              # 统计每个类别出现的次数
-    for filename in os.listdir(label_dir):
-        if filename.endswith('.txt'):
-            file_path = os.path.join(label_dir, filename)
-            check_label_file(file_path, class_counts)
+    if len(args.path) == 1:
+        check_scene(args.path[0], points=args.points, min_points=args.min_points, workers=args.workers)
+        return
 
-    print("\n检查完成。")
-    save_statistics(total_frames, class_counts, scene_dir)
+    jobs = [(scene_dir, args.points, args.min_points) for scene_dir in args.path]
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            results = list(executor.map(_check_job, jobs))
+    else:
+        results = [_check_job(job) for job in jobs]
+
+    # 各场景的错误和警告统一在主进程中按场景顺序打印，最后输出汇总表
+    for scene_dir, result, error in results:
+        for message in (result[1] if result else []):
+            print(message)
+    print(f"\n{'场景':<12} {'帧数':>6} {'错误':>6} {'警告':>6}")
+    for scene_dir, result, error in results:
+        if error is not None:
+            print(f"{scene_dir:<12} 检查失败: {error}")
+            continue
+        total_frames, messages = result
+        n_errors = sum(message.startswith('[ERROR]') for message in messages)
+        print(f"{scene_dir:<12} {total_frames:>6} {n_errors:>6} {len(messages) - n_errors:>6}")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -1,63 +1,163 @@
 import os
 import json
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from manifest import Manifest, config_hash
+from label_store import build_label_store
+from instrument import Stats, Progress, stage_report
 
-def convert_annotations(input_dir, output_dir):
+# 安装 orjson 后使用更快的解析器，否则使用标准库
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 导出结果中每帧的标注来源：data[0] 为人工标注（ground truth），data[1] 为模型预测，分别输出到不同目录
+SOURCES = {
+    'gt': (0, 'labels'),
+    'pred': (1, 'labels_pred'),
+}
+
+
+def load_json(path, stats=None):
+    stats = stats or Stats()
+    with stats.timer('read'):
+        with open(path, 'rb') as f:
+            raw = f.read()
+    stats.count('bytes_in', len(raw))
+    with stats.timer('parse'):
+        return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+
+def format_objects(objects):
+    """将一帧的标注对象转换为 "x y z dx dy dz yaw class" 文本，整帧拼接后一次写入"""
+    lines = []
+    for obj in objects:
+        contour = obj['contour']
+        center3D = contour['center3D']
+        size3D = contour['size3D']
+        # 模型预测结果可能没有朝向
+        yaw = contour.get('rotation3D') or {'z': 0.0}
+        lines.append(f"{round(center3D['x'], 3)} {round(center3D['y'], 3)} {round(center3D['z'], 3)} "
+                     f"{round(size3D['x'], 3)} {round(size3D['y'], 3)} {round(size3D['z'], 3)} "
+                     f"{round(yaw['z'], 3)} {obj['className']}\n")
+    return ''.join(lines)
+
+
+def convert_file(job):
+    """转换单个导出文件，job 为 (json 路径, [(来源下标, 标签文件路径)])，返回 (json 路径, 统计, 错误信息)"""
+    file_path, outputs = job
+    stats = Stats()
+    try:
+        data = load_json(file_path, stats)
+        for index, label_file_path in outputs:
+            objects = data[index]['objects'] if index < len(data) else []
+            with stats.timer('format'):
+                text = format_objects(objects)
+            with stats.timer('write'):
+                with open(label_file_path, 'w') as label_file:
+                    label_file.write(text)
+            stats.count('objects', len(objects))
+        stats.count('files')
+        return file_path, stats.to_dict(), None
+    except Exception as e:
+        return file_path, stats.to_dict(), str(e)
+
+
+def find_exports(scene_dir):
+    """返回场景目录下所有标注导出目录 <场景名>-<时间戳>/result，按时间戳排序"""
+    scene_name = os.path.basename(os.path.normpath(scene_dir))
+    export_dirs = sorted(d for d in os.listdir(scene_dir)
+                         if d.startswith(scene_name + '-') and os.path.isdir(os.path.join(scene_dir, d, 'result')))
+    return [os.path.join(scene_dir, d, 'result') for d in export_dirs]
+
+
+def collect_annotations(input_dirs):
+    """汇总多个导出目录中的 JSON 文件，同一帧出现在多次导出中时以最新一次为准，返回 {文件名: 路径}"""
+    files = {}
+    for input_dir in input_dirs:
+        for filename in os.listdir(input_dir):
+            if filename.endswith('.json'):
+                files[filename] = os.path.join(input_dir, filename)
+    return files
+
+
+def convert_annotations(input_dirs, scene_dir, sources=('gt',), workers=1, manifest=None, force=False, stats=None):
+    """将导出的标注转换为每帧一个 txt 文件，返回失败的文件
+
+    input_dirs 可以是单个目录或目录列表；sources 为要提取的来源（gt、pred），各自输出到 SOURCES 中对应的目录。
+    workers 大于 1 时按文件分发到进程池。指定 stats 时汇总读取、解析、格式化和写入的耗时。
+    """
+    stats = stats if stats is not None else Stats()
+    if isinstance(input_dirs, str):
+        input_dirs = [input_dirs]
     # 创建输出目录（如果不存在）
-    if not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-
-    # 遍历输入目录中的所有 JSON 文件
-    for filename in os.listdir(input_dir):
-        if filename.endswith('.json'):
-            file_path = os.path.join(input_dir, filename)
-            label_file_path = os.path.join(output_dir, os.path.splitext(filename)[0] + '.txt')
-
-            with open(file_path, 'r') as f:
-                data = json.load(f)
-
-            with open(label_file_path, 'w') as label_file:
-                print(f"Processing file: {file_path}")
-                for obj in data[0]['objects']:  # 遍历ground truth对象
-                    center3D = obj['contour']['center3D']
-                    size3D = obj['contour']['size3D']
-                    class_name = obj['className']
-                    yaw = obj['contour']['rotation3D']
-
-                    # 提取坐标和尺寸
-                    x = round(center3D['x'], 3)
-                    y = round(center3D['y'], 3)
-                    z = round(center3D['z'], 3)
-                    dx = round(size3D['x'], 3)
-                    dy = round(size3D['y'], 3)
-                    dz = round(size3D['z'], 3)
-
-                    yaw = round(yaw['z'], 3)
-
-                    # 写入文件
-                    label_file.write(f"{x} {y} {z} {dx} {dy} {dz} {yaw} {class_name}\n")
-                # for obj in data[1]['objects']:  # 遍历model predictions对象
-                #     center3D = obj['contour']['center3D']
-                #     size3D = obj['contour']['size3D']
-                #     class_name = obj['className']
-
-                #     # 提取坐标和尺寸
-                #     x = round(center3D['x'], 3)
-                #     y = round(center3D['y'], 3)
-                #     z = round(center3D['z'], 3)
-                #     dx = round(size3D['x'], 3)
-                #     dy = round(size3D['y'], 3)
-                #     dz = round(size3D['z'], 3)
-
-                #     # 写入文件
-                #     label_file.write(f"{x} {y} {z} {dx} {dy} {dz} {class_name}\n")
+    for source in sources:
+        os.makedirs(os.path.join(scene_dir, SOURCES[source][1]), exist_ok=True)
+
+    jobs = []
+    for filename, file_path in sorted(collect_annotations(input_dirs).items()):
+        stem = os.path.splitext(filename)[0]
+        outputs = [(SOURCES[source][0], os.path.join(scene_dir, SOURCES[source][1], stem + '.txt')) for source in sources]
+        # 标注文件未变化且标签文件仍存在时跳过
+        if manifest is not None and not force and manifest.is_fresh(filename, [file_path], [p for _, p in outputs]):
+            continue
+        jobs.append((file_path, outputs))
+    print(f"需要转换 {len(jobs)} 个标注文件（JSON 解析: {'orjson' if orjson is not None else 'json'}）")
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers)
+        results = executor.map(convert_file, jobs, chunksize=max(1, len(jobs) // (workers * 4)))
+    else:
+        executor = None
+        results = map(convert_file, jobs)
+
+    failures = []
+    progress = Progress(len(jobs), "转换标注", stats, {'MB/秒': ('bytes_in', 2**-20)})
+    try:
+        for (file_path, outputs), (_, job_stats, error) in zip(jobs, results):
+            stats.merge(job_stats)
+            if error is not None:
+                failures.append((file_path, error))
+                print(f"\n转换 {file_path} 时出错: {error}")
+            elif manifest is not None:
+                manifest.record(os.path.basename(file_path), [file_path], [p for _, p in outputs])
+            progress.update()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        progress.close()
+    print(f"转换完成: {len(jobs) - len(failures)} 个成功，{len(failures)} 个失败")
+    return failures
+
+
+def extract_scene_labels(scene_dir, force=False, sources=('gt',), workers=1):
+    """将场景目录下标注软件导出的结果转换为 labels/<帧>.txt（模型预测为 labels_pred/<帧>.txt）
+
+    同时生成每个标签目录对应的列式存储 labels.npz / labels_pred.npz，训练和检查时直接读取。
+    """
+    input_dirs = find_exports(scene_dir)  # JSON 文件所在目录
+    if not input_dirs:
+        raise FileNotFoundError(f"{scene_dir} 下没有找到标注导出目录")
+    print(f"使用标注导出目录: {', '.join(input_dirs)}")
+    with stage_report(scene_dir, 'labels') as stats:
+        manifest = Manifest(scene_dir, 'labels', config_hash(sources=list(sources)))
+        failures = convert_annotations(input_dirs, scene_dir, sources, workers, manifest, force, stats)
+        manifest.close()
+        for source in sources:
+            with stats.timer('store'):
+                store = build_label_store(os.path.join(scene_dir, SOURCES[source][1]))
+            print(f"已生成列式标签存储: {len(store)} 帧，{len(store.boxes)} 个框")
+    return failures
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="提取标注信息")
     parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--force', action='store_true', help='重新转换所有帧，不跳过构建记录中已是最新的结果')
+    parser.add_argument('--source', type=str, choices=['gt', 'pred', 'both'], default='gt',
+                        help='提取人工标注 data[0]（gt，默认，输出到 labels）、模型预测 data[1]（pred，输出到 labels_pred）或两者')
+    parser.add_argument('--workers', type=int, default=1, help='并行转换的进程数，默认为 1（串行）')
     args = parser.parse_args()
-    scene_dir = args.path
-    timestamp_dir = [d for d in os.listdir(scene_dir) if d.startswith(scene_dir + '-')]
-    input_dir = os.path.join(scene_dir, timestamp_dir[0], 'result')  # JSON 文件所在目录
-    output_dir = os.path.join(scene_dir, 'labels')  # 输出标签文件目录
-    convert_annotations(input_dir, output_dir)
\ No newline at end of file
+    sources = ('gt', 'pred') if args.source == 'both' else (args.source,)
+    extract_scene_labels(args.path, args.force, sources, args.workers)
@@ -1,21 +1,26 @@
 import os
+import errno
 import shutil
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from calibration import LIDARS, CAMERAS
+from stage_options import LINK_MODES
 
+# 默认的源目录和目标目录
 BASE_DIR = "scene_1_unaligned"
 TARGET_DIR = "scene_1"
-os.makedirs(TARGET_DIR, exist_ok=True)
+
+# 各链接方式失败时依次尝试的后备方式，都失败时再用线程池复制
+LINK_FALLBACKS = dict(zip(LINK_MODES, (["hardlink", "reflink"], ["reflink"], ["symlink"], [])))
+# Linux 下 FICLONE ioctl，btrfs/XFS 等文件系统支持写时复制克隆
+FICLONE = 0x40049409
+
+# 同步时的参考传感器
+REFERENCE = "LIDAR_TOP_32"
 
 # 固定要处理的文件夹
-FOLDERS = [
-    "LIDAR_FRONT",
-    "LIDAR_REAR",
-    "LIDAR_TOP_32",
-    "CAM_FRONT_8M",
-    "CAM_FRONT_3M",
-    "CAM_LEFT_3M",
-    "CAM_RIGHT_3M",
-    "CAM_BACK_3MH"
-]
+FOLDERS = LIDARS + CAMERAS
 
 def truncate_timestamp(fname):
     """
@@ -27,24 +32,192 @@ def truncate_timestamp(fname):
         base = base[:-9]  # 去掉最后9位
     return base + ext
 
-def process_folder(folder):
-    src_dir = os.path.join(BASE_DIR, folder)
-    dst_dir = os.path.join(TARGET_DIR, folder)
+def reflink(src, dst):
+    """写时复制克隆文件，文件系统不支持时抛出 OSError"""
+    import fcntl
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    except OSError:
+        os.remove(dst)
+        raise
+    shutil.copystat(src, dst)
+
+def link_file(src, dst, mode):
+    """按 mode 及其后备方式为 dst 建立指向 src 的零拷贝链接，返回实际使用的方式，都失败时返回 None"""
+    if os.path.lexists(dst):
+        os.remove(dst)
+    for method in LINK_FALLBACKS[mode]:
+        try:
+            if method == "hardlink":
+                os.link(src, dst)
+            elif method == "reflink":
+                reflink(src, dst)
+            else:
+                os.symlink(os.path.abspath(src), dst)
+            return method
+        except OSError as e:
+            # 跨文件系统、不支持或无权限时尝试下一种方式，其他错误直接抛出
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                               errno.EMLINK, errno.EACCES):
+                raise
+    return None
+
+def transfer_files(pairs, mode="hardlink", threads=8):
+    """将 (源文件, 目标文件) 列表链接或复制到目标位置，返回各方式的文件数和字节数统计"""
+    # 截断时间戳时同一秒的多帧对应同一个目标文件，只保留最后一个源文件，避免线程池并发写同一文件
+    pairs = [(src, dst) for dst, src in {dst: src for src, dst in pairs}.items()]
+    summary = {}
+    to_copy = []
+    for src, dst in pairs:
+        method = link_file(src, dst, mode)
+        if method is None:
+            to_copy.append((src, dst))
+            continue
+        count, size = summary.get(method, (0, 0))
+        summary[method] = (count + 1, size + os.path.getsize(src))
+
+    # 只有无法链接的文件才真正复制，使用线程池并行
+    if to_copy:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(lambda pair: shutil.copy2(*pair), to_copy))
+        summary["copy"] = (len(to_copy), sum(os.path.getsize(src) for src, _ in to_copy))
+
+    linked_bytes = sum(size for method, (_, size) in summary.items() if method != "copy")
+    copied_count, copied_bytes = summary.get("copy", (0, 0))
+    details = "，".join(f"{method} {count} 个" for method, (count, _) in summary.items())
+    print(f"共处理 {len(pairs)} 个文件（{details or '无'}），避免复制 {linked_bytes / 2**20:.1f} MB，"
+          f"实际复制 {copied_bytes / 2**20:.1f} MB")
+    return summary
+
+def process_folder(folder, base_dir=BASE_DIR, target_dir=TARGET_DIR):
+    """返回截断时间戳对齐后的 (源文件, 目标文件) 列表"""
+    src_dir = os.path.join(base_dir, folder)
+    dst_dir = os.path.join(target_dir, folder)
     os.makedirs(dst_dir, exist_ok=True)
 
+    pairs = []
     for fname in os.listdir(src_dir):
         old_path = os.path.join(src_dir, fname)
         if not os.path.isfile(old_path):
             continue
         new_name = truncate_timestamp(fname)
-        new_path = os.path.join(dst_dir, new_name)
-        shutil.copy2(old_path, new_path)
+        pairs.append((old_path, os.path.join(dst_dir, new_name)))
+    return pairs
+
+def read_timestamps(folder_dir):
+    """读取文件夹中所有文件的纳秒时间戳，返回按时间排序的 int64 数组和对应的文件名"""
+    names, stamps = [], []
+    for fname in os.listdir(folder_dir):
+        base = os.path.splitext(fname)[0]
+        if base.isdigit() and os.path.isfile(os.path.join(folder_dir, fname)):
+            names.append(fname)
+            stamps.append(int(base))
+    stamps = np.array(stamps, dtype=np.int64)
+    order = np.argsort(stamps, kind='stable')
+    return stamps[order], np.array(names, dtype=object)[order]
+
+def match_nearest(reference, stamps, tolerance):
+    """为每个参考时间戳找到最近的传感器帧，返回匹配的下标（超出容差为 -1）和时间差"""
+    if len(stamps) == 0:
+        return np.full(len(reference), -1, dtype=np.int64), np.full(len(reference), np.iinfo(np.int64).max)
+    # 最近的帧只可能是插入位置左右相邻的两帧
+    right = np.minimum(np.searchsorted(stamps, reference), len(stamps) - 1)
+    left = np.maximum(right - 1, 0)
+    diff_left = np.abs(reference - stamps[left])
+    diff_right = np.abs(stamps[right] - reference)
+    index = np.where(diff_right < diff_left, right, left)
+    diff = np.minimum(diff_left, diff_right)
+    return np.where(diff <= tolerance, index, -1), diff
 
-        print(f"{old_path} -> {new_path}")
+def build_sync_table(base_dir, folders, tolerance):
+    """以 LIDAR_TOP_32 为参考，将每个传感器的帧按最近时间戳对齐
+
+    返回 (参考时间戳, {传感器: 匹配的文件名数组}, {传感器: 时间差数组}, 报告)，只保留所有传感器都匹配成功的帧。
+    """
+    ref_stamps, ref_names = read_timestamps(os.path.join(base_dir, REFERENCE))
+    valid = np.ones(len(ref_stamps), dtype=bool)
+    matches, diffs, report = {}, {}, {}
+    for folder in folders:
+        stamps, names = read_timestamps(os.path.join(base_dir, folder))
+        if folder == REFERENCE:
+            index, diff = np.arange(len(stamps)), np.zeros(len(stamps), dtype=np.int64)
+        else:
+            index, diff = match_nearest(ref_stamps, stamps, tolerance)
+        matched = index >= 0
+        valid &= matched
+        matched_index = index[matched]
+        # 同一传感器帧被多个参考帧使用，说明该传感器丢帧
+        duplicated = len(matched_index) - len(np.unique(matched_index))
+        report[folder] = {
+            'frames': len(stamps),
+            'unmatched': int((~matched).sum()),
+            'duplicated': int(duplicated),
+            'unused': int(len(stamps) - len(np.unique(matched_index))),
+        }
+        matches[folder] = (index, names)
+        diffs[folder] = diff
+
+    table = {folder: names[index[valid]] for folder, (index, names) in matches.items()}
+    diffs = {folder: diff[valid] for folder, diff in diffs.items()}
+    report['dropped'] = int((~valid).sum())
+    return ref_stamps[valid], table, diffs, report
+
+def write_sync_table(target_dir, frames, table, diffs):
+    """将同步表写入目标目录的 sync_table.csv 和 sync_table.npz"""
+    folders = list(table)
+    with open(os.path.join(target_dir, 'sync_table.csv'), 'w') as f:
+        f.write(','.join(['frame'] + folders + [f"{folder}_offset_ms" for folder in folders]) + '\n')
+        for i, frame in enumerate(frames):
+            row = [str(frame)] + [str(table[folder][i]) for folder in folders]
+            row += [f"{diffs[folder][i] / 1e6:.3f}" for folder in folders]
+            f.write(','.join(row) + '\n')
+    np.savez(os.path.join(target_dir, 'sync_table.npz'), frames=frames,
+             **{folder: table[folder].astype(str) for folder in folders},
+             **{f"{folder}_offset_ns": diffs[folder] for folder in folders})
+
+def sync_folders(tolerance_ms, base_dir=BASE_DIR, target_dir=TARGET_DIR, link_mode="hardlink", threads=8):
+    """按最近时间戳同步所有传感器，输出文件统一以参考雷达的时间戳命名"""
+    frames, table, diffs, report = build_sync_table(base_dir, FOLDERS, int(tolerance_ms * 1e6))
+    write_sync_table(target_dir, frames, table, diffs)
+
+    pairs = []
+    for folder in FOLDERS:
+        src_dir = os.path.join(base_dir, folder)
+        dst_dir = os.path.join(target_dir, folder)
+        os.makedirs(dst_dir, exist_ok=True)
+        for frame, fname in zip(frames, table[folder]):
+            ext = os.path.splitext(fname)[1]
+            pairs.append((os.path.join(src_dir, fname), os.path.join(dst_dir, f"{frame}{ext}")))
+    transfer_files(pairs, link_mode, threads)
+
+    print(f"同步完成: 保留 {len(frames)} 帧，丢弃 {report['dropped']} 帧（容差 {tolerance_ms} ms）")
+    for folder in FOLDERS:
+        r = report[folder]
+        print(f"  {folder}: 共 {r['frames']} 帧，未匹配 {r['unmatched']}，重复使用 {r['duplicated']}，未使用 {r['unused']}")
+    return report
 
 def main():
+    parser = argparse.ArgumentParser(description="对齐各传感器的帧")
+    parser.add_argument('--mode', type=str, choices=['truncate', 'sync'], default='truncate',
+                        help='truncate 为去掉时间戳最后9位对齐（默认），sync 为以 LIDAR_TOP_32 为参考按最近时间戳同步')
+    parser.add_argument('--tolerance-ms', type=float, default=50.0,
+                        help='sync 模式下允许的最大时间差（毫秒），默认为 50')
+    parser.add_argument('--src', type=str, default=BASE_DIR, help=f'未对齐的原始数据目录，默认为 {BASE_DIR}')
+    parser.add_argument('--dst', type=str, default=TARGET_DIR, help=f'对齐后的场景目录，默认为 {TARGET_DIR}')
+    parser.add_argument('--link-mode', type=str, choices=LINK_MODES, default='hardlink',
+                        help='目标文件的生成方式，默认 hardlink；hardlink 失败时依次尝试 reflink 和复制，'
+                             'reflink/symlink 失败时复制。注意硬链接与原始文件共享数据，不要原地修改')
+    parser.add_argument('--threads', type=int, default=8, help='需要复制时的线程数，默认为 8')
+    args = parser.parse_args()
+    os.makedirs(args.dst, exist_ok=True)
+    if args.mode == 'sync':
+        sync_folders(args.tolerance_ms, args.src, args.dst, args.link_mode, args.threads)
+        return
+    pairs = []
     for folder in FOLDERS:
-        process_folder(folder)
+        pairs += process_folder(folder, args.src, args.dst)
+    transfer_files(pairs, args.link_mode, args.threads)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,172 @@
+import os
+import csv
+import sys
+import json
+import time
+import resource
+from contextlib import contextmanager
+from datetime import datetime
+
+# 每个场景的运行报告目录，每个阶段保存最近一次运行的 <阶段>.json 和 <阶段>.csv
+REPORT_DIR = "reports"
+# 设置该环境变量后，各阶段在主进程中的运行过程会用 cProfile 记录到 reports/<阶段>.prof
+PROFILE_ENV = "PIPELINE_PROFILE"
+
+
+class Stats:
+    """一个阶段各步骤的累计耗时、调用次数和计数器
+
+    进程池任务在子进程中各自记录，通过 to_dict() 随结果返回，主进程用 merge() 汇总。
+    计时器按 "步骤.传感器" 命名（例如 read.LIDAR_FRONT、encode.CAM_FRONT_8M），便于找出最慢的传感器。
+    """
+
+    __slots__ = ('timers', 'calls', 'counters')
+
+    def __init__(self):
+        self.timers = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start)
+
+    def add_time(self, name, seconds, calls=1):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+        self.calls[name] = self.calls.get(name, 0) + calls
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def to_dict(self):
+        return {'timers': self.timers, 'calls': self.calls, 'counters': self.counters}
+
+    def merge(self, stats):
+        """合并另一个 Stats 或 to_dict() 的结果"""
+        if stats is None:
+            return
+        if isinstance(stats, Stats):
+            stats = stats.to_dict()
+        for name, seconds in stats['timers'].items():
+            self.add_time(name, seconds, stats['calls'].get(name, 1))
+        for name, n in stats['counters'].items():
+            self.count(name, n)
+
+
+def timed(func, *args):
+    """调用 func(*args)，返回 (结果, 耗时秒数)，用于在线程池中计时后交给主线程记录"""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def peak_memory_mb():
+    """当前进程和已结束子进程的内存峰值 (MB)，Linux 下 ru_maxrss 单位为 KB"""
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def write_report(scene_dir, stage, stats, elapsed):
+    """将阶段的统计写入 <场景>/reports/<阶段>.json 和 .csv，返回 JSON 路径
+
+    计时器在多进程下为各进程耗时之和，可能大于墙钟时间 elapsed。
+    """
+    report_dir = os.path.join(scene_dir, REPORT_DIR)
+    os.makedirs(report_dir, exist_ok=True)
+    peak_rss, peak_child_rss = peak_memory_mb()
+    busy = sum(stats.timers.values())
+    elapsed = max(elapsed, 1e-9)
+    report = {
+        'scene': os.path.basename(os.path.normpath(scene_dir)),
+        'stage': stage,
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'elapsed': elapsed,
+        'peak_rss_mb': peak_rss,
+        'peak_child_rss_mb': peak_child_rss,
+        'counters': stats.counters,
+        'rates': {f"{name}_per_s": n / elapsed for name, n in stats.counters.items()},
+        'timers': {name: {'seconds': seconds, 'calls': stats.calls[name],
+                          'share': seconds / busy if busy else 0.0}
+                   for name, seconds in sorted(stats.timers.items(), key=lambda item: -item[1])},
+    }
+    json_path = os.path.join(report_dir, f"{stage}.json")
+    with open(json_path, 'w') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    with open(os.path.join(report_dir, f"{stage}.csv"), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['kind', 'name', 'value', 'calls'])
+        writer.writerow(['elapsed', stage, f"{elapsed:.6f}", ''])
+        writer.writerow(['memory', 'peak_rss_mb', f"{peak_rss:.1f}", ''])
+        writer.writerow(['memory', 'peak_child_rss_mb', f"{peak_child_rss:.1f}", ''])
+        writer.writerows(['counter', name, n, ''] for name, n in stats.counters.items())
+        writer.writerows(['timer', name, f"{item['seconds']:.6f}", item['calls']]
+                         for name, item in report['timers'].items())
+    return json_path
+
+
+@contextmanager
+def stage_report(scene_dir, stage, verbose=True):
+    """统计一个阶段的运行并在结束时写入运行报告，yield 供各步骤记录的 Stats
+
+    环境变量 PIPELINE_PROFILE 非空时同时用 cProfile 记录主进程，结果保存为 reports/<阶段>.prof，
+    可用 python -m pstats 或 snakeviz 查看；子进程中的耗时请用 workers=1 运行或使用 py-spy --subprocesses。
+    """
+    stats = Stats()
+    profiler = None
+    if os.environ.get(PROFILE_ENV):
+        import cProfile
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 同一进程中已有其他阶段在记录（pipeline 中并行的阶段），本阶段不再单独记录
+            profiler = None
+    start = time.perf_counter()
+    try:
+        yield stats
+    finally:
+        elapsed = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(os.path.join(scene_dir, REPORT_DIR), exist_ok=True)
+            profiler.dump_stats(os.path.join(scene_dir, REPORT_DIR, f"{stage}.prof"))
+        path = write_report(scene_dir, stage, stats, elapsed)
+        if verbose:
+            print(f"运行报告已保存到 {path}")
+
+
+class Progress:
+    """在同一行刷新的进度条，代替逐个文件的打印
+
+    rates 为 {显示名: (计数器名, 缩放系数)}，按 Stats 中的计数器显示吞吐量。
+    """
+
+    def __init__(self, total, label, stats=None, rates=None, width=30):
+        self.total = total
+        self.label = label
+        self.stats = stats
+        self.rates = rates or {}
+        self.width = width
+        self.done = 0
+        self.start = time.perf_counter()
+
+    def update(self, n=1):
+        self.done += n
+        elapsed = max(time.perf_counter() - self.start, 1e-6)
+        filled = int(self.width * self.done / self.total) if self.total else self.width
+        line = (f"\r{self.label} [{'#' * filled}{'.' * (self.width - filled)}] {self.done}/{self.total} | "
+                f"{self.done / elapsed:.1f}/秒")
+        for name, (counter, scale) in self.rates.items():
+            if self.stats is not None:
+                line += f" | {self.stats.counters.get(counter, 0) * scale / elapsed:.2f} {name}"
+        sys.stdout.write(line)
+        sys.stdout.flush()
+
+    def close(self):
+        if self.done:
+            sys.stdout.write("\n")
+            sys.stdout.flush()
@@ -0,0 +1,315 @@
+import os
+import csv
+import json
+import argparse
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pcd_io import read_pcd, points_xyz
+from calibration import MAIN_LIDAR
+from instrument import Stats, Progress, stage_report
+
+# 选中的关键帧列表，merge_pcd.py、undistort.py、update_config.py 和 package_scene.py 加 --keyframes 时只处理其中的帧
+KEYFRAME_FILE = "keyframes.csv"
+# 各帧的图像哈希和点云占据栅格缓存，输入文件未变化的帧不再重新计算
+SIGNATURE_DIR = ".keyframe_cache"
+# 计算图像感知哈希的相机
+KEYFRAME_CAMERA = "CAM_FRONT_3M"
+# 感知哈希：缩小到 32x32 灰度图后取 DCT 左上角 8x8 低频系数与中位数比较，共 64 位
+HASH_RESIZE = 32
+HASH_SIZE = 8
+# 点云占据栅格：主雷达坐标系下 ±51.2 米、0.4 米的鸟瞰网格，只统计高于地面的点
+CLOUD_RANGE = 51.2
+CLOUD_VOXEL = 0.4
+CLOUD_Z_RANGE = (-1.4, 3.0)
+# 与上一个关键帧相比的变化超过阈值时保留：图像为哈希的汉明距离比例，点云为占据栅格的 Jaccard 距离
+IMAGE_THRESHOLD = 0.1
+CLOUD_THRESHOLD = 0.3
+# 静止时至少每隔 MAX_INTERVAL 秒保留一帧
+MAX_INTERVAL = 2.0
+METHODS = ('image', 'cloud', 'both')
+# 每个字节中为 1 的位数，用于对打包的位数组计算汉明距离和交并集大小
+POPCOUNT = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.int32)
+
+
+def image_signature(image_path):
+    """图像的 64 位感知哈希，打包为 8 字节"""
+    import cv2
+    # 解码时直接缩小到 1/8，JPEG 可跳过大部分解码工作
+    img = cv2.imread(image_path, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+    if img is None:
+        raise ValueError(f"无法读取图像: {image_path}")
+    small = cv2.resize(img, (HASH_RESIZE, HASH_RESIZE), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE]
+    return np.packbits((low > np.median(low)).ravel())
+
+
+def cloud_signature(pcd_path):
+    """点云的鸟瞰占据栅格，打包为位数组"""
+    xyz = points_xyz(read_pcd(pcd_path, mmap=True))
+    cells = int(round(2 * CLOUD_RANGE / CLOUD_VOXEL))
+    keep = ((np.abs(xyz[:, 0]) < CLOUD_RANGE) & (np.abs(xyz[:, 1]) < CLOUD_RANGE)
+            & (xyz[:, 2] > CLOUD_Z_RANGE[0]) & (xyz[:, 2] < CLOUD_Z_RANGE[1]))
+    ij = ((xyz[keep, :2] + CLOUD_RANGE) / CLOUD_VOXEL).astype(np.int64)
+    np.clip(ij, 0, cells - 1, out=ij)
+    grid = np.zeros(cells * cells, dtype=bool)
+    grid[ij[:, 0] * cells + ij[:, 1]] = True
+    return np.packbits(grid)
+
+
+SIGNATURES = {'image': image_signature, 'cloud': cloud_signature}
+
+
+def _signature_job(job):
+    """进程池任务，返回 (签名, 错误信息)"""
+    kind, path = job
+    try:
+        return SIGNATURES[kind](path), None
+    except Exception as e:
+        return None, str(e)
+
+
+def file_stamp(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def signature_params(kind):
+    """签名的计算参数，参数变化时缓存失效"""
+    if kind == 'image':
+        return json.dumps({'camera': KEYFRAME_CAMERA, 'resize': HASH_RESIZE, 'size': HASH_SIZE})
+    return json.dumps({'lidar': MAIN_LIDAR, 'range': CLOUD_RANGE, 'voxel': CLOUD_VOXEL, 'z': CLOUD_Z_RANGE})
+
+
+def load_signatures(scene_dir, kind, timestamps, paths, workers=1, stats=None):
+    """计算所有帧的签名，返回 (帧数, 字节数) 的 uint8 数组，输入文件未变化的帧直接读取缓存"""
+    stats = stats if stats is not None else Stats()
+    cache_path = os.path.join(scene_dir, SIGNATURE_DIR, f"{kind}.npz")
+    stamps = np.array([file_stamp(path) for path in paths], dtype=np.int64).reshape(-1, 2)
+    params = signature_params(kind)
+    cached = {}
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            if str(data['params']) == params:
+                cached = {ts: (tuple(stamp), sig) for ts, stamp, sig in
+                          zip(data['timestamps'], data['stamps'], data['signatures'])}
+
+    signatures = [None] * len(timestamps)
+    pending = []
+    for i, (ts, stamp) in enumerate(zip(timestamps, stamps)):
+        hit = cached.get(ts)
+        if hit is not None and hit[0] == tuple(stamp):
+            signatures[i] = hit[1]
+        else:
+            pending.append(i)
+
+    if pending:
+        jobs = [(kind, paths[i]) for i in pending]
+        progress = Progress(len(jobs), f"计算{'图像哈希' if kind == 'image' else '点云栅格'}")
+        with stats.timer(f"signature.{kind}"):
+            if workers > 1:
+                executor = ProcessPoolExecutor(max_workers=workers)
+                results = executor.map(_signature_job, jobs, chunksize=max(1, len(jobs) // (workers * 8)))
+            else:
+                executor = None
+                results = map(_signature_job, jobs)
+            try:
+                for i, (signature, error) in zip(pending, results):
+                    if error is not None:
+                        raise ValueError(f"{paths[i]}: {error}")
+                    signatures[i] = signature
+                    progress.update()
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+                progress.close()
+        stats.count(f"computed.{kind}", len(pending))
+
+    signatures = np.stack(signatures) if signatures else np.zeros((0, 0), dtype=np.uint8)
+    if pending:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, timestamps=np.array(timestamps), stamps=stamps, signatures=signatures, params=params)
+        os.replace(tmp_path, cache_path)
+    return signatures
+
+
+def hamming_change(a, b):
+    """打包位数组之间不同位的比例，a、b 可以按行广播"""
+    return POPCOUNT[np.bitwise_xor(a, b)].sum(axis=-1) / (8 * a.shape[-1])
+
+
+def jaccard_change(a, b):
+    """打包位数组之间的 Jaccard 距离 1 - |A∩B| / |A∪B|，两者都为空时为 0"""
+    inter = POPCOUNT[np.bitwise_and(a, b)].sum(axis=-1)
+    union = POPCOUNT[np.bitwise_or(a, b)].sum(axis=-1)
+    return np.where(union > 0, 1.0 - inter / np.maximum(union, 1), 0.0)
+
+
+CHANGES = {'image': hamming_change, 'cloud': jaccard_change}
+
+
+def timestamp_seconds(timestamps):
+    """按数量级把纳秒/微秒/毫秒/秒时间戳统一换算为秒"""
+    values = np.array([int(ts) for ts in timestamps], dtype=np.float64)
+    if len(values) == 0:
+        return values
+    for scale in (1e18, 1e15, 1e12):
+        if values.max() >= scale / 10:
+            return values / (scale / 1e9)
+    return values
+
+
+def select_keyframes(seconds, signatures, thresholds, scale=1.0, max_interval=MAX_INTERVAL, min_interval=0.0,
+                     chunk=64):
+    """从第一帧开始贪心地选择关键帧，返回选中帧的下标
+
+    候选帧与上一个关键帧相比，任一签名的变化量除以对应阈值后不小于 scale，且间隔不小于 min_interval 时保留；
+    间隔超过 max_interval 时无论变化多少都保留。每次按 chunk 帧一组向量化计算与上一个关键帧的变化量。
+    """
+    n = len(seconds)
+    if n == 0:
+        return []
+    selected = [0]
+    last = 0
+    start = 1
+    while start < n:
+        stop = min(n, start + chunk)
+        score = np.zeros(stop - start)
+        for kind, sigs in signatures.items():
+            score = np.maximum(score, CHANGES[kind](sigs[start:stop], sigs[last]) / thresholds[kind])
+        gap = seconds[start:stop] - seconds[last]
+        keep = (score >= scale) & (gap >= min_interval)
+        if max_interval:
+            keep |= gap > max_interval
+        hits = np.flatnonzero(keep)
+        if len(hits):
+            last = start + int(hits[0])
+            selected.append(last)
+            start = last + 1
+        else:
+            start = stop
+    return selected
+
+
+def select_at_rate(seconds, signatures, thresholds, rate, max_interval=MAX_INTERVAL, min_interval=0.0):
+    """按目标帧率选择关键帧：二分查找变化量的缩放系数，使选中的帧数不超过 时长 × rate + 1
+
+    与均匀抽帧相比，同样的帧数会集中在变化较大的时段。返回 (选中帧的下标, 缩放系数)。
+    """
+    budget = max(1, int((seconds[-1] - seconds[0]) * rate) + 1) if len(seconds) else 0
+    lo, hi = 0.0, 1.0
+    # 先找到选中帧数不超过预算的上界
+    while len(select_keyframes(seconds, signatures, thresholds, hi, max_interval, min_interval)) > budget and hi < 1e6:
+        lo, hi = hi, hi * 2
+    for _ in range(30):
+        mid = (lo + hi) / 2
+        if len(select_keyframes(seconds, signatures, thresholds, mid, max_interval, min_interval)) > budget:
+            lo = mid
+        else:
+            hi = mid
+    return select_keyframes(seconds, signatures, thresholds, hi, max_interval, min_interval), hi
+
+
+def keyframe_inputs(scene_dir, kind, timestamps):
+    """各帧用于计算签名的文件，图像按时间戳匹配 png/jpg"""
+    if kind == 'cloud':
+        return [os.path.join(scene_dir, MAIN_LIDAR, f"{ts}.pcd") for ts in timestamps]
+    camera_dir = os.path.join(scene_dir, KEYFRAME_CAMERA)
+    images = {os.path.splitext(f)[0]: f for f in os.listdir(camera_dir)}
+    missing = [ts for ts in timestamps if ts not in images]
+    if missing:
+        raise FileNotFoundError(f"{camera_dir} 缺少 {len(missing)} 帧 (如 {', '.join(missing[:3])})")
+    return [os.path.join(camera_dir, images[ts]) for ts in timestamps]
+
+
+def write_keyframes(scene_dir, timestamps, changes, selected):
+    """写入 keyframes.csv：每帧与前一帧相比的变化量以及是否被选为关键帧"""
+    keep = np.zeros(len(timestamps), dtype=bool)
+    keep[selected] = True
+    kinds = list(changes)
+    path = os.path.join(scene_dir, KEYFRAME_FILE)
+    with open(path + '.tmp', 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['timestamp'] + [f"{kind}_change" for kind in kinds] + ['keyframe'])
+        for i, ts in enumerate(timestamps):
+            writer.writerow([ts] + [f"{changes[kind][i]:.4f}" for kind in kinds] + [int(keep[i])])
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_keyframes(scene_dir):
+    """读取场景中选中的关键帧时间戳，未运行过关键帧选择时返回 None"""
+    path = os.path.join(scene_dir, KEYFRAME_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', newline='') as f:
+        return [row['timestamp'] for row in csv.DictReader(f) if row['keyframe'] == '1']
+
+
+def scene_keyframes(scene_dir):
+    """--keyframes 时使用的帧列表，没有 keyframes.csv 时报错，避免静默处理全部帧"""
+    frames = load_keyframes(scene_dir)
+    if frames is None:
+        raise FileNotFoundError(f"{scene_dir} 中没有 {KEYFRAME_FILE}，请先运行 python utils/keyframes.py --path {scene_dir}")
+    return frames
+
+
+def select_scene_keyframes(scene_dir, method='both', rate=None, image_threshold=IMAGE_THRESHOLD,
+                           cloud_threshold=CLOUD_THRESHOLD, max_interval=MAX_INTERVAL, min_interval=0.0, workers=1):
+    """为一个场景选择关键帧并写入 keyframes.csv，返回选中的时间戳
+
+    method 为 image（CAM_FRONT_3M 的感知哈希）、cloud（主雷达的鸟瞰占据栅格）或 both。
+    指定 rate（帧/秒）时按目标帧率选择，否则按变化阈值选择。
+    """
+    from merge_pcd import list_timestamps
+    kinds = ['image', 'cloud'] if method == 'both' else [method]
+    thresholds = {'image': image_threshold, 'cloud': cloud_threshold}
+    with stage_report(scene_dir, 'keyframes') as stats:
+        timestamps = list_timestamps(scene_dir)
+        seconds = timestamp_seconds(timestamps)
+        signatures = {}
+        for kind in kinds:
+            paths = keyframe_inputs(scene_dir, kind, timestamps)
+            signatures[kind] = load_signatures(scene_dir, kind, timestamps, paths, workers, stats)
+
+        with stats.timer('select'):
+            # 与前一帧相比的变化量只用于输出检查，第一帧记为 0
+            changes = {kind: np.concatenate([[0.0], CHANGES[kind](sigs[1:], sigs[:-1])]) if len(sigs) else np.zeros(0)
+                       for kind, sigs in signatures.items()}
+            if rate:
+                selected, scale = select_at_rate(seconds, signatures, thresholds, rate, max_interval, min_interval)
+                print(f"目标 {rate} 帧/秒，变化阈值缩放系数 {scale:.3f}")
+            else:
+                selected = select_keyframes(seconds, signatures, thresholds, 1.0, max_interval, min_interval)
+        path = write_keyframes(scene_dir, timestamps, changes, selected)
+        stats.count('frames', len(timestamps))
+        stats.count('keyframes', len(selected))
+    ratio = len(selected) / len(timestamps) if timestamps else 0.0
+    print(f"✅ {scene_dir}: 共 {len(timestamps)} 帧，选中 {len(selected)} 个关键帧 ({ratio:.1%})，已保存到 {path}")
+    return [timestamps[i] for i in selected]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按相邻帧的变化量选择关键帧，减少送去标注的冗余帧")
+    parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--method', type=str, choices=METHODS, default='both',
+                        help=f'变化量的来源：image 为 {KEYFRAME_CAMERA} 的感知哈希，cloud 为 {MAIN_LIDAR} 的占据栅格，默认为 both')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='目标关键帧率（帧/秒），指定时自动调整阈值，使变化大的时段保留更多帧')
+    parser.add_argument('--image-threshold', type=float, default=IMAGE_THRESHOLD,
+                        help=f'图像哈希变化阈值（不同位的比例），默认为 {IMAGE_THRESHOLD}')
+    parser.add_argument('--cloud-threshold', type=float, default=CLOUD_THRESHOLD,
+                        help=f'占据栅格变化阈值（Jaccard 距离），默认为 {CLOUD_THRESHOLD}')
+    parser.add_argument('--max-interval', type=float, default=MAX_INTERVAL,
+                        help=f'相邻关键帧的最大间隔（秒），静止时也按此间隔保留，0 表示不限制，默认为 {MAX_INTERVAL}')
+    parser.add_argument('--min-interval', type=float, default=0.0, help='相邻关键帧的最小间隔（秒），默认为 0')
+    parser.add_argument('--workers', type=int, default=1, help='计算签名的进程数，默认为 1')
+    args = parser.parse_args()
+    select_scene_keyframes(args.path, args.method, args.rate, args.image_threshold, args.cloud_threshold,
+                           args.max_interval, args.min_interval, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+import os
+import numpy as np
+
+# 自定义数据集的类别，类别编码为其下标
+CLASS_NAMES = ('car', 'truck', 'bus', 'bicycle', 'pedestrian', 'traffic_cone', 'barrier')
+
+
+def store_path(label_dir):
+    """标签目录对应的列式存储路径，例如 scene_1/labels -> scene_1/labels.npz"""
+    return os.path.normpath(label_dir) + '.npz'
+
+
+def label_dir_signature(label_dir):
+    """标签目录的 (文件数, 最新修改时间)，用于判断列式存储是否过期"""
+    count, latest = 0, 0
+    with os.scandir(label_dir) as entries:
+        for entry in entries:
+            if entry.name.endswith('.txt'):
+                count += 1
+                latest = max(latest, entry.stat().st_mtime_ns)
+    return count, latest
+
+
+def read_label_dir(label_dir):
+    """读取目录下所有 "x y z dx dy dz yaw class" 标注文件，返回列式数组的字典
+
+    frames 为按文件名排序的帧名，第 i 帧的框为 boxes[offsets[i]:offsets[i + 1]]；classes 为 class_names 中的下标，
+    不在 CLASS_NAMES 中的类别追加到 class_names 末尾；lines 为每个框在原文件中的行号。
+    格式错误或数值无法转换的行不进入数组，记录在 error_frames/error_lines/error_messages 中。
+    """
+    files = sorted(f for f in os.listdir(label_dir) if f.endswith('.txt'))
+    names = list(CLASS_NAMES)
+    codes = {name: i for i, name in enumerate(names)}
+    rows, frames, lines, classes = [], [], [], []
+    errors = []
+    for frame, filename in enumerate(files):
+        with open(os.path.join(label_dir, filename), 'r') as f:
+            for line_idx, line in enumerate(f):
+                parts = line.split()
+                if len(parts) != 8:
+                    errors.append((frame, line_idx + 1, f"数据长度不为 8，实际为 {len(parts)}"))
+                    continue
+                label = parts[7]
+                if label not in codes:
+                    codes[label] = len(names)
+                    names.append(label)
+                rows.append(parts[:7])
+                frames.append(frame)
+                lines.append(line_idx + 1)
+                classes.append(codes[label])
+
+    valid = np.ones(len(rows), dtype=bool)
+    try:
+        # 所有行一次性转换为浮点数
+        boxes = np.array(rows, dtype=np.float32).reshape(-1, 7)
+    except ValueError:
+        # 存在无法转换的数值时逐行定位，去掉这些行
+        boxes = np.zeros((len(rows), 7), dtype=np.float32)
+        for i, row in enumerate(rows):
+            try:
+                boxes[i] = [float(v) for v in row]
+            except ValueError as e:
+                valid[i] = False
+                errors.append((frames[i], lines[i], f"数值转换失败 - {e}"))
+
+    frames = np.array(frames, dtype=np.int64)[valid]
+    errors.sort(key=lambda item: (item[0], item[1]))
+    return {
+        'frames': np.array([os.path.splitext(f)[0] for f in files], dtype=str),
+        'offsets': np.searchsorted(frames, np.arange(len(files) + 1)).astype(np.int64),
+        'boxes': boxes[valid],
+        'classes': np.array(classes, dtype=np.int8)[valid],
+        'lines': np.array(lines, dtype=np.int32)[valid],
+        'class_names': np.array(names, dtype=str),
+        'error_frames': np.array([e[0] for e in errors], dtype=np.int32),
+        'error_lines': np.array([e[1] for e in errors], dtype=np.int32),
+        'error_messages': np.array([e[2] for e in errors], dtype=str),
+        'signature': np.array(label_dir_signature(label_dir), dtype=np.int64),
+    }
+
+
+def build_label_store(label_dir, path=None):
+    """将标签目录转换为列式存储（默认为 <标签目录>.npz），返回 LabelStore"""
+    path = path or store_path(label_dir)
+    columns = read_label_dir(label_dir)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **columns)
+    os.replace(path + '.tmp', path)
+    return LabelStore(path)
+
+
+def open_label_store(label_dir, rebuild=True):
+    """打开标签目录对应的列式存储，存储不存在或标签文件有变化时重新生成（rebuild=False 时报错）"""
+    path = store_path(label_dir)
+    if os.path.exists(path):
+        store = LabelStore(path)
+        if not os.path.isdir(label_dir) or tuple(store.signature) == label_dir_signature(label_dir):
+            return store
+    if not rebuild:
+        raise FileNotFoundError(f"列式标签存储不存在或已过期: {path}")
+    return build_label_store(label_dir, path)
+
+
+class LabelStore:
+    """读取场景级列式标签存储，按帧取出的框和类别都是整体数组的切片，不复制数据"""
+
+    def __init__(self, path):
+        with np.load(path) as data:
+            self.frames = data['frames']
+            self.offsets = data['offsets']
+            self.boxes = data['boxes']
+            self.classes = data['classes']
+            self.lines = data['lines']
+            self.class_names = [str(name) for name in data['class_names']]
+            self.error_frames = data['error_frames']
+            self.error_lines = data['error_lines']
+            self.error_messages = data['error_messages']
+            self.signature = data['signature']
+        self._index = {str(frame): i for i, frame in enumerate(self.frames)}
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __contains__(self, name):
+        return str(name) in self._index
+
+    def __getitem__(self, i):
+        """按帧序号返回 ((n, 7) float32 框, (n,) int8 类别编码)"""
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.boxes[start:end], self.classes[start:end]
+
+    def frame(self, name):
+        """按帧名（标签文件名去掉 .txt）返回该帧的框和类别编码"""
+        if str(name) not in self._index:
+            raise KeyError(f"存储中不存在帧: {name}")
+        return self[self._index[str(name)]]
+
+    def frame_ids(self):
+        """每个框所属的帧序号"""
+        return np.repeat(np.arange(len(self.frames)), np.diff(self.offsets))
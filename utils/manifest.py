@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import sqlite3
+
+# 每个场景目录下的构建记录文件
+MANIFEST_NAME = ".build_manifest.sqlite"
+
+
+def file_signature(paths):
+    """返回输入文件的 [路径, 大小, 修改时间(ns)] 列表，文件不存在时大小和时间为 None"""
+    signature = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            signature.append([path, st.st_size, st.st_mtime_ns])
+        except FileNotFoundError:
+            signature.append([path, None, None])
+    return signature
+
+
+def config_hash(files=(), **options):
+    """对标定等配置文件的内容以及影响输出的参数计算哈希"""
+    digest = hashlib.sha1()
+    for path in files:
+        digest.update(path.encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+
+class Manifest:
+    """场景级的增量构建记录，按 (阶段, 帧) 保存输入签名、配置哈希和输出文件
+
+    重新运行某个阶段时，输入文件的大小和修改时间、配置哈希都未变化且输出文件仍存在的帧视为最新，可以跳过。
+    """
+
+    def __init__(self, scene_dir, stage, config=''):
+        self.stage = stage
+        self.config = config
+        self.conn = sqlite3.connect(os.path.join(scene_dir, MANIFEST_NAME), timeout=60)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS frames ("
+            "stage TEXT, frame TEXT, config TEXT, inputs TEXT, outputs TEXT, PRIMARY KEY (stage, frame))")
+        self._records = {
+            frame: (config, inputs, json.loads(outputs))
+            for frame, config, inputs, outputs in self.conn.execute(
+                "SELECT frame, config, inputs, outputs FROM frames WHERE stage = ?", (stage,))
+        }
+        self._pending = []
+
+    def is_fresh(self, frame, inputs, outputs):
+        """该帧的输入、配置和输出都与上次构建一致时返回 True"""
+        record = self._records.get(frame)
+        if record is None:
+            return False
+        config, signature, recorded_outputs = record
+        return (config == self.config
+                and signature == json.dumps(file_signature(inputs))
+                and recorded_outputs == list(outputs)
+                and all(os.path.exists(path) for path in outputs))
+
+    def record(self, frame, inputs, outputs):
+        """记录一帧的构建结果，每 256 帧写入一次数据库"""
+        signature = json.dumps(file_signature(inputs))
+        self._records[frame] = (self.config, signature, list(outputs))
+        self._pending.append((self.stage, frame, self.config, signature, json.dumps(list(outputs))))
+        if len(self._pending) >= 256:
+            self.flush()
+
+    def flush(self):
+        if self._pending:
+            with self.conn:
+                self.conn.executemany("INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?)", self._pending)
+            self._pending = []
+
+    def close(self):
+        self.flush()
+        self.conn.close()
@@ -1,48 +1,321 @@
-import open3d as o3d
 import numpy as np
-import json
 import os
+import time
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+from pcd_io import read_pcd, read_pcd_header, write_pcd, points_xyz, xyz_view, resolve_pcd_format
+from point_store import PointStoreWriter, STORE_FIELDS, STORE_DTYPES
+from manifest import Manifest, config_hash
+from instrument import Stats, Progress, stage_report
+from calibration import LIDARS, MAIN_LIDAR, LIDAR_EXTRINSICS, load_calibration
 
-# 加载外参矩阵
-with open("utils/lidar2m32.json", "r") as f:
-    transforms = json.load(f)
+def load_lidar_transforms(direction="sensor2main"):
+    """从已校验的标定中取出各雷达的 float32 4x4 外参，direction 的含义见 Calibration.lidar_transforms"""
+    return load_calibration().lidar_transforms(direction)
 
-def apply_transform(pcd, matrix):
-    pcd.transform(np.array(matrix))
-    return pcd
+def transform_xyz(xyz, matrix):
+    """用一次批量矩阵乘法原地变换 (N, 3) 坐标"""
+    xyz[:] = xyz @ matrix[:3, :3].T + matrix[:3, 3]
 
-def transform2lidar32(pcd, matrix):
-    matrix = np.linalg.inv(np.array(matrix))
-    pcd.transform(matrix)
-    return pcd
+def apply_transform(points, matrix):
+    """对结构化点云的 xyz 坐标应用 4x4 变换矩阵，其余字段保持不变"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    xyz = xyz_view(points)
+    if xyz is not None:
+        transform_xyz(xyz, matrix)
+        return points
+    xyz = points_xyz(points)
+    transform_xyz(xyz, matrix)
+    points['x'], points['y'], points['z'] = xyz[:, 0], xyz[:, 1], xyz[:, 2]
+    return points
 
-def merge_all_lidars(timestamp, scene_dir):
-    merged_pcd = o3d.geometry.PointCloud()
-    for lidar_name in ["LIDAR_FRONT", "LIDAR_REAR", "LIDAR_TOP_32"]:
+def merged_dtype(dtypes):
+    """合并各雷达的字段，xyz 在前，同名字段取兼容的数据类型，丢弃 '_' 开头的填充字段"""
+    formats = {}
+    for dtype in dtypes:
+        for name in dtype.names:
+            if name.startswith('_'):
+                continue
+            field = dtype[name]
+            formats[name] = np.promote_types(formats[name], field) if name in formats else field
+    names = ['x', 'y', 'z'] + [name for name in formats if name not in ('x', 'y', 'z')]
+    return np.dtype([(name, formats.get(name, np.dtype(np.float32))) for name in names])
+
+def box_mask(xyz, box):
+    """返回落在轴对齐框 (xmin, ymin, zmin, xmax, ymax, zmax) 内的点的掩码"""
+    lower = np.asarray(box[:3], dtype=xyz.dtype)
+    upper = np.asarray(box[3:], dtype=xyz.dtype)
+    return np.all((xyz >= lower) & (xyz <= upper), axis=1)
+
+def voxel_downsample(points, voxel_size):
+    """体素降采样，每个体素保留一个点，坐标取体素内所有点的质心，其余字段取体素内第一个点的值"""
+    if len(points) == 0:
+        return points
+    xyz = points_xyz(points, np.float64)
+    # 坐标为 NaN/inf 的无效点没有所属体素，直接丢弃
+    finite = np.isfinite(xyz).all(axis=1)
+    if not finite.all():
+        points, xyz = points[finite], xyz[finite]
+        if len(points) == 0:
+            return points
+    voxel = np.floor(xyz / voxel_size).astype(np.int64)
+    voxel -= voxel.min(axis=0)
+    dims = voxel.max(axis=0) + 1
+    # 体素索引线性化为唯一的 int64 键
+    keys = (voxel[:, 0] * dims[1] + voxel[:, 1]) * dims[2] + voxel[:, 2]
+    _, first, inverse, counts = np.unique(keys, return_index=True, return_inverse=True, return_counts=True)
+    downsampled = points[first]
+    for axis, name in enumerate(('x', 'y', 'z')):
+        downsampled[name] = np.bincount(inverse, weights=xyz[:, axis]) / counts
+    return downsampled
+
+def filter_points(points, roi=None, ego_box=None, voxel_size=None):
+    """ROI 裁剪、去除自车点和体素降采样，未指定的步骤跳过；启用任一过滤时同时去掉坐标为 NaN/inf 的无效点"""
+    if roi is not None or ego_box is not None:
+        xyz = xyz_view(points)
+        if xyz is None:
+            xyz = points_xyz(points)
+        keep = np.isfinite(xyz).all(axis=1)
+        if roi is not None:
+            keep &= box_mask(xyz, roi)
+        if ego_box is not None:
+            keep &= ~box_mask(xyz, ego_box)
+        points = points[keep]
+    if voxel_size:
+        points = voxel_downsample(points, voxel_size)
+    return points
+
+def merge_all_lidars(timestamp, scene_dir, transforms, pcd_format='binary', verbose=True, filters=None, save_pcd=True,
+                     stats=None):
+    """合并一帧的所有雷达点云，返回 (合并后过滤前的点数, 最终点云)
+
+    指定 stats 时按雷达记录读取、变换的耗时，以及过滤、写入的耗时和点数、字节数。
+    """
+    stats = stats or Stats()
+    # 先读取文件头，根据点数和字段一次性分配输出数组
+    sources = []
+    for lidar_name in LIDARS:
         pcd_path = f"{scene_dir}/{lidar_name}/{timestamp}.pcd"
         if os.path.exists(pcd_path):
-            pcd = o3d.io.read_point_cloud(pcd_path)
-            # 只有非主雷达才需要变换
-            if lidar_name != "LIDAR_TOP_32":
-                pcd = apply_transform(pcd, transforms[lidar_name])
+            with stats.timer(f"read.{lidar_name}"):
+                sources.append((lidar_name, pcd_path, read_pcd_header(pcd_path)))
+            stats.count('bytes_in', os.path.getsize(pcd_path))
+    merged = np.zeros(sum(header['points'] for _, _, header in sources),
+                      dtype=merged_dtype([header['dtype'] for _, _, header in sources]))
+
+    # 逐个雷达将点写入各自的切片，缺失的字段保持为 0，再在切片上原地变换坐标
+    offset = 0
+    for lidar_name, pcd_path, header in sources:
+        with stats.timer(f"read.{lidar_name}"):
+            points = read_pcd(pcd_path, mmap=True, header=header)
+            segment = merged[offset:offset + len(points)]
+            for name in points.dtype.names:
+                if name in merged.dtype.names:
+                    segment[name] = points[name]
+            del points
+        # 只有非主雷达才需要变换
+        if lidar_name != MAIN_LIDAR:
+            with stats.timer(f"transform.{lidar_name}"):
+                apply_transform(segment, transforms[lidar_name])
+            if verbose:
                 print(f"已应用变换矩阵到 {lidar_name}")
-            merged_pcd += pcd
+        offset += len(segment)
+
+    # 可选的过滤阶段
+    n_merged = len(merged)
+    stats.count('frames')
+    stats.count('points', n_merged)
+    if filters:
+        with stats.timer('filter'):
+            merged = filter_points(merged, **filters)
+        if verbose:
+            print(f"过滤后点数: {n_merged} -> {len(merged)}")
 
     # 保存合并后的点云
-    o3d.io.write_point_cloud(f"{scene_dir}/lidar_point_cloud_0/{timestamp}.pcd", merged_pcd)
-    print(f"已保存合并后的点云：{scene_dir}/lidar_point_cloud_0/{timestamp}.pcd")
+    if save_pcd:
+        output_path = f"{scene_dir}/lidar_point_cloud_0/{timestamp}.pcd"
+        with stats.timer('write'):
+            write_pcd(output_path, merged, data=pcd_format)
+        stats.count('bytes_out', os.path.getsize(output_path))
+        if verbose:
+            print(f"已保存合并后的点云：{scene_dir}/lidar_point_cloud_0/{timestamp}.pcd")
+    return n_merged, merged
+
+def frame_inputs(timestamp, scene_dir):
+    """一帧合并所用的各雷达点云路径"""
+    return [f"{scene_dir}/{lidar_name}/{timestamp}.pcd" for lidar_name in LIDARS]
+
+def frame_output(timestamp, scene_dir):
+    return f"{scene_dir}/lidar_point_cloud_0/{timestamp}.pcd"
+
+# 子进程中的外参矩阵，每个进程只加载一次
+_worker_transforms = None
+
+def _init_worker(direction):
+    global _worker_transforms
+    _worker_transforms = load_lidar_transforms(direction)
+
+def _merge_job(job):
+    """进程池任务，返回 (时间戳, 合并后点数, 过滤后点数, 点云或 None, 统计, 错误信息)
+
+    只有需要写入打包存储时才把点云传回主进程。
+    """
+    timestamp, scene_dir, pcd_format, verbose, filters, save_pcd, return_points = job
+    stats = Stats()
+    try:
+        n_merged, points = merge_all_lidars(timestamp, scene_dir, _worker_transforms, pcd_format, verbose, filters,
+                                            save_pcd, stats)
+        return timestamp, n_merged, len(points), points if return_points else None, stats.to_dict(), None
+    except Exception as e:
+        return timestamp, 0, 0, None, stats.to_dict(), str(e)
+
+def merge_frames(timestamps, scene_dir, pcd_format='binary', workers=1, direction="sensor2main", verbose=False,
+                 filters=None, store=None, save_pcd=True, manifest=None, stats=None):
+    """合并所有帧，workers 大于 1 时按时间戳分发到进程池，在同一行显示进度和吞吐量
+
+    指定 filters 时每帧过滤前后的点数写入场景目录下的 merge_filter_report.csv。
+    指定 store（PointStoreWriter）时每帧点云同时追加到场景级打包存储中。
+    指定 manifest 时记录每个成功合并的帧，供下次运行跳过。
+    指定 stats 时汇总各进程的分步耗时和计数。
+    """
+    stats = stats if stats is not None else Stats()
+    start = time.time()
+    total_points = 0
+    kept_points = 0
+    report = []
+    failures = []
+    jobs = [(ts, scene_dir, pcd_format, verbose, filters, save_pcd, store is not None) for ts in timestamps]
+    progress = None if verbose else Progress(len(jobs), "合并点云", stats,
+                                             {'M点/秒': ('points', 1e-6), 'MB/秒': ('bytes_in', 2**-20)})
+
+    if workers > 1:
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                       initargs=(direction,))
+        results = executor.map(_merge_job, jobs, chunksize=max(1, len(jobs) // (workers * 8)))
+    else:
+        executor = None
+        _init_worker(direction)
+        results = map(_merge_job, jobs)
+
+    try:
+        for timestamp, n_points, n_kept, points, job_stats, error in results:
+            stats.merge(job_stats)
+            total_points += n_points
+            kept_points += n_kept
+            report.append((timestamp, n_points, n_kept))
+            if points is not None:
+                with stats.timer('store'):
+                    store.append(timestamp, points)
+            if error is not None:
+                failures.append((timestamp, error))
+                print(f"\n合并 {timestamp} 时出错: {error}")
+            elif manifest is not None:
+                manifest.record(timestamp, frame_inputs(timestamp, scene_dir), [frame_output(timestamp, scene_dir)])
+            if progress is not None:
+                progress.update()
+    finally:
+        if executor is not None:
+            executor.shutdown()
+        if progress is not None:
+            progress.close()
+
+    elapsed = time.time() - start
+    print(f"合并完成: {len(jobs) - len(failures)} 帧成功，{len(failures)} 帧失败，"
+          f"共 {total_points} 个点，耗时 {elapsed:.1f} 秒")
+    if filters:
+        ratio = kept_points / total_points if total_points else 0.0
+        print(f"过滤后保留 {kept_points} 个点 ({ratio:.1%})")
+        with open(os.path.join(scene_dir, "merge_filter_report.csv"), 'w') as f:
+            f.write("timestamp,points_before,points_after\n")
+            f.writelines(f"{ts},{before},{after}\n" for ts, before, after in sorted(report))
+    return failures
+
+def list_timestamps(scene_dir):
+    """按主雷达目录列出场景中所有帧的时间戳"""
+    return sorted(str(int(f.split('.')[0])) for f in os.listdir(os.path.join(scene_dir, MAIN_LIDAR)))
+
+def merge_manifest(scene_dir, direction='sensor2main', pcd_format='binary', filters=None):
+    """打开场景的 merge 阶段构建记录，外参、方向、格式和过滤参数变化时所有帧都需要重新合并"""
+    return Manifest(scene_dir, 'merge', config_hash([LIDAR_EXTRINSICS], direction=direction,
+                                                    pcd_format=pcd_format, filters=filters))
+
+def merge_scene(scene_dir, pcd_format='binary', workers=1, direction='sensor2main', force=False, verbose=False,
+                filters=None, store=False, store_only=False, store_dtype='float32', store_fields=STORE_FIELDS,
+                timestamps=None):
+    """合并一个场景的所有帧，返回失败的帧
+
+    未指定 timestamps 时处理主雷达目录下的所有帧，构建记录中已是最新的帧会被跳过（force=True 时全部重新合并）。
+    """
+    os.makedirs(os.path.join(scene_dir, "lidar_point_cloud_0"), exist_ok=True)
+    # 构建记录中保存实际写出的格式
+    pcd_format = resolve_pcd_format(pcd_format)
+    with stage_report(scene_dir, 'merge') as stats:
+        # 遍历所有时间戳
+        if timestamps is None:
+            timestamps = list_timestamps(scene_dir)
+        writer = None
+        if store or store_only:
+            writer = PointStoreWriter(os.path.join(scene_dir, "points_store"), store_fields, store_dtype)
+
+        # 只写打包存储时没有逐帧输出，每帧都需要重新合并
+        manifest = None
+        if not store_only:
+            manifest = merge_manifest(scene_dir, direction, pcd_format, filters)
+            if not force:
+                with stats.timer('manifest'):
+                    pending = [ts for ts in timestamps
+                               if not manifest.is_fresh(ts, frame_inputs(ts, scene_dir), [frame_output(ts, scene_dir)])]
+                print(f"共 {len(timestamps)} 帧，跳过已是最新的 {len(timestamps) - len(pending)} 帧")
+                if writer is not None:
+                    # 跳过的帧直接从已有结果读入打包存储
+                    for ts in sorted(set(timestamps) - set(pending)):
+                        writer.append(ts, read_pcd(frame_output(ts, scene_dir), mmap=True))
+                timestamps = pending
+
+        failures = merge_frames(timestamps, scene_dir, pcd_format, workers, direction=direction, verbose=verbose,
+                                filters=filters, store=writer, save_pcd=not store_only, manifest=manifest,
+                                stats=stats)
+        if manifest is not None:
+            manifest.close()
+        if writer is not None:
+            writer.close()
+            print(f"已生成打包点云存储：{writer.store_dir}，共 {len(writer.timestamps)} 帧，{writer.total} 个点")
+    return failures
 
 def main():
     parser = argparse.ArgumentParser(description="合并所有点云")
     parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--pcd-format', type=str, choices=['binary', 'binary_compressed'], default='binary',
+                        help='合并后点云的保存格式，默认为 binary')
+    parser.add_argument('--direction', type=str, choices=['sensor2main', 'main2sensor'], default='sensor2main',
+                        help='lidar2m32.json 中外参矩阵的方向：sensor2main 表示从各雷达到 LIDAR_TOP_32（默认），'
+                             'main2sensor 表示相反方向，使用时取逆')
+    parser.add_argument('--workers', type=int, default=1, help='并行合并的进程数，默认为 1（串行）')
+    parser.add_argument('--force', action='store_true', help='重新合并所有帧，不跳过构建记录中已是最新的结果')
+    parser.add_argument('--verbose', action='store_true', help='逐帧打印处理信息，默认只显示进度')
+    parser.add_argument('--keyframes', action='store_true', help='只合并 keyframes.csv 中选中的关键帧')
+    parser.add_argument('--roi', type=float, nargs=6, default=None, metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'),
+                        help='只保留该轴对齐范围内的点（LIDAR_TOP_32 坐标系，单位米），例如 -100 -100 -5 100 100 5')
+    parser.add_argument('--ego-box', type=float, nargs=6, default=None, metavar=('XMIN', 'YMIN', 'ZMIN', 'XMAX', 'YMAX', 'ZMAX'),
+                        help='去除落在该范围内的自车车身点')
+    parser.add_argument('--voxel-size', type=float, default=None, help='体素降采样的体素边长（米），不指定则不降采样')
+    parser.add_argument('--store', action='store_true',
+                        help='同时生成场景级打包点云存储 points_store，训练时可按帧内存映射读取')
+    parser.add_argument('--store-only', action='store_true', help='只生成打包存储，不写逐帧的 .pcd 文件')
+    parser.add_argument('--store-dtype', type=str, choices=STORE_DTYPES, default='float32',
+                        help='打包存储的数据类型，int16 按 1cm 步长量化，默认为 float32')
+    parser.add_argument('--store-fields', type=str, default=','.join(STORE_FIELDS),
+                        help=f'打包存储保存的字段，逗号分隔，默认为 {",".join(STORE_FIELDS)}')
     args = parser.parse_args()
-    scene_dir = args.path
-    os.makedirs(os.path.join(scene_dir, "lidar_point_cloud_0"), exist_ok=True)
-    # 遍历所有时间戳
-    timestamps = [str(int(f.split('.')[0])) for f in os.listdir(os.path.join(scene_dir, "LIDAR_TOP_32"))]
-    for ts in timestamps:
-        merge_all_lidars(ts, scene_dir)
+    filters = None
+    if args.roi or args.ego_box or args.voxel_size:
+        filters = dict(roi=args.roi, ego_box=args.ego_box, voxel_size=args.voxel_size)
+    timestamps = None
+    if args.keyframes:
+        from keyframes import scene_keyframes
+        timestamps = scene_keyframes(args.path)
+    merge_scene(args.path, args.pcd_format, args.workers, args.direction, args.force, args.verbose, filters,
+                args.store, args.store_only, args.store_dtype, args.store_fields.split(','), timestamps)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
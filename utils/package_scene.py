@@ -0,0 +1,194 @@
+import os
+import time
+import zlib
+import struct
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from calibration import OUTPUT_DIRS
+
+# 送入标注软件的场景数据目录
+PACKAGE_DIRS = ["camera_config"] + OUTPUT_DIRS + ["lidar_point_cloud_0"]
+FRAME_DIR = "lidar_point_cloud_0"
+# 已经压缩过的图像直接存储，再次 deflate 只会浪费时间
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+# 超过该大小的文件或偏移量需要使用 zip64 扩展字段，与标准库 zipfile 一致
+ZIP64_LIMIT = (1 << 31) - 1
+
+
+def check_scene_outputs(scene_dir, frames=None):
+    """检查打包所需的目录和每一帧的文件是否齐全，返回 {目录: 缺失的帧列表}，目录不存在时为 None
+
+    未指定 frames 时以 lidar_point_cloud_0 中的所有帧为准。
+    """
+    missing = {}
+    frame_dir = os.path.join(scene_dir, FRAME_DIR)
+    if not os.path.isdir(frame_dir):
+        return {d: None for d in PACKAGE_DIRS if not os.path.isdir(os.path.join(scene_dir, d))}
+    if frames is None:
+        frames = {os.path.splitext(f)[0] for f in os.listdir(frame_dir) if f.endswith('.pcd')}
+    frames = set(frames)
+    if not frames:
+        missing[FRAME_DIR] = []
+    for d in PACKAGE_DIRS:
+        if d == FRAME_DIR and not frames:
+            continue
+        path = os.path.join(scene_dir, d)
+        if not os.path.isdir(path):
+            missing[d] = None
+            continue
+        present = {os.path.splitext(f)[0] for f in os.listdir(path)}
+        lost = sorted(frames - present)
+        if lost:
+            missing[d] = lost
+    return missing
+
+
+def dos_datetime(mtime):
+    """将修改时间转换为 zip 使用的 DOS 日期和时间"""
+    t = time.localtime(max(mtime, 315532800))
+    return (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2), ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+
+
+def _prepare_entry(path, method, level):
+    """读取文件并计算 CRC，需要压缩时进行 raw deflate，返回 (数据, CRC, 原始大小, 修改时间)
+
+    在线程池中运行，zlib 计算 CRC 和压缩时会释放 GIL。
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    crc = zlib.crc32(raw)
+    if method == ZIP_DEFLATED:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        data = compressor.compress(raw) + compressor.flush()
+    else:
+        data = raw
+    return data, crc, len(raw), os.stat(path).st_mtime
+
+
+def _local_header(name, method, crc, compress_size, file_size, date_time):
+    extra = b''
+    zip64 = file_size > ZIP64_LIMIT or compress_size > ZIP64_LIMIT
+    if zip64:
+        extra = struct.pack('<HHQQ', 0x0001, 16, file_size, compress_size)
+        compress_size = file_size = 0xFFFFFFFF
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, 0x800, method, date_time[0], date_time[1],
+                       crc, compress_size, file_size, len(name), len(extra)) + name + extra
+
+
+def _central_header(name, method, crc, compress_size, file_size, date_time, offset):
+    # zip64 扩展字段只包含超出范围的值，顺序为原始大小、压缩后大小、偏移量
+    values = []
+    if file_size > ZIP64_LIMIT:
+        values.append(file_size)
+        file_size = 0xFFFFFFFF
+    if compress_size > ZIP64_LIMIT:
+        values.append(compress_size)
+        compress_size = 0xFFFFFFFF
+    if offset > ZIP64_LIMIT:
+        values.append(offset)
+        offset = 0xFFFFFFFF
+    extra = struct.pack(f'<HH{len(values)}Q', 0x0001, 8 * len(values), *values) if values else b''
+    version = 45 if values else 20
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, 0x800, method,
+                       date_time[0], date_time[1], crc, compress_size, file_size, len(name), len(extra), 0, 0, 0,
+                       0o100644 << 16, offset) + name + extra
+
+
+def _end_records(count, cd_offset, cd_size):
+    records = b''
+    if count >= 0xFFFF or cd_offset > ZIP64_LIMIT or cd_size > ZIP64_LIMIT:
+        zip64_offset = cd_offset + cd_size
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, zip64_offset, 1)
+        count, cd_offset, cd_size = min(count, 0xFFFF), min(cd_offset, 0xFFFFFFFF), min(cd_size, 0xFFFFFFFF)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+
+def write_zip(zip_path, entries, threads=8, level=6):
+    """将 [(压缩包内路径, 文件路径)] 按顺序流式写入 zip，返回 (原始字节数, 压缩包字节数)
+
+    图像以 STORED 方式直接存储，点云和配置文件在线程池中逐文件并行 deflate，主线程按顺序写出。
+    在途的文件数不超过 4 * threads，内存占用与场景大小无关。先写入临时文件，完成后再替换。
+    """
+    central = []
+    total_raw = 0
+    pending = deque()
+    items = iter(entries)
+    tmp_path = zip_path + '.tmp'
+    with open(tmp_path, 'wb') as out, ThreadPoolExecutor(max_workers=threads) as executor:
+        while True:
+            while len(pending) < 4 * threads:
+                item = next(items, None)
+                if item is None:
+                    break
+                arcname, path = item
+                method = ZIP_STORED if path.lower().endswith(STORED_EXTENSIONS) else ZIP_DEFLATED
+                pending.append((arcname, method, executor.submit(_prepare_entry, path, method, level)))
+            if not pending:
+                break
+            arcname, method, future = pending.popleft()
+            data, crc, file_size, mtime = future.result()
+            name = arcname.encode('utf-8')
+            date_time = dos_datetime(mtime)
+            offset = out.tell()
+            out.write(_local_header(name, method, crc, len(data), file_size, date_time))
+            out.write(data)
+            central.append(_central_header(name, method, crc, len(data), file_size, date_time, offset))
+            total_raw += file_size
+
+        cd_offset = out.tell()
+        for header in central:
+            out.write(header)
+        out.write(_end_records(len(central), cd_offset, out.tell() - cd_offset))
+        zip_size = out.tell()
+    os.replace(tmp_path, zip_path)
+    return total_raw, zip_size
+
+
+def package_scene(scene_dir, zip_path=None, threads=8, level=6, frames=None):
+    """检查并将场景中送入标注软件的目录打包为 <场景名>.zip，返回压缩包路径
+
+    缺少目录或任意一帧的图像、配置文件时不生成压缩包，直接报错。指定 frames（时间戳列表）时只打包这些帧。
+    """
+    scene_name = os.path.basename(os.path.normpath(scene_dir))
+    zip_path = zip_path or os.path.join(scene_dir, f"{scene_name}.zip")
+    missing = check_scene_outputs(scene_dir, frames)
+    if missing:
+        details = []
+        for d, names in missing.items():
+            if names is None:
+                details.append(f"{d} 目录不存在")
+            elif not names:
+                details.append(f"{d} 中没有点云")
+            else:
+                details.append(f"{d} 缺少 {len(names)} 帧 (如 {', '.join(names[:3])})")
+        raise FileNotFoundError(f"{scene_dir} 数据不完整: " + '；'.join(details))
+
+    frames = set(frames) if frames is not None else None
+    entries = [(f"{d}/{fname}", os.path.join(scene_dir, d, fname))
+               for d in PACKAGE_DIRS for fname in sorted(os.listdir(os.path.join(scene_dir, d)))
+               if frames is None or os.path.splitext(fname)[0] in frames]
+    start = time.time()
+    total_raw, zip_size = write_zip(zip_path, entries, threads, level)
+    elapsed = max(time.time() - start, 1e-6)
+    print(f"已打包: {zip_path}，共 {len(entries)} 个文件，{total_raw / 2**20:.1f} MB -> {zip_size / 2**20:.1f} MB，"
+          f"耗时 {elapsed:.1f} 秒 ({total_raw / 2**20 / elapsed:.1f} MB/秒)")
+    return zip_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="检查并打包送入标注软件的场景数据")
+    parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--output', type=str, default=None, help='压缩包路径，默认为 <场景>/<场景名>.zip')
+    parser.add_argument('--threads', type=int, default=8, help='读取和压缩文件的线程数，默认为 8')
+    parser.add_argument('--level', type=int, choices=range(10), default=6, help='点云和配置文件的 deflate 压缩级别，默认为 6')
+    parser.add_argument('--keyframes', action='store_true', help='只打包 keyframes.csv 中选中的关键帧')
+    args = parser.parse_args()
+    frames = None
+    if args.keyframes:
+        from keyframes import scene_keyframes
+        frames = scene_keyframes(args.path)
+    package_scene(args.path, args.output, args.threads, args.level, frames)
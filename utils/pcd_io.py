@@ -0,0 +1,275 @@
+import struct
+import numpy as np
+
+# PCD 中 TYPE/SIZE 与 numpy 数据类型的对应关系
+PCD_TYPES = {
+    ('F', 4): 'f4', ('F', 8): 'f8',
+    ('I', 1): 'i1', ('I', 2): 'i2', ('I', 4): 'i4', ('I', 8): 'i8',
+    ('U', 1): 'u1', ('U', 2): 'u2', ('U', 4): 'u4', ('U', 8): 'u8',
+}
+NUMPY_KINDS = {'f': 'F', 'i': 'I', 'u': 'U'}
+# 本进程中是否已提示过未安装 python-lzf
+_lzf_warned = set()
+
+
+def lzf_available():
+    try:
+        import lzf  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def warn_once(key, message):
+    if key not in _lzf_warned:
+        _lzf_warned.add(key)
+        print(message)
+
+
+def resolve_pcd_format(data):
+    """binary_compressed 需要 python-lzf，未安装时提示并改用 binary，返回实际使用的格式"""
+    if data == 'binary_compressed' and not lzf_available():
+        warn_once('write', "⚠️ 未安装 python-lzf，无法写入 binary_compressed，改为 binary 格式（pip install python-lzf）")
+        return 'binary'
+    return data
+
+
+def read_pcd_header(pcd_path):
+    """读取 PCD 文件头，返回包含字段信息、点数、数据格式和文件头长度的字典"""
+    header = {}
+    with open(pcd_path, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"PCD 文件头不完整: {pcd_path}")
+            text = line.decode('ascii', errors='ignore').strip()
+            if not text or text.startswith('#'):
+                continue
+            key, _, value = text.partition(' ')
+            header[key.upper()] = value.split()
+            if key.upper() == 'DATA':
+                header['HEADER_LEN'] = f.tell()
+                break
+
+    fields = header['FIELDS']
+    sizes = [int(v) for v in header['SIZE']]
+    types = [v.upper() for v in header['TYPE']]
+    counts = [int(v) for v in header.get('COUNT', ['1'] * len(fields))]
+    width = int(header['WIDTH'][0])
+    height = int(header.get('HEIGHT', ['1'])[0])
+    points = int(header['POINTS'][0]) if 'POINTS' in header else width * height
+    return {
+        'fields': fields,
+        'sizes': sizes,
+        'types': types,
+        'counts': counts,
+        'width': width,
+        'height': height,
+        'viewpoint': [float(v) for v in header.get('VIEWPOINT', ['0', '0', '0', '1', '0', '0', '0'])],
+        'points': points,
+        'data': header['DATA'][0].lower(),
+        'header_len': header['HEADER_LEN'],
+        'dtype': header_dtype(fields, sizes, types, counts),
+    }
+
+
+def header_dtype(fields, sizes, types, counts):
+    """根据文件头字段构建紧凑排列的结构化 dtype，重名的填充字段（如 '_'）会被重命名"""
+    names, formats, seen = [], [], {}
+    for name, size, type_, count in zip(fields, sizes, types, counts):
+        if (type_, size) not in PCD_TYPES:
+            raise ValueError(f"不支持的 PCD 字段类型: {name} TYPE={type_} SIZE={size}")
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+        fmt = '<' + PCD_TYPES[(type_, size)]
+        formats.append((fmt, (count,)) if count > 1 else fmt)
+    return np.dtype({'names': names, 'formats': formats})
+
+
+def read_pcd(pcd_path, mmap=False, header=None):
+    """读取 PCD 文件为结构化 numpy 数组，保留所有字段
+
+    支持 ascii、binary 和 binary_compressed 三种格式，binary 格式可通过 mmap=True 直接内存映射。
+    已读取过文件头时可通过 header 传入，避免重复解析。
+    """
+    if header is None:
+        header = read_pcd_header(pcd_path)
+    dtype = header['dtype']
+    n = header['points']
+
+    if header['data'] == 'binary':
+        if mmap:
+            return np.memmap(pcd_path, dtype=dtype, mode='r', offset=header['header_len'], shape=(n,))
+        with open(pcd_path, 'rb') as f:
+            f.seek(header['header_len'])
+            return np.fromfile(f, dtype=dtype, count=n)
+
+    with open(pcd_path, 'rb') as f:
+        f.seek(header['header_len'])
+        body = f.read()
+
+    if header['data'] == 'binary_compressed':
+        compressed_size, uncompressed_size = struct.unpack('<II', body[:8])
+        raw = lzf_decompress(body[8:8 + compressed_size], uncompressed_size)
+        return _columns_to_points(raw, dtype, n)
+
+    if header['data'] == 'ascii':
+        points = np.empty(n, dtype=dtype)
+        if n == 0:
+            return points
+        values = np.loadtxt(body.decode('ascii').splitlines(), dtype=np.float64, ndmin=2)
+        col = 0
+        for name in dtype.names:
+            width = int(np.prod(dtype[name].shape)) if dtype[name].shape else 1
+            column = values[:n, col:col + width]
+            points[name] = column.reshape(points[name].shape)
+            col += width
+        return points
+
+    raise ValueError(f"不支持的 PCD 数据格式: {header['data']}")
+
+
+def write_pcd(pcd_path, points, data='binary', viewpoint=None):
+    """将结构化 numpy 数组写入 PCD 文件，data 为 'binary' 或 'binary_compressed'"""
+    if data not in ('binary', 'binary_compressed'):
+        raise ValueError(f"不支持的 PCD 写入格式: {data}")
+    data = resolve_pcd_format(data)
+    points = np.ascontiguousarray(points)
+    n = len(points)
+    fields, sizes, types, counts = [], [], [], []
+    for name in points.dtype.names:
+        field_dtype = points.dtype[name]
+        base = field_dtype.base
+        if base.kind not in NUMPY_KINDS:
+            raise ValueError(f"不支持的字段类型: {name} {base}")
+        fields.append(name)
+        sizes.append(str(base.itemsize))
+        types.append(NUMPY_KINDS[base.kind])
+        counts.append(str(int(np.prod(field_dtype.shape)) if field_dtype.shape else 1))
+    viewpoint = viewpoint or [0, 0, 0, 1, 0, 0, 0]
+
+    header = (
+        "# .PCD v0.7 - Point Cloud Data file format\n"
+        "VERSION 0.7\n"
+        f"FIELDS {' '.join(fields)}\n"
+        f"SIZE {' '.join(sizes)}\n"
+        f"TYPE {' '.join(types)}\n"
+        f"COUNT {' '.join(counts)}\n"
+        f"WIDTH {n}\n"
+        "HEIGHT 1\n"
+        f"VIEWPOINT {' '.join(str(v) for v in viewpoint)}\n"
+        f"POINTS {n}\n"
+        f"DATA {data}\n"
+    )
+    # 统一按小端、紧凑排列写出
+    packed = points.astype(header_dtype(fields, [int(s) for s in sizes], types, [int(c) for c in counts]), copy=False)
+
+    with open(pcd_path, 'wb') as f:
+        f.write(header.encode('ascii'))
+        if data == 'binary':
+            packed.tofile(f)
+        else:
+            # binary_compressed 按字段逐列存储后整体 LZF 压缩
+            raw = b''.join(np.ascontiguousarray(packed[name]).tobytes() for name in packed.dtype.names)
+            compressed = lzf_compress(raw)
+            f.write(struct.pack('<II', len(compressed), len(raw)))
+            f.write(compressed)
+
+
+def xyz_view(points):
+    """当 x、y、z 为相邻的同类型浮点字段时，返回共享内存的 (N, 3) 视图，否则返回 None"""
+    names = points.dtype.names
+    if names is None or not {'x', 'y', 'z'} <= set(names):
+        return None
+    fields = points.dtype.fields
+    base = fields['x'][0]
+    offset = fields['x'][1]
+    if base.kind != 'f' or base.shape or any(
+            fields[name][0] != base or fields[name][1] != offset + i * base.itemsize
+            for i, name in enumerate(('x', 'y', 'z'))):
+        return None
+    return np.ndarray((len(points), 3), dtype=base, buffer=points, offset=offset,
+                      strides=(points.dtype.itemsize, base.itemsize))
+
+
+def points_xyz(points, dtype=np.float32):
+    """取出结构化点云中的 xyz 坐标，返回 (N, 3) 数组"""
+    xyz = np.empty((len(points), 3), dtype=dtype)
+    xyz[:, 0] = points['x']
+    xyz[:, 1] = points['y']
+    xyz[:, 2] = points['z']
+    return xyz
+
+
+def _columns_to_points(raw, dtype, n):
+    """将逐字段存储的数据转换为结构化数组"""
+    points = np.empty(n, dtype=dtype)
+    offset = 0
+    for name in dtype.names:
+        field_dtype = dtype[name]
+        field_count = int(np.prod(field_dtype.shape)) if field_dtype.shape else 1
+        column = np.frombuffer(raw, dtype=field_dtype.base, count=n * field_count, offset=offset)
+        points[name] = column.reshape(points[name].shape)
+        offset += column.nbytes
+    return points
+
+
+def lzf_compress(raw):
+    """LZF 压缩，需要安装 python-lzf"""
+    try:
+        import lzf
+    except ImportError:
+        raise ImportError("写入 binary_compressed 格式需要安装 python-lzf: pip install python-lzf") from None
+    # 空点云（如滤波后没有剩余的点）写入压缩前后长度都为 0 的数据块，python-lzf 对空输入返回 None
+    if not raw:
+        return b''
+    # 输出缓冲区留出不可压缩数据的最大膨胀量，保证总能压缩成功
+    compressed = lzf.compress(raw, len(raw) + len(raw) // 32 + 16)
+    if compressed is None:
+        raise ValueError(f"LZF 压缩失败: {len(raw)} 字节")
+    return compressed
+
+
+def lzf_decompress(data, expected_size):
+    """LZF 解压，优先使用 python-lzf
+
+    未安装时使用逐个数据块循环的纯 Python 实现，只用于读取其他工具生成的压缩文件，每帧需要零点几秒。
+    """
+    if expected_size == 0:
+        return b''
+    try:
+        import lzf
+        return lzf.decompress(data, expected_size)
+    except ImportError:
+        warn_once('read', "⚠️ 未安装 python-lzf，binary_compressed 点云使用纯 Python 解压，速度很慢（pip install python-lzf）")
+
+    out = bytearray()
+    i, n = 0, len(data)
+    while i < n:
+        ctrl = data[i]
+        i += 1
+        if ctrl < 32:
+            # 字面量块
+            out += data[i:i + ctrl + 1]
+            i += ctrl + 1
+            continue
+        # 回溯引用块
+        length = ctrl >> 5
+        if length == 7:
+            length += data[i]
+            i += 1
+        ref = len(out) - ((ctrl & 0x1f) << 8) - data[i] - 1
+        i += 1
+        length += 2
+        if ref + length <= len(out):
+            out += out[ref:ref + length]
+        else:
+            for k in range(length):
+                out.append(out[ref + k])
+    if len(out) != expected_size:
+        raise ValueError(f"LZF 解压后长度不符: {len(out)} != {expected_size}")
+    return bytes(out)
@@ -0,0 +1,472 @@
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# 各阶段脚本之间按文件名互相导入，以 python -m utils.pipeline 运行时也需要能找到它们
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from instrument import Stats, Progress, write_report
+from stage_options import LINK_MODES, INTERPOLATIONS, OUTPUT_FORMATS
+
+# 每个阶段依赖的前置阶段，没有依赖关系的阶段（如点云合并和图像去畸变）同时运行
+STAGES = {
+    'align': (),
+    'keyframes': ('align',),
+    'merge': ('align', 'keyframes'),
+    'undistort': ('align', 'keyframes'),
+    'config': ('merge',),
+    'package': ('merge', 'undistort', 'config'),
+    'labels': (),
+    'check': ('labels',),
+}
+DEFAULT_STAGES = "merge,undistort,config,package"
+# 批处理时按帧分发到共享进程池的阶段
+FRAME_STAGES = ('merge', 'undistort')
+BATCH_STATE = ".batch_state.json"
+BATCH_REPORT = "batch_report.json"
+
+
+# 各阶段在运行时才导入对应脚本，只运行 check 等轻量阶段时不会加载 cv2 等模块
+def run_align(scene_dir, args):
+    from file_align import sync_folders
+    src = args.src or f"{os.path.normpath(scene_dir)}_unaligned"
+    os.makedirs(scene_dir, exist_ok=True)
+    sync_folders(args.tolerance_ms, src, scene_dir, args.link_mode, args.threads)
+
+
+def run_keyframes(scene_dir, args):
+    from keyframes import select_scene_keyframes
+    select_scene_keyframes(scene_dir, args.keyframe_method, args.keyframe_rate, workers=args.workers)
+
+
+def run_merge(scene_dir, args):
+    from merge_pcd import merge_scene
+    return merge_scene(scene_dir, args.pcd_format, args.workers, args.direction, args.force,
+                       timestamps=scene_frames(scene_dir, args))
+
+
+def run_undistort(scene_dir, args):
+    from undistort import undistort_scene
+    return undistort_scene(scene_dir, args.workers, args.io_threads, front_crop(args), args.interpolation,
+                           args.format, force=args.force, frames=scene_frames(scene_dir, args))
+
+
+def run_config(scene_dir, args):
+    from undistort import write_camera_config
+    write_camera_config(scene_dir, front_crop(args), args.force, scene_frames(scene_dir, args))
+
+
+def run_package(scene_dir, args):
+    from package_scene import package_scene
+    package_scene(scene_dir, threads=args.threads, frames=scene_frames(scene_dir, args))
+
+
+def run_labels(scene_dir, args):
+    from extract_label import extract_scene_labels
+    return extract_scene_labels(scene_dir, args.force, workers=args.workers)
+
+
+def run_check(scene_dir, args):
+    from check_label import check_scene
+    check_scene(scene_dir)
+
+
+STAGE_FUNCTIONS = {
+    'align': run_align,
+    'keyframes': run_keyframes,
+    'merge': run_merge,
+    'undistort': run_undistort,
+    'config': run_config,
+    'package': run_package,
+    'labels': run_labels,
+    'check': run_check,
+}
+
+
+def scene_frames(scene_dir, args):
+    """使用关键帧时后续阶段只处理 keyframes.csv 中选中的帧，否则返回 None 处理所有帧"""
+    if not args.keyframes:
+        return None
+    from keyframes import scene_keyframes
+    return scene_keyframes(scene_dir)
+
+
+def front_crop(args):
+    if not args.front_crop:
+        return None
+    from undistort import parse_crop
+    return parse_crop(args.front_crop, args.front_scale)
+
+
+def parse_stages(text):
+    stages = [s.strip() for s in text.split(',') if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise ValueError(f"未知的阶段: {', '.join(unknown)}，可选 {', '.join(STAGES)}")
+    return stages
+
+
+def run_stages(scene_dir, stages, args, results=None):
+    """按依赖关系运行场景的各个阶段，返回 {阶段: (状态, 耗时, 说明)}
+
+    只等待本次选中的前置阶段；某个阶段出错时依赖它的阶段会被跳过，其余阶段继续运行。
+    返回值为帧列表的阶段（merge、undistort）中有失败的帧时记为 partial。
+    results 为之前已运行阶段的结果，会据此跳过前置阶段失败的阶段。
+    """
+    results = dict(results or {})
+    pending = list(stages)
+    running = {}
+
+    def ready(stage):
+        return all(dep in results for dep in STAGES[stage] if dep in stages)
+
+    def blocked(stage):
+        return any(results.get(dep, ('ok',))[0] in ('failed', 'skipped') for dep in STAGES[stage])
+
+    def timed(stage):
+        start = time.time()
+        output = STAGE_FUNCTIONS[stage](scene_dir, args)
+        return output, time.time() - start
+
+    with ThreadPoolExecutor(max_workers=len(STAGES)) as executor:
+        while pending or running:
+            for stage in [s for s in pending if ready(s)]:
+                pending.remove(stage)
+                if blocked(stage):
+                    results[stage] = ('skipped', 0.0, "前置阶段未成功")
+                    continue
+                print(f"[{scene_dir}] 开始阶段 {stage}")
+                running[executor.submit(timed, stage)] = (stage, time.time())
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                stage, start = running.pop(future)
+                try:
+                    failures, elapsed = future.result()
+                    if failures:
+                        results[stage] = ('partial', elapsed, f"{len(failures)} 帧失败")
+                    else:
+                        results[stage] = ('ok', elapsed, "")
+                except Exception as e:
+                    results[stage] = ('failed', time.time() - start, str(e))
+                print(f"[{scene_dir}] 阶段 {stage}: {results[stage][0]} ({results[stage][1]:.1f} 秒) {results[stage][2]}")
+    return results
+
+
+def load_scenes(trainval=None, pattern="scene_*"):
+    """读取 trainval.yaml 中 train 和 val 的所有场景，文件不存在时按 pattern 匹配场景目录"""
+    if trainval and os.path.exists(trainval):
+        import yaml
+        with open(trainval, 'r') as f:
+            data = yaml.safe_load(f) or {}
+        scenes = []
+        for split in ('train', 'val'):
+            for scene in data.get(split) or []:
+                if scene not in scenes:
+                    scenes.append(scene)
+        return scenes
+    return sorted(d for d in glob.glob(pattern) if os.path.isdir(d))
+
+
+def load_batch_state(state_path):
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, 'r') as f:
+        return json.load(f)
+
+
+def save_batch_state(state_path, state):
+    with open(state_path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=4)
+    os.replace(state_path + '.tmp', state_path)
+
+
+def _init_batch_worker(direction):
+    from merge_pcd import _init_worker
+    _init_worker(direction)
+
+
+def _frame_task(task):
+    """共享进程池中的单帧任务，返回 (统计, 错误信息)，成功时错误信息为 None"""
+    stage, job = task
+    if stage == 'merge':
+        from merge_pcd import _merge_job
+        result = _merge_job(job)
+    else:
+        from undistort import _undistort_job
+        result = _undistort_job(job)
+    return result[-2], result[-1]
+
+
+def plan_frame_tasks(scene_dir, stages, args, results):
+    """生成一个场景中需要处理的逐帧任务，返回 ([(阶段, 任务, 构建记录键, 输入, 输出)], {阶段: 构建记录})"""
+    tasks, manifests = [], {}
+    for stage in FRAME_STAGES:
+        if stage not in stages:
+            continue
+        if any(results.get(dep, ('ok',))[0] in ('failed', 'skipped') for dep in STAGES[stage]):
+            results[stage] = ('skipped', 0.0, "前置阶段未成功")
+            continue
+        try:
+            if stage == 'merge':
+                from merge_pcd import list_timestamps, merge_manifest, frame_inputs, frame_output
+                os.makedirs(os.path.join(scene_dir, "lidar_point_cloud_0"), exist_ok=True)
+                manifest = merge_manifest(scene_dir, args.direction, args.pcd_format)
+                timestamps = scene_frames(scene_dir, args)
+                if timestamps is None:
+                    timestamps = list_timestamps(scene_dir)
+                stage_tasks = [(stage, (ts, scene_dir, args.pcd_format, False, None, True, False), ts,
+                                frame_inputs(ts, scene_dir), [frame_output(ts, scene_dir)])
+                               for ts in timestamps]
+            else:
+                from undistort import scene_undistort_jobs, undistort_manifest
+                crop = front_crop(args)
+                manifest = undistort_manifest(scene_dir, crop, args.interpolation)
+                jobs = scene_undistort_jobs(scene_dir, crop, args.interpolation, args.format,
+                                            frames=scene_frames(scene_dir, args))
+                stage_tasks = [(stage, job, job[3], [job[0]], [job[3]]) for job in jobs]
+        except Exception as e:
+            results[stage] = ('failed', 0.0, str(e))
+            continue
+        if not args.force:
+            stage_tasks = [t for t in stage_tasks if not manifest.is_fresh(t[2], t[3], t[4])]
+        manifests[stage] = manifest
+        tasks += stage_tasks
+    return tasks, manifests
+
+
+def zip_longest_skip(queues):
+    """按轮次依次从每个队列取一项，已取完的队列跳过"""
+    longest = max((len(q) for q in queues), default=0)
+    for i in range(longest):
+        yield [q[i] for q in queues if i < len(q)]
+
+
+def dependency(stage, other):
+    """stage 是否直接或间接依赖 other"""
+    return any(dep == other or dependency(dep, other) for dep in STAGES[stage])
+
+
+def run_frame_stages(scenes, plans, args):
+    """将所有场景的逐帧任务交错提交到同一个进程池
+
+    空闲的进程总是从共享队列中取下一帧，某个场景帧数较多时其他进程不会空等。
+    同时在途的任务数有上限，返回 ({场景: {阶段: (状态, 耗时, 说明)}}, 处理的帧数)。
+    """
+    # 按场景轮流排列任务，各场景的进度大致同步推进
+    queues = [[(scene, task) for task in plans[scene][0]] for scene in scenes]
+    order = [item for group in zip_longest_skip(queues) for item in group]
+    stats = {scene: {stage: {'frames': 0, 'failures': 0, 'start': None, 'end': None, 'timing': Stats()}
+                     for stage in plans[scene][1]}
+             for scene in scenes}
+    total = len(order)
+    done = 0
+    progress = Progress(total, "批处理")
+
+    if total:
+        max_in_flight = max(1, args.workers) * 4
+        with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_batch_worker,
+                                 initargs=(args.direction,)) as executor:
+            items = iter(order)
+            running = {}
+            while True:
+                while len(running) < max_in_flight:
+                    item = next(items, None)
+                    if item is None:
+                        break
+                    scene, task = item
+                    stage_stats = stats[scene][task[0]]
+                    if stage_stats['start'] is None:
+                        stage_stats['start'] = time.time()
+                    running[executor.submit(_frame_task, task[:2])] = item
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    scene, (stage, _, key, inputs, outputs) = running.pop(future)
+                    stage_stats = stats[scene][stage]
+                    try:
+                        job_stats, error = future.result()
+                        stage_stats['timing'].merge(job_stats)
+                    except Exception as e:
+                        error = str(e)
+                    stage_stats['frames'] += 1
+                    stage_stats['end'] = time.time()
+                    if error is None:
+                        plans[scene][1][stage].record(key, inputs, outputs)
+                    else:
+                        stage_stats['failures'] += 1
+                        print(f"\n[{scene}] {stage} {key} 出错: {error}")
+                    done += 1
+                    progress.update()
+        progress.close()
+
+    results = {}
+    for scene in scenes:
+        results[scene] = {}
+        for stage, manifest in plans[scene][1].items():
+            manifest.close()
+            s = stats[scene][stage]
+            elapsed = s['end'] - s['start'] if s['start'] is not None else 0.0
+            write_report(scene, stage, s['timing'], elapsed)
+            if s['failures']:
+                results[scene][stage] = ('partial', elapsed, f"{s['failures']}/{s['frames']} 帧失败")
+            else:
+                results[scene][stage] = ('ok', elapsed, f"{s['frames']} 帧")
+    return results, done
+
+
+def run_batch(scenes, stages, args):
+    """批量处理多个场景，返回 ({场景: {阶段: (状态, 耗时, 说明)}}, merge 和 undistort 处理的帧数)
+
+    align 等场景级阶段在线程池中按场景并行运行；merge、undistort 的所有帧交错提交到同一个进程池；
+    之后再运行 config、package 等后续阶段。每个场景、每个阶段的错误只影响依赖它的阶段。
+    """
+    results = {scene: {} for scene in scenes}
+    threads = max(1, min(len(scenes), args.workers))
+
+    def scene_stages(scene, selected):
+        return scene, run_stages(scene, selected, args, results[scene])
+
+    # 帧级阶段之前的场景级阶段
+    before = [s for s in stages if s not in FRAME_STAGES and not any(
+        f in stages and dependency(s, f) for f in FRAME_STAGES)]
+    after = [s for s in stages if s not in FRAME_STAGES and s not in before]
+    if before:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for scene, scene_results in executor.map(lambda sc: scene_stages(sc, before), scenes):
+                results[scene] = scene_results
+
+    plans = {scene: plan_frame_tasks(scene, stages, args, results[scene]) for scene in scenes}
+    frame_results, frames = run_frame_stages(scenes, plans, args)
+    for scene, scene_results in frame_results.items():
+        results[scene].update(scene_results)
+
+    if after:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            for scene, scene_results in executor.map(lambda sc: scene_stages(sc, after), scenes):
+                results[scene] = scene_results
+    return results, frames
+
+
+def batch_report(results, stages, frames, elapsed, report_path):
+    """打印并保存批处理的汇总报告"""
+    report = {'elapsed': elapsed, 'stages': stages, 'scenes': {}}
+    stage_totals = {stage: 0.0 for stage in stages}
+    print(f"\n批处理完成: 共 {len(results)} 个场景，总耗时 {elapsed:.1f} 秒")
+    for scene, scene_results in results.items():
+        status = 'ok' if all(r[0] == 'ok' for r in scene_results.values()) else 'failed'
+        report['scenes'][scene] = {
+            'status': status,
+            'stages': {stage: {'status': r[0], 'elapsed': r[1], 'detail': r[2]} for stage, r in scene_results.items()},
+        }
+        summary = ', '.join(f"{stage} {r[0]} {r[1]:.1f}s" for stage, r in scene_results.items())
+        print(f"  {scene:<12} {status:<7} {summary}")
+        for stage, r in scene_results.items():
+            stage_totals[stage] = stage_totals.get(stage, 0.0) + r[1]
+    report['frames'] = frames
+    report['frames_per_second'] = frames / elapsed if elapsed > 0 else 0.0
+    report['stage_seconds'] = stage_totals
+    print(f"共处理 {frames} 帧 (merge + undistort)，{report['frames_per_second']:.1f} 帧/秒")
+    print("各阶段累计耗时: " + ', '.join(f"{stage} {t:.1f}s" for stage, t in stage_totals.items()))
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=4, ensure_ascii=False)
+    print(f"汇总报告已保存到 {report_path}")
+    return report
+
+
+def add_stage_arguments(parser):
+    parser.add_argument('--stages', type=str, default=DEFAULT_STAGES,
+                        help=f'要运行的阶段，逗号分隔，可选 {",".join(STAGES)}，默认为 {DEFAULT_STAGES}')
+    parser.add_argument('--workers', type=int, default=1, help='merge 和 undistort 阶段各自使用的进程数，默认为 1')
+    parser.add_argument('--force', action='store_true', help='重新处理所有帧，不跳过构建记录中已是最新的结果')
+    parser.add_argument('--src', type=str, default=None, help='align 阶段的原始数据目录，默认为 <场景>_unaligned')
+    parser.add_argument('--tolerance-ms', type=float, default=50.0, help='align 阶段允许的最大时间差（毫秒），默认为 50')
+    parser.add_argument('--link-mode', type=str, choices=LINK_MODES, default='hardlink',
+                        help='align 阶段目标文件的生成方式，默认为 hardlink')
+    parser.add_argument('--threads', type=int, default=8, help='align 阶段复制文件以及 package 阶段压缩文件的线程数，默认为 8')
+    parser.add_argument('--pcd-format', type=str, choices=['binary', 'binary_compressed'], default='binary',
+                        help='合并后点云的保存格式，默认为 binary')
+    parser.add_argument('--direction', type=str, choices=['sensor2main', 'main2sensor'], default='sensor2main',
+                        help='lidar2m32.json 中外参矩阵的方向，默认为 sensor2main')
+    parser.add_argument('--io-threads', type=int, default=0, help='undistort 单进程流水线的读取和编码线程数，默认为 0')
+    parser.add_argument('--front-crop', type=str, default=None, help='CAM_FRONT_8M 去畸变后从中心裁剪的尺寸，例如 1920x1536')
+    parser.add_argument('--front-scale', type=float, default=1.0, help='CAM_FRONT_8M 裁剪后的缩放比例')
+    parser.add_argument('--interpolation', type=str, choices=INTERPOLATIONS, default=None,
+                        help='重映射插值方式，默认鱼眼相机为 cubic，针孔相机为 linear')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, default=None,
+                        help='去畸变后输出图像格式，默认与输入一致')
+    parser.add_argument('--keyframes', action='store_true',
+                        help='后续阶段只处理 keyframes.csv 中选中的关键帧，运行 keyframes 阶段时自动启用')
+    parser.add_argument('--keyframe-method', type=str, choices=['image', 'cloud', 'both'], default='both',
+                        help='keyframes 阶段变化量的来源，默认为 both')
+    parser.add_argument('--keyframe-rate', type=float, default=None,
+                        help='keyframes 阶段的目标关键帧率（帧/秒），不指定则按变化阈值选择')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="按依赖关系运行场景预处理的各个阶段")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='处理单个场景')
+    run_parser.add_argument('scene', type=str, help='场景路径，例如 scene_1')
+    add_stage_arguments(run_parser)
+    batch_parser = subparsers.add_parser('batch', help='批量处理 trainval.yaml 中的所有场景')
+    batch_parser.add_argument('--trainval', type=str, default='trainval.yaml',
+                              help='场景索引文件，默认为 trainval.yaml，不存在时按 --glob 匹配场景目录')
+    batch_parser.add_argument('--glob', type=str, default='scene_*', help='匹配场景目录的模式，默认为 scene_*')
+    batch_parser.add_argument('--resume', action='store_true',
+                              help=f'跳过 {BATCH_STATE} 中记录为已全部成功完成的场景')
+    batch_parser.add_argument('--report', type=str, default=BATCH_REPORT, help=f'汇总报告路径，默认为 {BATCH_REPORT}')
+    add_stage_arguments(batch_parser)
+    args = parser.parse_args()
+
+    try:
+        stages = parse_stages(args.stages)
+    except ValueError as e:
+        parser.error(str(e))
+    args.keyframes = args.keyframes or 'keyframes' in stages
+    from pcd_io import resolve_pcd_format
+    args.pcd_format = resolve_pcd_format(args.pcd_format)
+
+    if args.command == 'batch':
+        scenes = load_scenes(args.trainval, args.glob)
+        if not scenes:
+            parser.error("没有找到需要处理的场景")
+        state = load_batch_state(BATCH_STATE)
+        if args.resume:
+            done = [scene for scene in scenes if state.get(scene, {}).get('status') == 'ok'
+                    and set(stages) <= set(state[scene].get('stages', []))]
+            if done:
+                print(f"跳过已完成的场景: {', '.join(done)}")
+            scenes = [scene for scene in scenes if scene not in done]
+        print(f"共 {len(scenes)} 个场景: {', '.join(scenes)}")
+        start = time.time()
+        results, frames = run_batch(scenes, stages, args)
+        for scene, scene_results in results.items():
+            ok = all(r[0] == 'ok' for r in scene_results.values())
+            previous = state.get(scene, {}).get('stages', []) if ok else []
+            state[scene] = {'status': 'ok' if ok else 'failed',
+                            'stages': sorted(set(previous) | set(stages)) if ok else stages,
+                            'finished': time.strftime('%Y-%m-%d %H:%M:%S')}
+        save_batch_state(BATCH_STATE, state)
+        report = batch_report(results, stages, frames, time.time() - start, args.report)
+        if any(s['status'] != 'ok' for s in report['scenes'].values()):
+            sys.exit(1)
+        return
+
+    start = time.time()
+    results = run_stages(args.scene, stages, args)
+    print(f"\n{args.scene} 处理完成，总耗时 {time.time() - start:.1f} 秒")
+    for stage in stages:
+        status, elapsed, detail = results[stage]
+        print(f"  {stage:<10} {status:<8} {elapsed:8.1f} 秒  {detail}")
+    if any(status != 'ok' for status, _, _ in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import json
+import numpy as np
+
+# 打包存储默认保存的字段
+STORE_FIELDS = ('x', 'y', 'z', 'intensity')
+# int16 量化时的步长，xyz 精度 1cm，可表示 ±327m
+INT16_SCALE = 0.01
+STORE_DTYPES = ('float32', 'float16', 'int16')
+# dtype 只用于坐标，其余字段（intensity、timestamp 等）的取值范围和精度要求不同，单独以 float32 保存，
+# 源字段为 float64 或 32 位以上整数（如 timestamp）时以 float64 保存
+XYZ_FIELDS = ('x', 'y', 'z')
+
+
+class PointStoreWriter:
+    """逐帧追加写入场景级的打包点云存储
+
+    存储目录包含 points.bin（所有帧首尾相接的 (N, C) 数组）、index.npz（按时间戳排序的
+    timestamps/offsets/counts）和 meta.json（字段、数据类型和量化步长）。
+    points.bin 只以 dtype 保存 xyz 字段，其余字段以 float32/float64 保存在 attributes.bin 中。
+    """
+
+    def __init__(self, store_dir, fields=STORE_FIELDS, dtype='float32', scale=INT16_SCALE):
+        if dtype not in STORE_DTYPES:
+            raise ValueError(f"不支持的存储数据类型: {dtype}")
+        os.makedirs(store_dir, exist_ok=True)
+        self.store_dir = store_dir
+        self.fields = tuple(fields)
+        self.dtype = dtype
+        self.point_fields = tuple(name for name in self.fields if name in XYZ_FIELDS)
+        self.attribute_fields = tuple(name for name in self.fields if name not in XYZ_FIELDS)
+        self.scale = scale
+        self.timestamps, self.offsets, self.counts = [], [], []
+        self.total = 0
+        # 先写入临时文件，close 时再替换，中途失败不会破坏已有的存储
+        self._points_path = os.path.join(store_dir, 'points.bin')
+        self._file = open(self._points_path + '.tmp', 'wb')
+        # 属性的数据类型由第一帧的字段类型决定
+        self.attribute_dtype = None
+        self._attributes_file = None
+
+    def append(self, timestamp, points):
+        """追加一帧结构化点云，缺失的字段补 0"""
+        columns = field_columns(points, self.point_fields)
+        if self.dtype == 'int16':
+            columns = np.clip(np.rint(columns / self.scale), -32768, 32767).astype(np.int16)
+        elif self.dtype == 'float16':
+            columns = columns.astype(np.float16)
+        columns.tofile(self._file)
+        if self.attribute_fields:
+            if self._attributes_file is None:
+                self.attribute_dtype = attribute_dtype(points, self.attribute_fields)
+                self._attributes_file = open(os.path.join(self.store_dir, 'attributes.bin.tmp'), 'wb')
+            field_columns(points, self.attribute_fields, self.attribute_dtype).tofile(self._attributes_file)
+
+        self.timestamps.append(int(timestamp))
+        self.offsets.append(self.total)
+        self.counts.append(len(points))
+        self.total += len(points)
+
+    def close(self):
+        self._file.close()
+        if self.attribute_fields:
+            if self._attributes_file is None:
+                # 没有写入任何帧
+                self.attribute_dtype = 'float32'
+                self._attributes_file = open(os.path.join(self.store_dir, 'attributes.bin.tmp'), 'wb')
+            self._attributes_file.close()
+        order = np.argsort(np.array(self.timestamps, dtype=np.int64), kind='stable')
+        with open(os.path.join(self.store_dir, 'index.npz.tmp'), 'wb') as f:
+            np.savez(f,
+                     timestamps=np.array(self.timestamps, dtype=np.int64)[order],
+                     offsets=np.array(self.offsets, dtype=np.int64)[order],
+                     counts=np.array(self.counts, dtype=np.int64)[order])
+        meta = {
+            'fields': list(self.point_fields),
+            'attribute_fields': list(self.attribute_fields),
+            'attribute_dtype': self.attribute_dtype,
+            'dtype': self.dtype,
+            'scale': self.scale if self.dtype == 'int16' else None,
+            'frames': len(self.timestamps),
+            'points': self.total,
+        }
+        with open(os.path.join(self.store_dir, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f, indent=4)
+        names = ['points.bin', 'index.npz', 'meta.json']
+        if self.attribute_fields:
+            names.insert(1, 'attributes.bin')
+        else:
+            # 之前生成的属性文件不再对应当前的存储
+            try:
+                os.remove(os.path.join(self.store_dir, 'attributes.bin'))
+            except FileNotFoundError:
+                pass
+        for name in names:
+            path = os.path.join(self.store_dir, name)
+            os.replace(path + '.tmp', path)
+
+
+def attribute_dtype(points, fields):
+    """属性字段的存储类型：能无损转换为 float32 时为 float32，否则为 float64"""
+    for name in fields:
+        if name in points.dtype.names and not np.can_cast(points.dtype[name].base, np.float32, 'safe'):
+            return 'float64'
+    return 'float32'
+
+
+def field_columns(points, fields, dtype=np.float32):
+    """把结构化点云的指定字段转换为 (n, C) 数组，缺失的字段补 0"""
+    columns = np.zeros((len(points), len(fields)), dtype=dtype)
+    for i, name in enumerate(fields):
+        if name in points.dtype.names:
+            columns[:, i] = points[name]
+    return columns
+
+
+class PointStore:
+    """以内存映射方式读取打包点云存储，按时间戳零拷贝取出单帧
+
+    fields 为 points.bin 中的坐标字段，attribute_fields 为单独以 float32/float64 保存在 attributes.bin 中的字段。
+    """
+
+    def __init__(self, store_dir):
+        with open(os.path.join(store_dir, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        with np.load(os.path.join(store_dir, 'index.npz')) as index:
+            self.timestamps = index['timestamps']
+            self.offsets = index['offsets']
+            self.counts = index['counts']
+        self.fields = tuple(self.meta['fields'])
+        self.attribute_fields = tuple(self.meta.get('attribute_fields', ()))
+        self.points = load_columns(os.path.join(store_dir, 'points.bin'), self.meta['dtype'],
+                                   self.meta['points'], len(self.fields))
+        self.attributes = None
+        if self.attribute_fields:
+            self.attributes = load_columns(os.path.join(store_dir, 'attributes.bin'), self.meta['attribute_dtype'],
+                                           self.meta['points'], len(self.attribute_fields))
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def frame(self, timestamp, dequantize=False):
+        """返回指定时间戳的 (n, C) 点云切片
+
+        dequantize=True 时返回副本：坐标反量化为 float32，并按 fields + attribute_fields 的顺序拼接其余字段
+        （属性以 float64 保存时结果也为 float64）。
+        """
+        i = self.index(timestamp)
+        if not dequantize:
+            return self[i]
+        points = self.dequantize(self[i])
+        if self.attributes is not None:
+            points = np.concatenate([points, self.frame_attributes(timestamp)], axis=1)
+        return points
+
+    def frame_attributes(self, timestamp):
+        """返回指定时间戳的 attribute_fields 切片 (n, C)，没有单独保存的字段时返回 None"""
+        if self.attributes is None:
+            return None
+        i = self.index(timestamp)
+        offset = self.offsets[i]
+        return self.attributes[offset:offset + self.counts[i]]
+
+    def index(self, timestamp):
+        i = np.searchsorted(self.timestamps, int(timestamp))
+        if i >= len(self.timestamps) or self.timestamps[i] != int(timestamp):
+            raise KeyError(f"存储中不存在时间戳: {timestamp}")
+        return i
+
+    def __getitem__(self, i):
+        """按排序后的帧序号取出 points.bin 中的切片"""
+        offset = self.offsets[i]
+        return self.points[offset:offset + self.counts[i]]
+
+    def dequantize(self, points):
+        if self.meta['dtype'] == 'int16':
+            return points.astype(np.float32) * np.float32(self.meta['scale'])
+        return points.astype(np.float32)
+
+
+def load_columns(path, dtype, n, columns):
+    """内存映射 (n, columns) 数组，没有点时返回空数组"""
+    if n == 0:
+        return np.zeros((0, columns), dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n, columns))
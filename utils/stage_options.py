@@ -0,0 +1,8 @@
+# 各阶段命令行参数的可选值，不依赖 cv2、numpy 等库，pipeline.py 构建参数时导入不会拖慢未用到这些阶段的运行
+
+# align 阶段目标文件的生成方式
+LINK_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+# undistort 阶段的重映射插值方式
+INTERPOLATIONS = ('nearest', 'linear', 'cubic', 'lanczos')
+# undistort 阶段的输出图像格式
+OUTPUT_FORMATS = ('png', 'jpg', 'webp')
@@ -0,0 +1,196 @@
+import os
+import json
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from pcd_io import write_pcd
+from label_store import CLASS_NAMES
+from calibration import CAMERA_SPECS, LIDAR_EXTRINSICS, CAMERA_EXTRINSICS, PARAMETERS_DIR
+
+# 各相机的朝向（在 LIDAR_TOP_32 坐标系中的偏航角，度），分辨率、模型和标定文件名取自 calibration.CAMERA_SPECS
+CAMERA_YAWS = {"CAM_FRONT_8M": 0, "CAM_FRONT_3M": 0, "CAM_LEFT_3M": 90, "CAM_RIGHT_3M": -90, "CAM_BACK_3MH": 180}
+# 各激光雷达的字段和每帧点数相对 --points 的比例，LIDAR_TOP_32 带 ring 和 timestamp
+LIDAR_SPECS = {
+    "LIDAR_FRONT": ([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4')], 0.5),
+    "LIDAR_REAR": ([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4')], 0.5),
+    "LIDAR_TOP_32": ([('x', '<f4'), ('y', '<f4'), ('z', '<f4'), ('intensity', '<f4'),
+                      ('ring', '<u2'), ('timestamp', '<f8')], 1.0),
+}
+# 第一帧的纳秒时间戳和帧间隔（10 Hz）
+START_TIMESTAMP = 1700000000000000000
+FRAME_INTERVAL = 100000000
+# 各类别的典型尺寸 (dx, dy, dz)，生成标注时在此基础上随机缩放
+CLASS_SIZES = {
+    'car': (4.5, 1.9, 1.6), 'truck': (9.0, 2.5, 3.2), 'bus': (11.0, 2.6, 3.2), 'bicycle': (1.8, 0.6, 1.4),
+    'pedestrian': (0.6, 0.6, 1.7), 'traffic_cone': (0.4, 0.4, 0.7), 'barrier': (2.0, 0.5, 1.0),
+}
+
+
+def yaw_matrix(yaw, translation):
+    """绕 z 轴旋转 yaw（弧度）并平移的 4x4 矩阵"""
+    c, s = np.cos(yaw), np.sin(yaw)
+    return [[c, -s, 0.0, translation[0]], [s, c, 0.0, translation[1]], [0.0, 0.0, 1.0, translation[2]],
+            [0.0, 0.0, 0.0, 1.0]]
+
+
+def camera_extrinsic(yaw, translation):
+    """LIDAR_TOP_32 到相机坐标系（x 向右、y 向下、z 向前）的 4x4 矩阵，相机朝向偏航角 yaw（弧度）"""
+    c, s = np.cos(yaw), np.sin(yaw)
+    rotation = np.array([[s, -c, 0.0], [0.0, 0.0, -1.0], [c, s, 0.0]])
+    matrix = np.eye(4)
+    matrix[:3, :3] = rotation
+    matrix[:3, 3] = -rotation @ np.asarray(translation)
+    return matrix.tolist()
+
+
+def format_parameters(serial, values):
+    """按 utils/Parameters/*.txt 的格式输出标定文件，值为 None 的参数写为 '/'"""
+    lines = [f"SN码:{serial}"]
+    lines += [f"{key}:{'/' if value is None else f'{value:.10f}'}" for key, value in values.items()]
+    lines += ["RMS:0.0100", "标定校验:null", "是否写入:"]
+    return "\n".join(lines)
+
+
+def write_calibration(root, rng):
+    """在 root/utils 下生成与真实标定格式相同的 Parameters/*.txt、lidar2m32.json 和 32m2cameras.json"""
+    param_dir = os.path.join(root, PARAMETERS_DIR)
+    os.makedirs(param_dir, exist_ok=True)
+
+    def jitter(scale):
+        return float(rng.normal(0, scale))
+
+    for i, spec in enumerate(CAMERA_SPECS):
+        width, height = spec.size
+        if spec.model == "fisheye":
+            focal = width / 3.76
+            distortion = dict(K1=0.138 + jitter(0.005), K2=-0.042 + jitter(0.002), P1=None, P2=None,
+                              K3=0.0036 + jitter(0.0002), K4=-0.0002, K5=None, K6=None)
+        else:
+            focal = width / 2.0 if spec.name == "CAM_FRONT_8M" else width / 1.9
+            distortion = dict(K1=-0.05 + jitter(0.005), K2=0.01 + jitter(0.001), P1=0.0, P2=0.0,
+                              K3=0.0, K4=0.0, K5=0.0, K6=0.0)
+        values = dict(FX=focal + jitter(1.0), FY=focal + jitter(1.0),
+                      CX=width / 2 + jitter(2.0), CY=height / 2 + jitter(2.0), **distortion)
+        with open(os.path.join(param_dir, spec.param_file), 'w', encoding='utf-8') as f:
+            f.write(format_parameters(f"SYN-{i:08d}", values))
+
+    lidars = {"LIDAR_REAR": yaw_matrix(np.pi, (-2.5, 0.0, -0.2)), "LIDAR_FRONT": yaw_matrix(0.0, (0.2, 0.0, -0.4))}
+    with open(os.path.join(root, LIDAR_EXTRINSICS), 'w') as f:
+        json.dump(lidars, f, indent=4)
+    cameras = {camera: camera_extrinsic(np.radians(yaw), (0.5, 0.0, -0.3)) for camera, yaw in CAMERA_YAWS.items()}
+    with open(os.path.join(root, CAMERA_EXTRINSICS), 'w') as f:
+        json.dump(cameras, f, indent=4)
+
+
+def synthetic_points(n, fields, rng, frame):
+    """生成近似机械旋转雷达的一帧点云：地面点和随机分布的障碍物点，各字段均有值"""
+    points = np.zeros(n, dtype=fields)
+    azimuth = rng.uniform(-np.pi, np.pi, n)
+    distance = 2.0 + rng.exponential(20.0, n)
+    ground = rng.random(n) < 0.6
+    points['x'] = distance * np.cos(azimuth) + frame * 0.5
+    points['y'] = distance * np.sin(azimuth)
+    points['z'] = np.where(ground, -1.8 + rng.normal(0, 0.03, n), rng.uniform(-1.8, 3.0, n))
+    points['intensity'] = rng.uniform(0, 255, n)
+    if 'ring' in points.dtype.names:
+        points['ring'] = np.arange(n) % 32
+        points['timestamp'] = (START_TIMESTAMP + frame * FRAME_INTERVAL) / 1e9 + np.sort(rng.uniform(0, 0.1, n))
+    return points
+
+
+def synthetic_image(size, seed, frame):
+    """生成一张有渐变和色块纹理的图像，随帧水平平移，编码后的大小接近真实场景"""
+    import cv2
+    width, height = size
+    rng = np.random.default_rng(seed)
+    x = np.linspace(0, 255, width, dtype=np.float32)
+    y = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    image = np.empty((height, width, 3), dtype=np.uint8)
+    image[..., 0] = (x + y) / 2
+    image[..., 1] = y
+    image[..., 2] = 255 - (x + y) / 2
+    for _ in range(60):
+        x0, y0 = int(rng.integers(0, width)), int(rng.integers(0, height))
+        w, h = int(rng.integers(20, width // 6)), int(rng.integers(20, height // 6))
+        cv2.rectangle(image, (x0, y0), (x0 + w, y0 + h), [int(v) for v in rng.integers(0, 256, 3)], -1)
+    image = np.roll(image, frame * 8, axis=1)
+    noise = np.random.default_rng(seed + frame).integers(0, 12, image.shape[:2], dtype=np.uint8)
+    return cv2.add(image, noise[..., None].repeat(3, axis=2))
+
+
+def synthetic_objects(rng, n_objects, frame):
+    """生成一帧 xtreme1 导出格式的标注对象，对象位置随帧缓慢移动"""
+    objects = []
+    for i in range(n_objects):
+        name = CLASS_NAMES[i % len(CLASS_NAMES)]
+        dx, dy, dz = (v * rng.uniform(0.8, 1.2) for v in CLASS_SIZES[name])
+        objects.append({
+            'className': name,
+            'contour': {
+                'center3D': {'x': rng.uniform(-60, 60) + frame * 0.5, 'y': rng.uniform(-30, 30), 'z': -1.8 + dz / 2},
+                'size3D': {'x': dx, 'y': dy, 'z': dz},
+                'rotation3D': {'x': 0, 'y': 0, 'z': rng.uniform(-np.pi, np.pi)},
+            },
+        })
+    return objects
+
+
+def _frame_job(job):
+    """生成一帧的所有传感器数据和标注导出文件"""
+    import cv2
+    scene_dir, export_dir, frame, n_points, n_objects, image_format, seed = job
+    timestamp = START_TIMESTAMP + frame * FRAME_INTERVAL
+    rng = np.random.default_rng(seed * 100003 + frame)
+    for lidar, (fields, ratio) in LIDAR_SPECS.items():
+        write_pcd(os.path.join(scene_dir, lidar, f"{timestamp}.pcd"),
+                  synthetic_points(int(n_points * ratio), fields, rng, frame))
+    for i, spec in enumerate(CAMERA_SPECS):
+        cv2.imwrite(os.path.join(scene_dir, spec.name, f"{timestamp}.{image_format}"),
+                    synthetic_image(spec.size, seed * 10 + i, frame))
+    # data[0] 为人工标注，data[1] 为模型预测（没有朝向）
+    gt = synthetic_objects(rng, n_objects, frame)
+    pred = [dict(obj, contour=dict(obj['contour'], rotation3D=None)) for obj in gt]
+    with open(os.path.join(export_dir, f"{timestamp}.json"), 'w') as f:
+        json.dump([{'objects': gt}, {'objects': pred}], f)
+    return timestamp
+
+
+def generate_scene(root, scene='scene_1', frames=10, points=120000, objects=20, image_format='png', seed=0,
+                   workers=1):
+    """在 root 下生成一个合成场景，返回场景目录
+
+    root/utils 下为合成的标定文件和外参，root/<scene> 下为八个传感器目录和一次标注导出结果，
+    与真实数据的目录结构和文件格式相同，可在 root 目录下直接运行各处理脚本。
+    """
+    rng = np.random.default_rng(seed)
+    write_calibration(root, rng)
+    scene_dir = os.path.join(root, scene)
+    for folder in list(LIDAR_SPECS) + list(CAMERA_YAWS):
+        os.makedirs(os.path.join(scene_dir, folder), exist_ok=True)
+    export_dir = os.path.join(scene_dir, f"{scene}-20250101000000", "result")
+    os.makedirs(export_dir, exist_ok=True)
+
+    jobs = [(scene_dir, export_dir, frame, points, objects, image_format, seed) for frame in range(frames)]
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(_frame_job, jobs))
+    else:
+        for job in jobs:
+            _frame_job(job)
+    print(f"已生成合成场景 {scene_dir}: {frames} 帧，每帧 {points} 个主雷达点，{objects} 个标注框")
+    return scene_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="生成用于测试和性能基准的合成场景")
+    parser.add_argument('--root', type=str, required=True, help='输出目录，场景和标定文件生成在该目录下')
+    parser.add_argument('--scene', type=str, default='scene_1', help='场景名，默认为 scene_1')
+    parser.add_argument('--frames', type=int, default=10, help='帧数，默认为 10')
+    parser.add_argument('--points', type=int, default=120000, help='LIDAR_TOP_32 每帧点数，默认为 120000')
+    parser.add_argument('--objects', type=int, default=20, help='每帧标注框数量，默认为 20')
+    parser.add_argument('--image-format', type=str, choices=['png', 'jpg'], default='png', help='图像格式，默认为 png')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子，默认为 0')
+    parser.add_argument('--workers', type=int, default=1, help='并行生成的进程数，默认为 1')
+    args = parser.parse_args()
+    generate_scene(args.root, args.scene, args.frames, args.points, args.objects, args.image_format, args.seed,
+                   args.workers)
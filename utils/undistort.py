@@ -3,329 +3,527 @@ import numpy as np
 import os
 import glob
 import re
-from pathlib import Path
-from itertools import chain
 import json
+import hashlib
+import threading
 import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from manifest import Manifest, config_hash
+from instrument import Stats, Progress, stage_report, timed
+from calibration import CAMERAS, OUTPUT_DIRS, PARAM_FILES, load_calibration
+from stage_options import INTERPOLATIONS as INTERPOLATION_NAMES, OUTPUT_FORMATS
 
-def update_camera_config(camera_config_path, param_files, input_dirs):
-    # 初始化空的配置数组
-    camera_config = []
-
-    # 加载外部参数
-    with open('utils/32m2cameras.json', 'r') as f:
-        ext_params = json.load(f)
+# 去畸变映射表缓存目录，标定不变时跨场景复用
+MAP_CACHE_DIR = "utils/Parameters/.map_cache"
+# 进程内已加载的映射表，键为 (相机名, 图像尺寸, 裁剪参数)，每个进程只加载一次，处理每帧时不再读取标定
+_rectify_maps = {}
+# 支持裁剪缩放的相机及其默认裁剪尺寸
+CROP_CAMERA = "CAM_FRONT_8M"
+FRONT_8M_CROP = "1920x1536"
+# 可选的插值方式，未指定时鱼眼相机使用三次插值，针孔相机使用线性插值
+INTERPOLATIONS = dict(zip(INTERPOLATION_NAMES,
+                          (cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_LANCZOS4)))
+# 每个场景中各份不同配置内容的存放目录，camera_config/<帧>.json 为指向它们的硬链接
+CONFIG_BLOB_DIR = ".camera_config"
 
-    # 遍历每个相机配置
-    for i, (param_file, input_dir) in enumerate(zip(param_files, input_dirs)):
-        if input_dir==f"{scene_dir}/CAM_FRONT_8M":
-            width=3840
-            height=2160
-        else:
-            width=1920
-            height=1536
-        internal_params = read_camera_parameters(param_file)
-        fx = internal_params.get("FX")
-        fy = internal_params.get("FY")
-        cx = internal_params.get("CX")
-        cy = internal_params.get("CY")
-        # 获取外参
-        external_matrix = ext_params.get(input_dir.split('/')[-1])
-        flat_external = sum(external_matrix, [])  # 展平为一维列表
+def build_camera_config(front_crop=None):
+    """根据已校验的标定构建各相机的内外参配置列表，顺序与 CAMERA_SPECS 一致"""
+    camera_config = []
+    for camera in load_calibration().cameras:
+        width, height = camera.size
+        camera_matrix = camera.intrinsic
+        if front_crop is not None and camera.name == CROP_CAMERA:
+            # 裁剪缩放后的内参与输出图像尺寸保持一致
+            camera_matrix, (width, height) = calculate_new_camera_matrix(camera.intrinsic, camera.size, front_crop)
 
         # 构建单个相机配置
         camera_entry = {
             "camera_internal": {
-                "fx": fx,
-                "fy": fy,
-                "cx": cx,
-                "cy": cy
+                "fx": float(camera_matrix[0, 0]),
+                "fy": float(camera_matrix[1, 1]),
+                "cx": float(camera_matrix[0, 2]),
+                "cy": float(camera_matrix[1, 2])
             },
             "width": width,
             "height": height,
-            "camera_external": flat_external,
+            "camera_external": camera.extrinsic.ravel().tolist(),
             "rowMajor": True
         }
-
-        # 添加到配置列表
         camera_config.append(camera_entry)
+    return camera_config
 
+def update_camera_config(camera_config_path, front_crop=None):
+    camera_config = build_camera_config(front_crop)
     # 写入新文件
     with open(camera_config_path, 'w') as f:
         json.dump(camera_config, f, indent=4)
 
     print(f"✅ 已成功创建并写入 {camera_config_path}")
 
-def generate_camera_config_dir(camera_config_path):
-    with open(camera_config_path, "r") as f:
-        data = json.load(f)
+def link_or_write(blob_path, payload, json_path):
+    """将帧配置硬链接到共享的配置文件，文件系统不支持硬链接时直接写入内容"""
+    try:
+        os.unlink(json_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.link(blob_path, json_path)
+    except OSError:
+        with open(json_path, "wb") as json_file:
+            json_file.write(payload)
 
-    # 创建 camera_config 文件夹
-    os.makedirs(f"{scene_dir}/camera_config", exist_ok=True)
+def generate_camera_config_dir(camera_config, scene_dir, force=False, frames=None):
+    """为每一帧点云生成 camera_config/<帧>.json
 
+    camera_config 为所有帧共用的配置列表，或 {帧: 配置列表}（标定随时间变化时）。每份不同的配置只序列化一次，
+    写入场景目录下的 .camera_config/<哈希>.json，各帧的文件为指向它的硬链接，不支持硬链接时写入同样的字节。
+    """
     # 获取 LIDAR_CONCAT 下的所有 .pcd 文件名（去掉后缀）
-    pcd_files = [f for f in os.listdir(f"{scene_dir}/lidar_point_cloud_0") if f.endswith(".pcd")]
-    base_names = [os.path.splitext(f)[0] for f in pcd_files]
+    if frames is None:
+        pcd_files = [f for f in os.listdir(f"{scene_dir}/lidar_point_cloud_0") if f.endswith(".pcd")]
+        frames = [os.path.splitext(f)[0] for f in pcd_files]
 
-    # 为每个文件名生成对应的 .json 文件，并写入相同的内容
-    for name in base_names:
+    # 相同内容的配置只序列化一次
+    blobs = {}
+    frame_blobs = {}
+    for name in frames:
+        config = camera_config.get(name) if isinstance(camera_config, dict) else camera_config
+        if config is None:
+            raise KeyError(f"缺少帧 {name} 的相机配置")
+        payload = json.dumps(config, indent=4).encode()
+        digest = hashlib.sha1(payload).hexdigest()[:16]
+        blobs.setdefault(digest, payload)
+        frame_blobs[name] = digest
+
+    # 创建 camera_config 文件夹
+    os.makedirs(f"{scene_dir}/camera_config", exist_ok=True)
+    blob_dir = os.path.join(scene_dir, CONFIG_BLOB_DIR)
+    os.makedirs(blob_dir, exist_ok=True)
+    for digest, payload in blobs.items():
+        blob_path = os.path.join(blob_dir, f"{digest}.json")
+        if not os.path.exists(blob_path):
+            with open(blob_path + ".tmp", "wb") as f:
+                f.write(payload)
+            os.replace(blob_path + ".tmp", blob_path)
+
+    # 帧对应的配置内容未变且文件仍存在时跳过
+    manifest = Manifest(scene_dir, 'config')
+    written = 0
+    for name, digest in frame_blobs.items():
         json_path = os.path.join(scene_dir, "camera_config", f"{name}.json")
-        with open(json_path, "w") as json_file:
-            json.dump(data, json_file, indent=4)
-
-    print("✅ 所有 JSON 文件已生成并保存到 camera_config 文件夹中。")
-
-def read_camera_parameters(param_file):
-    """从参数文件中读取相机内参和畸变系数"""
-    params = {}
-    with open(param_file, 'r', encoding='utf-8') as f:
-        lines = f.readlines()
-        
-    for line in lines:
-        # 使用冒号分割键值
-        if ':' in line:
-            key, value = line.split(':', 1)
-            key = key.strip()
-            value = value.strip()
-            
-            # 忽略值为'/'或'null'的参数
-            if value != '/' and value != 'null' and value != '':
-                try:
-                    # 尝试将值转换为浮点数
-                    params[key] = float(value)
-                except ValueError:
-                    # 如果不能转换为浮点数，则保存为字符串
-                    params[key] = value
-    
-    return params
+        blob_path = os.path.join(blob_dir, f"{digest}.json")
+        if not force and manifest.is_fresh(name, [blob_path], [json_path]):
+            continue
+        link_or_write(blob_path, blobs[digest], json_path)
+        manifest.record(name, [blob_path], [json_path])
+        written += 1
+    manifest.close()
 
-def undistort_fisheye_images(param_file, input_dir, output_dir):
-    """对鱼眼相机拍摄的图像进行去畸变处理"""
-    # 读取参数
-    params = read_camera_parameters(param_file)
-    
-    # 提取相机内参
-    fx = params.get('FX')
-    fy = params.get('FY')
-    cx = params.get('CX')
-    cy = params.get('CY')
-    
-    # 提取畸变系数
-    k1 = params.get('K1', 0.0)
-    k2 = params.get('K2', 0.0)
-    k3 = params.get('K3', 0.0)
-    k4 = params.get('K4', 0.0)
-    
-    # 检查必要的参数是否存在
-    required_params = ['FX', 'FY', 'CX', 'CY']
-    if not all(param in params for param in required_params):
-        missing = [param for param in required_params if param not in params]
-        raise ValueError(f"缺少必要的相机参数: {', '.join(missing)}")
-    
-    # 创建相机矩阵
-    camera_matrix = np.array([
-        [fx, 0, cx],
-        [0, fy, cy],
+    print(f"✅ 已生成 {written} 个帧配置文件（共 {len(frame_blobs)} 帧，{len(blobs)} 份不同配置），保存在 camera_config 文件夹中。")
+
+def build_rectify_maps(camera, size, crop=None):
+    """计算去畸变映射表，camera 为 calibration 中的 CameraCalibration，size 为输入图像的 (w, h)
+
+    指定 crop=(crop_w, crop_h, scale) 时，去畸变、中心裁剪和缩放合并为一次映射，
+    映射表直接输出目标尺寸的图像。
+    """
+    camera_matrix, dist_coeffs = camera.intrinsic, camera.distortion
+    if crop is None:
+        # 新相机矩阵与原内参一致，与 cv2.undistort 的默认行为相同
+        new_camera_matrix = camera_matrix.copy()
+        out_size = size
+    else:
+        new_camera_matrix, out_size = calculate_new_camera_matrix(camera_matrix, size, crop)
+    if camera.model == 'fisheye':
+        return cv2.fisheye.initUndistortRectifyMap(
+            camera_matrix, dist_coeffs, np.eye(3), new_camera_matrix, out_size, cv2.CV_16SC2)
+    return cv2.initUndistortRectifyMap(
+        camera_matrix, dist_coeffs, None, new_camera_matrix, out_size, cv2.CV_16SC2)
+
+def rectify_map_cache_path(camera, size, crop=None, cache_dir=MAP_CACHE_DIR):
+    """映射表缓存文件路径，以标定文件内容、相机模型、图像尺寸和裁剪参数的哈希为键"""
+    digest = hashlib.sha1(f"{camera.digest}|{camera.model}|{size[0]}x{size[1]}|{crop}|CV_16SC2".encode())
+    name = os.path.splitext(camera.spec.param_file)[0]
+    return os.path.join(cache_dir, f"{name}_{digest.hexdigest()[:16]}.npz")
+
+def load_rectify_maps(camera_name, size, crop=None, cache_dir=MAP_CACHE_DIR):
+    """读取去畸变映射表，优先使用内存和磁盘缓存，均不存在时计算并写入磁盘"""
+    key = (camera_name, size, crop)
+    if key in _rectify_maps:
+        return _rectify_maps[key]
+
+    camera = load_calibration().camera(camera_name)
+
+    cache_path = rectify_map_cache_path(camera, size, crop, cache_dir)
+    if os.path.exists(cache_path):
+        with np.load(cache_path) as data:
+            _rectify_maps[key] = (data['map1'], data['map2'])
+        return _rectify_maps[key]
+
+    map1, map2 = build_rectify_maps(camera, size, crop)
+
+    # 先写临时文件再重命名（文件名带进程号和线程号），避免并发运行时读到不完整的缓存
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, map1=map1, map2=map2)
+    os.replace(tmp_path, cache_path)
+    print(f"已生成去畸变映射表缓存: {cache_path}")
+    _rectify_maps[key] = (map1, map2)
+    return map1, map2
+
+def parse_crop(crop_size, scale=1.0):
+    """解析形如 1920x1536 的裁剪尺寸，返回 (crop_w, crop_h, scale)"""
+    crop_width, crop_height = (int(v) for v in crop_size.lower().split('x'))
+    if crop_width <= 0 or crop_height <= 0 or scale <= 0:
+        raise ValueError(f"无效的裁剪参数: {crop_size}, scale={scale}")
+    return crop_width, crop_height, float(scale)
+
+def calculate_new_camera_matrix(camera_matrix, size, crop):
+    """计算从图像中心裁剪并缩放后的相机内参矩阵，返回 (新相机矩阵, 输出尺寸)"""
+    fx, fy = camera_matrix[0, 0], camera_matrix[1, 1]
+    cx, cy = camera_matrix[0, 2], camera_matrix[1, 2]
+
+    width, height = size
+    crop_width, crop_height, scale = crop
+    # 计算裁剪边界（从中心开始）
+    left = max(0, int((width - crop_width) / 2))
+    top = max(0, int((height - crop_height) / 2))
+
+    # 新的主点坐标需要减去裁剪的偏移量，缩放以像素中心为基准
+    new_cx = (cx - left + 0.5) * scale - 0.5
+    new_cy = (cy - top + 0.5) * scale - 0.5
+    out_size = (int(round(crop_width * scale)), int(round(crop_height * scale)))
+
+    # 构建新的相机矩阵
+    new_camera_matrix = np.array([
+        [fx * scale, 0, new_cx],
+        [0, fy * scale, new_cy],
         [0, 0, 1]
     ])
-    
-    # 畸变系数 (k1, k2, p1, p2, k3, k4, k5, k6)
-    # OpenCV的鱼眼相机模型使用k1, k2, k3, k4作为畸变系数
-    dist_coeffs = np.array([k1, k2, k3, k4])
-    
-    # 确保输出目录存在
-    os.makedirs(output_dir, exist_ok=True)
-    
-    # 获取输入目录中的所有图像
-    image_files = glob.glob(os.path.join(input_dir, '*.png')) + glob.glob(os.path.join(input_dir, '*.jpg'))
-    
-    # 处理每个图像
-    for image_file in image_files:
-        # 读取图像
-        img = cv2.imread(image_file)
-        if img is None:
-            print(f"无法读取图像: {image_file}")
-            continue
-        
-        # 获取图像尺寸
-        h, w = img.shape[:2]
-        
-        # 计算新的相机矩阵
-        new_camera_matrix = camera_matrix.copy()
-        
-        # 使用OpenCV的鱼眼相机模型进行去畸变
-        map1, map2 = cv2.fisheye.initUndistortRectifyMap(
-            camera_matrix, 
-            dist_coeffs, 
-            np.eye(3), 
-            new_camera_matrix, 
-            (w, h), 
-            cv2.CV_16SC2
-        )
-        undistorted_img = cv2.remap(img, map1, map2, interpolation=cv2.INTER_CUBIC, borderMode=cv2.BORDER_CONSTANT)
-        
-        # 打印去畸变后的图像尺寸
-        # print(f"去畸变后的图像尺寸: {undistorted_img.shape[1]}x{undistorted_img.shape[0]}")
-        
-        # 构建输出文件路径
-        filename = os.path.basename(image_file)
-        output_file = os.path.join(output_dir, filename)
-        
-        # 保存去畸变后的图像
-        cv2.imwrite(output_file, undistorted_img)
-        print(f"已处理: {image_file}")
-
-def crop_image(image, cx, cy, crop_percent=1):
-    """从光学中心裁剪图像"""
-    width=3840
-    height=2160
-    
-    # 计算裁剪区域
-    crop_width = 1920  # 直接指定目标宽度
-    crop_height = 1536  # 直接指定目标高度
-    
-    # 计算裁剪区域的边界（从中心开始）
-    left = int((width - crop_width) / 2)
-    right = left + crop_width
-    top = int((height - crop_height) / 2)
-    bottom = top + crop_height
-    
-    # 裁剪图像
-    cropped = image[top:bottom, left:right]
-    # print(f"\n裁剪后的图像尺寸: {cropped.shape[1]}x{cropped.shape[0]}")
-    return cropped
-
-def calculate_new_camera_matrix(params, input_dir, crop_percent=1):
-    """计算裁剪后的相机内参矩阵"""
-    fx = params.get('FX')
-    fy = params.get('FY')
-    cx = params.get('CX')
-    cy = params.get('CY')
-    
-    # 读取一张图片来获取尺寸，支持jpg和png格式
-    input_path = Path(input_dir)
-    sample_image = next(chain(input_path.glob("*.jpg"), input_path.glob("*.png")), None)
-    if sample_image:
-        image = cv2.imread(str(sample_image))
-        if image is not None:
-            width=3840
-            height=2160
-
-            
-            # 计算裁剪区域
-            crop_width = width-1920
-            crop_height = height-1536
-            # 计算裁剪边界
-            left = max(0, int(crop_width/2))
-            top = max(0, int(crop_height/2))
-            
-            # 计算裁剪后的主点坐标
-            # 新的主点坐标需要减去裁剪的偏移量
-            new_cx = cx - left  # left是裁剪的起始x坐标
-            new_cy = cy - top   # top是裁剪的起始y坐标
-            print(f"新的主点坐标: {new_cx}, {new_cy}")
-            # 构建原始相机矩阵
-            camera_matrix = np.array([
-                [fx, 0, cx],
-                [0, fy, cy],
-                [0, 0, 1]
-            ])
-            
-            # 构建新的相机矩阵
-            new_camera_matrix = np.array([
-                [fx, 0, new_cx],
-                [0, fy, new_cy],
-                [0, 0, 1]
-            ])
-            
-            return camera_matrix, new_camera_matrix
-    
-    return None, None
 
-def process_fisheye_camera(param_file, input_dir, output_dir):
-    try:
-        print(f'开始处理camera: {input_dir}中的图片')
-        undistort_fisheye_images(param_file, input_dir, output_dir)
-        print(f"所有图像已处理完成并保存到 {output_dir} 目录")
-    except Exception as e:
-        print(f"处理出错: {e}")
+    return new_camera_matrix, out_size
 
-def undistort_pinhole_image(image_path, params, input_dir):
-    # 读取图像
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"无法读取图像: {image_path}")
+def list_image_files(input_dir):
+    """获取输入目录中的所有图像"""
+    return sorted(glob.glob(os.path.join(input_dir, '*.png')) + glob.glob(os.path.join(input_dir, '*.jpg')))
+
+def output_image_path(output_dir, image_path, output_format=None):
+    """构建输出文件路径，指定输出格式时替换扩展名"""
+    filename = os.path.basename(image_path)
+    if output_format is not None:
+        filename = f"{os.path.splitext(filename)[0]}.{output_format}"
+    return os.path.join(output_dir, filename)
 
+def build_encode_params(output_path, png_compression=None, quality=None, fast_lossless=False):
+    """根据输出文件格式生成 cv2.imwrite 的编码参数"""
+    ext = os.path.splitext(output_path)[1].lower().lstrip('.')
+    params = []
+    if ext == 'png':
+        # 无损快速模式使用最低压缩级别，编码速度最快
+        level = 1 if fast_lossless else png_compression
+        if level is not None:
+            params += [cv2.IMWRITE_PNG_COMPRESSION, level]
+    elif ext in ('jpg', 'jpeg'):
+        if fast_lossless:
+            raise ValueError("JPEG 不支持无损模式")
+        if quality is not None:
+            params += [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif ext == 'webp':
+        # OpenCV 中 WebP 质量大于 100 时为无损编码
+        webp_quality = 101 if fast_lossless else quality
+        if webp_quality is not None:
+            params += [cv2.IMWRITE_WEBP_QUALITY, webp_quality]
+    return tuple(params)
+
+def remap_image(img, camera_name, model, crop=None, interpolation=None):
+    """使用缓存的映射表对图像去畸变（可同时裁剪缩放）"""
     # 获取原始图像尺寸
     h, w = img.shape[:2]
-    
-    # 构建相机矩阵
-    camera_matrix = np.array([
-        [params['FX'], 0, params['CX']],
-        [0, params['FY'], params['CY']],
-        [0, 0, 1]
-    ])
-    
-    # 构建畸变系数
-    dist_coeffs = np.array([
-        params['K1'], params['K2'], params['P1'], params['P2'],
-        params['K3'], params['K4'], params['K5'], params['K6']
-    ])
-    
-    # 去畸变
-    undistorted_img = cv2.undistort(img, camera_matrix, dist_coeffs)
-        
-    return undistorted_img, camera_matrix
 
-def process_pinhole_image(param_file, input_dir, output_dir):
+    # 默认鱼眼相机使用三次插值，针孔相机与 cv2.undistort 一致使用线性插值
+    map1, map2 = load_rectify_maps(camera_name, (w, h), crop)
+    if interpolation is None:
+        interpolation = 'cubic' if model == 'fisheye' else 'linear'
+    interpolation = INTERPOLATIONS[interpolation]
+    return cv2.remap(img, map1, map2, interpolation=interpolation, borderMode=cv2.BORDER_CONSTANT)
+
+def write_image(output_path, img, encode_params=()):
+    """按编码参数保存图像，并删除同一帧以其他格式保存的旧输出"""
+    if not cv2.imwrite(output_path, img, list(encode_params)):
+        raise ValueError(f"无法保存图像: {output_path}")
+    remove_stale_outputs(output_path)
+
+def remove_stale_outputs(output_path):
+    """更换 --format 后删除之前以其他格式生成的同名图像，避免打包时同一帧出现两份"""
+    base, ext = os.path.splitext(output_path)
+    for output_format in OUTPUT_FORMATS:
+        if f".{output_format}" != ext.lower():
+            try:
+                os.remove(f"{base}.{output_format}")
+            except FileNotFoundError:
+                pass
+
+def image_camera(image_path):
+    """图像所属的相机，即所在文件夹名，用于按相机统计耗时"""
+    return os.path.basename(os.path.dirname(image_path))
+
+def undistort_image(image_path, camera_name, model, output_path, crop=None, interpolation=None, encode_params=(),
+                    stats=None):
+    """对单帧图像去畸变（可同时裁剪缩放）并保存，指定 stats 时按相机记录读取解码、重映射和编码写入的耗时"""
+    stats = stats or Stats()
+    camera = image_camera(image_path)
+    with stats.timer(f"read.{camera}"):
+        img = cv2.imread(image_path)
+    if img is None:
+        raise ValueError(f"无法读取图像: {image_path}")
+    with stats.timer(f"remap.{camera}"):
+        undistorted_img = remap_image(img, camera_name, model, crop, interpolation)
+    with stats.timer(f"encode.{camera}"):
+        write_image(output_path, undistorted_img, encode_params)
+    stats.count('images')
+    stats.count('bytes_in', os.path.getsize(image_path))
+    stats.count('bytes_out', os.path.getsize(output_path))
+
+def _undistort_job(job):
+    """进程池任务，返回 (图像路径, 统计, 错误信息)"""
+    stats = Stats()
+    try:
+        undistort_image(*job, stats=stats)
+        return job[0], stats.to_dict(), None
+    except Exception as e:
+        return job[0], stats.to_dict(), str(e)
+
+def undistort_progress(jobs, stats):
+    return Progress(len(jobs), "去畸变", stats, {'MB/秒': ('bytes_in', 2**-20)})
+
+def build_undistort_jobs(input_dirs, output_dirs, front_crop=None, interpolation=None,
+                         output_format=None, codec_options=None, frames=None):
+    """生成所有相机的 (相机, 帧) 任务列表，并预先加载每个相机的映射表
+
+    input_dirs 的文件夹名即相机名，相机模型和标定分辨率取自 calibration 中的 CAMERA_SPECS。
+    指定 frames（时间戳列表）时只处理文件名在其中的图像。
+    """
+    frames = set(frames) if frames is not None else None
+    calibration = load_calibration()
+    jobs = []
+    for input_dir, output_dir in zip(input_dirs, output_dirs):
+        os.makedirs(output_dir, exist_ok=True)
+        camera = calibration.camera(os.path.basename(os.path.normpath(input_dir)))
+        crop = front_crop if camera.name == CROP_CAMERA else None
+        image_files = list_image_files(input_dir)
+        if frames is not None:
+            image_files = [f for f in image_files if os.path.splitext(os.path.basename(f))[0] in frames]
+        if not image_files:
+            print(f"未找到图像: {input_dir}")
+            continue
+        # 在主进程中预先加载映射表，子进程直接继承或从磁盘缓存读取，不再重复计算
+        sample = cv2.imread(image_files[0])
+        if sample is not None:
+            size = (sample.shape[1], sample.shape[0])
+            if size != camera.size:
+                print(f"⚠️ {camera.name} 的图像尺寸 {size[0]}x{size[1]} 与标定分辨率 "
+                      f"{camera.size[0]}x{camera.size[1]} 不一致")
+            load_rectify_maps(camera.name, size, crop)
+        for image_path in image_files:
+            output_path = output_image_path(output_dir, image_path, output_format)
+            encode_params = build_encode_params(output_path, **(codec_options or {}))
+            jobs.append((image_path, camera.name, camera.model, output_path, crop, interpolation, encode_params))
+    return jobs
+
+def undistort_sequential(jobs, verbose=False, stats=None):
+    """在当前进程中逐帧去畸变，返回失败的帧；默认只显示进度条，verbose=True 时逐帧打印"""
+    stats = stats if stats is not None else Stats()
+    progress = None if verbose else undistort_progress(jobs, stats)
+    failures = []
+    for job in jobs:
+        image_path, job_stats, error = _undistort_job(job)
+        stats.merge(job_stats)
+        if error is not None:
+            failures.append((image_path, error))
+            print(f"\n处理图像 {image_path} 时出错: {error}")
+        elif verbose:
+            print(f"已处理: {image_path}")
+        if progress is not None:
+            progress.update()
+    if progress is not None:
+        progress.close()
+    return failures
+
+def undistort_parallel(jobs, workers, stats=None):
+    """将 (相机, 帧) 任务分发到进程池中并行去畸变，返回失败的帧"""
+    stats = stats if stats is not None else Stats()
+    progress = undistort_progress(jobs, stats)
+    # 分块提交任务，降低进程间通信开销
+    chunksize = max(1, len(jobs) // (workers * 4))
+    failures = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for image_path, job_stats, error in executor.map(_undistort_job, jobs, chunksize=chunksize):
+            stats.merge(job_stats)
+            if error is not None:
+                failures.append((image_path, error))
+                print(f"\n处理图像 {image_path} 时出错: {error}")
+            progress.update()
+    progress.close()
+
+    print(f"并行去畸变完成: 共 {len(jobs)} 帧，失败 {len(failures)} 帧")
+    return failures
+
+def undistort_pipelined(jobs, io_threads, queue_size=None, stats=None):
+    """读取、去畸变、编码三级流水线处理，返回失败的帧
+
+    读取和编码分别在线程池中进行（OpenCV 在解码、编码时会释放 GIL），
+    去畸变在主线程中按顺序进行。两端的在途任务数都不超过 queue_size，内存占用保持稳定。
+    线程中的耗时随结果返回，统计只在主线程中更新。
+    """
+    stats = stats if stats is not None else Stats()
+    progress = undistort_progress(jobs, stats)
+    queue_size = queue_size or 2 * io_threads
+    failures = []
+    pending_reads = deque()
+    pending_writes = deque()
+    job_iter = iter(jobs)
+
+    def finish_write(job, future):
+        image_path, output_path = job[0], job[3]
         try:
-            params = read_camera_parameters(param_file)
-            image_files = glob.glob(os.path.join(input_dir, '*.jpg'))+glob.glob(os.path.join(input_dir, '*.png'))
-            # 处理所有图片
-            for image_path in image_files:
-                try:
-                    cropped_img, new_camera_matrix = undistort_pinhole_image(image_path, params,input_dir)
-                    # 获取原始文件名
-
-                    filename = os.path.basename(image_path)
-                    # 构建输出文件路径
-                    output_path = os.path.join(output_dir, f'{filename}')
-                    # 保存处理后的图片
-                    cv2.imwrite(output_path, cropped_img)
-                    print(f"已处理: {image_path}")
-
-
-                except Exception as e:
-                    print(f"处理图像 {image_path} 时出错: {str(e)}")
-            print(f"所有图像已处理完成并保存到 {output_dir} 目录")
+            _, seconds = future.result()
+            stats.add_time(f"encode.{image_camera(image_path)}", seconds)
+            stats.count('images')
+            stats.count('bytes_in', os.path.getsize(image_path))
+            stats.count('bytes_out', os.path.getsize(output_path))
         except Exception as e:
-            print(f"处理图像时出错: {str(e)}")
+            failures.append((image_path, str(e)))
+            print(f"\n处理图像 {image_path} 时出错: {e}")
+        progress.update()
+
+    with ThreadPoolExecutor(max_workers=io_threads) as readers, ThreadPoolExecutor(max_workers=io_threads) as writers:
+        while True:
+            # 预读取后续帧，直到在途读取任务达到上限
+            while len(pending_reads) < queue_size:
+                job = next(job_iter, None)
+                if job is None:
+                    break
+                pending_reads.append((job, readers.submit(timed, cv2.imread, job[0])))
+            if not pending_reads:
+                break
+
+            job, future = pending_reads.popleft()
+            image_path, camera_name, model, output_path, crop, interpolation, encode_params = job
+            camera = image_camera(image_path)
+            try:
+                img, seconds = future.result()
+                stats.add_time(f"read.{camera}", seconds)
+                if img is None:
+                    raise ValueError(f"无法读取图像: {image_path}")
+                with stats.timer(f"remap.{camera}"):
+                    undistorted_img = remap_image(img, camera_name, model, crop, interpolation)
+            except Exception as e:
+                failures.append((image_path, str(e)))
+                print(f"\n处理图像 {image_path} 时出错: {e}")
+                progress.update()
+                continue
+
+            pending_writes.append((job, writers.submit(timed, write_image, output_path, undistorted_img, encode_params)))
+            # 编码积压过多时等待最早的任务完成
+            while len(pending_writes) > queue_size:
+                finish_write(*pending_writes.popleft())
+
+        while pending_writes:
+            finish_write(*pending_writes.popleft())
+    progress.close()
+
+    print(f"流水线去畸变完成: 共 {len(jobs)} 帧，失败 {len(failures)} 帧")
+    return failures
 
+def scene_undistort_jobs(scene_dir, front_crop=None, interpolation=None, output_format=None, codec_options=None,
+                         frames=None):
+    """生成一个场景所有相机的去畸变任务，指定 frames 时只包含这些帧"""
+    input_dirs = [os.path.join(scene_dir, camera) for camera in CAMERAS]
+    output_dirs = [os.path.join(scene_dir, output_dir) for output_dir in OUTPUT_DIRS]
+    return build_undistort_jobs(input_dirs, output_dirs, front_crop, interpolation, output_format, codec_options,
+                                frames)
+
+def undistort_manifest(scene_dir, front_crop=None, interpolation=None, codec_options=None):
+    """打开场景的 undistort 阶段构建记录，标定参数或处理参数变化时所有帧都需要重新处理"""
+    # 只有实际指定的编码参数参与哈希；png_compression=0 等取值为 0 的参数同样是有效配置，只跳过 None 和未开启的开关
+    codec = {key: value for key, value in (codec_options or {}).items() if value is not None and value is not False}
+    return Manifest(scene_dir, 'undistort', config_hash(PARAM_FILES, front_crop=front_crop,
+                                                        interpolation=interpolation, codec=codec))
+
+def undistort_scene(scene_dir, workers=1, io_threads=0, front_crop=None, interpolation=None, output_format=None,
+                    codec_options=None, force=False, verbose=False, frames=None):
+    """对一个场景的所有相机去畸变，返回失败的帧，指定 frames（时间戳列表）时只处理这些帧
+
+    构建记录中已是最新的帧会被跳过（force=True 时全部重新处理）。workers 大于 1 时使用进程池，
+    否则 io_threads 大于 0 时使用单进程流水线。各相机的分步耗时写入 reports/undistort.json。
+    """
+    with stage_report(scene_dir, 'undistort') as stats:
+        with stats.timer('prepare'):
+            jobs = scene_undistort_jobs(scene_dir, front_crop, interpolation, output_format, codec_options, frames)
+        manifest = undistort_manifest(scene_dir, front_crop, interpolation, codec_options)
+        if not force:
+            with stats.timer('manifest'):
+                pending = [job for job in jobs if not manifest.is_fresh(job[3], [job[0]], [job[3]])]
+            print(f"共 {len(jobs)} 帧，跳过已是最新的 {len(jobs) - len(pending)} 帧")
+            jobs = pending
+
+        if workers > 1:
+            failures = undistort_parallel(jobs, workers, stats)
+        elif io_threads > 0:
+            failures = undistort_pipelined(jobs, io_threads, stats=stats)
+        else:
+            failures = undistort_sequential(jobs, verbose, stats)
+
+        failed = {image_path for image_path, _ in failures}
+        for job in jobs:
+            if job[0] not in failed:
+                manifest.record(job[3], [job[0]], [job[3]])
+        manifest.close()
+    return failures
+
+def write_camera_config(scene_dir, front_crop=None, force=False, frames=None):
+    """生成相机内外参配置，并为每一帧点云写入对应的 camera_config/<帧>.json
+
+    配置只在内存中构建，不再经过共享的 utils/camera_config.json，多个场景可以同时生成。
+    指定 frames 时只为这些帧生成，否则为 lidar_point_cloud_0 中的所有帧生成。
+    """
+    camera_config = build_camera_config(front_crop)
+    generate_camera_config_dir(camera_config, scene_dir, force, frames)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="图像去畸变以及保存内参外参配置文件")
     parser.add_argument('--path', type=str, required=True, help='场景路径，例如 scene_1')
+    parser.add_argument('--workers', type=int, default=1, help='并行处理的进程数，默认为 1（串行）')
+    parser.add_argument('--front-crop', type=str, nargs='?', const=FRONT_8M_CROP, default=None,
+                        help=f'CAM_FRONT_8M 去畸变后从中心裁剪的尺寸，例如 {FRONT_8M_CROP}，不指定则输出原始分辨率')
+    parser.add_argument('--front-scale', type=float, default=1.0, help='CAM_FRONT_8M 裁剪后的缩放比例，例如 0.5')
+    parser.add_argument('--interpolation', type=str, choices=list(INTERPOLATIONS), default=None,
+                        help='重映射插值方式，默认鱼眼相机为 cubic，针孔相机为 linear')
+    parser.add_argument('--io-threads', type=int, default=0,
+                        help='单进程流水线模式下读取和编码线程数，默认为 0（不使用流水线）')
+    parser.add_argument('--format', type=str, choices=OUTPUT_FORMATS, default=None,
+                        help='输出图像格式，默认与输入图像一致')
+    parser.add_argument('--png-compression', type=int, choices=range(10), default=None,
+                        help='PNG 压缩级别 0-9，默认使用 OpenCV 的默认值')
+    parser.add_argument('--quality', type=int, default=None, help='JPEG/WebP 编码质量 1-100')
+    parser.add_argument('--fast-lossless', action='store_true',
+                        help='无损快速模式：PNG 使用最低压缩级别，WebP 使用无损编码')
+    parser.add_argument('--force', action='store_true', help='重新处理所有帧，不跳过构建记录中已是最新的结果')
+    parser.add_argument('--verbose', action='store_true', help='单进程时逐帧打印处理信息，默认只显示进度条')
+    parser.add_argument('--keyframes', action='store_true', help='只处理 keyframes.csv 中选中的关键帧')
     args = parser.parse_args()
-    scene_dir = args.path
-    param_files = ["utils/Parameters/pinhole-front.txt","utils/Parameters/fisheye-front.txt", 
-                   "utils/Parameters/fisheye-left.txt", "utils/Parameters/fisheye-right.txt", "utils/Parameters/pinhole-back.txt"]
-    input_dirs = [f"{scene_dir}/CAM_FRONT_8M",f"{scene_dir}/CAM_FRONT_3M",
-                   f"{scene_dir}/CAM_LEFT_3M", f"{scene_dir}/CAM_RIGHT_3M", 
-                  f"{scene_dir}/CAM_BACK_3MH" ]
-    output_dirs = [f"{scene_dir}/camera_image_0", f"{scene_dir}/camera_image_1", f"{scene_dir}/camera_image_2",
-                   f"{scene_dir}/camera_image_3", f"{scene_dir}/camera_image_4"]
-    
-    for param_file, input_dir, output_dir in zip(param_files, input_dirs, output_dirs):
-        # 创建输出目录
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-        if input_dir==f"{scene_dir}/CAM_BACK_3MH" or input_dir==f"{scene_dir}/CAM_FRONT_8M":
-            process_pinhole_image(param_file, input_dir, output_dir)
-        else:
-            process_fisheye_camera(param_file, input_dir, output_dir)
-
-    camera_config_path = "utils/camera_config.json"
-    update_camera_config(camera_config_path, param_files, input_dirs)
-    generate_camera_config_dir(camera_config_path)
+    if args.format == 'jpg' and args.fast_lossless:
+        parser.error("JPEG 不支持无损模式，请使用 --format png 或 webp")
+    front_crop = parse_crop(args.front_crop, args.front_scale) if args.front_crop else None
+    codec_options = dict(png_compression=args.png_compression, quality=args.quality, fast_lossless=args.fast_lossless)
+    frames = None
+    if args.keyframes:
+        from keyframes import scene_keyframes
+        frames = scene_keyframes(args.path)
+    undistort_scene(args.path, args.workers, args.io_threads, front_crop, args.interpolation, args.format,
+                    codec_options, args.force, args.verbose, frames)
+    write_camera_config(args.path, front_crop, args.force, frames)
     
     print("\n处理完所有图片")